@@ -21,6 +21,7 @@ designed with the following goals in mind:
 
 import inspect
 import json
+import math
 import os
 import platform
 import shutil
@@ -31,6 +32,7 @@ from pathlib import Path
 import pytest
 
 import host_tools.cargo_build as build_tools
+import host_tools.drive as drive_tools
 from framework import defs, utils
 from framework.artifacts import disks, kernel_params
 from framework.defs import DEFAULT_BINARY_DIR
@@ -42,7 +44,7 @@ from framework.utils_cpu_templates import (
     static_cpu_templates_params,
 )
 from host_tools.metrics import get_metrics_logger
-from host_tools.network import NetNs
+from host_tools.network import NetNsPool
 
 # This codebase uses Python features available in Python 3.10 or above
 if sys.version_info < (3, 10):
@@ -66,6 +68,24 @@ def pytest_addoption(parser):
         help="use firecracker/jailer binaries from this directory instead of compiling from source",
     )
 
+    parser.addoption(
+        "--ab-binary-dirs",
+        action="store",
+        nargs=2,
+        metavar=("A_DIR", "B_DIR"),
+        help="run every test that uses microvm_factory twice, once with the firecracker/jailer binaries from each "
+        "directory, interleaved in ABBA order",
+    )
+
+    parser.addoption(
+        "--ab-rounds",
+        action="store",
+        type=int,
+        default=1,
+        help="the number of rounds a sequential A/B-test is split into. Performance tests "
+        "using the perf_iterations fixture only do their share of iterations in each",
+    )
+
     parser.addoption(
         "--custom-cpu-template",
         action="store",
@@ -75,6 +95,56 @@ def pytest_addoption(parser):
     )
 
 
+def pytest_generate_tests(metafunc):
+    """Pytest hook. Run tests building microVMs once per A/B revision if requested."""
+    if (
+        metafunc.config.getoption("--ab-binary-dirs")
+        and "ab_revision" in metafunc.fixturenames
+    ):
+        metafunc.parametrize("ab_revision", ["A", "B"])
+
+
+def pytest_collection_modifyitems(items):
+    """Pytest hook. Interleave the A and B runs of each test in ABBA order.
+
+    This way, drift of the host over the course of the session (e.g. thermal
+    effects, or noisy neighbours) affects both revisions equally, instead of
+    ending up in their difference.
+    """
+    pairs = {}
+    for item in items:
+        callspec = getattr(item, "callspec", None)
+        if callspec is None or "ab_revision" not in callspec.params:
+            continue
+        other_params = tuple(
+            sorted(
+                (name, repr(value))
+                for name, value in callspec.params.items()
+                if name != "ab_revision"
+            )
+        )
+        pairs.setdefault((item.path, item.originalname, other_params), []).append(item)
+
+    if not pairs:
+        return
+
+    item_pair = {item: pair for pair in pairs.values() for item in pair}
+    reordered = []
+    nr_pairs = 0
+    for item in items:
+        if item not in item_pair:
+            reordered.append(item)
+        elif item is item_pair[item][0]:
+            pair = sorted(
+                item_pair[item], key=lambda x: x.callspec.params["ab_revision"]
+            )
+            if nr_pairs % 2:
+                pair.reverse()
+            reordered.extend(pair)
+            nr_pairs += 1
+    items[:] = reordered
+
+
 def pytest_report_header():
     """Pytest hook to print relevant metadata in the logs"""
     return f"EC2 AMI: {global_props.ami}"
@@ -224,6 +294,20 @@ def test_fc_session_root_path():
     yield fc_session_root_path
 
 
+@pytest.fixture(scope="session")
+def perf_iterations(request):
+    """Scale the number of iterations of a performance test down to a single round of a sequential A/B-test"""
+    rounds = request.config.getoption("--ab-rounds")
+    return lambda iterations: max(math.ceil(iterations / rounds), 1)
+
+
+@pytest.fixture(autouse=True, scope="session")
+def drive_factory():
+    """Remove all scratch drives created during the session, and their cached images"""
+    yield drive_tools.DRIVE_FACTORY
+    drive_tools.DRIVE_FACTORY.cleanup()
+
+
 @pytest.fixture(scope="session")
 def bin_vsock_path(test_fc_session_root_path):
     """Build a simple vsock client/server application."""
@@ -281,42 +365,31 @@ def netns_factory(worker_id):
 
     Network namespaces are created once per test session and re-used in subsequent tests.
     """
-    # pylint:disable=protected-access
-
-    class NetNsFactory:
-        """A Network namespace factory that reuses namespaces."""
+    pool = NetNsPool(f"netns-{worker_id}-")
+    yield pool.get
+    pool.close()
 
-        def __init__(self, prefix: str):
-            self._all = []
-            self._returned = []
-            self.prefix = prefix
 
-        def get(self, _netns_id):
-            """Get a free network namespace"""
-            if len(self._returned) > 0:
-                ns = self._returned.pop(0)
-                while ns.is_used():
-                    pass
-                return ns
-            ns = NetNs(self.prefix + str(len(self._all)))
-            # change the cleanup function so it is returned to the pool
-            ns._cleanup_orig = ns.cleanup
-            ns.cleanup = lambda: self._returned.append(ns)
-            self._all.append(ns)
-            return ns
-
-    netns_fcty = NetNsFactory(f"netns-{worker_id}-")
-    yield netns_fcty.get
+@pytest.fixture()
+def ab_revision():
+    """The A/B revision whose binaries the microvm_factory uses, if run with --ab-binary-dirs
 
-    for netns in netns_fcty._all:
-        netns._cleanup_orig()
+    Parametrized by `pytest_generate_tests`.
+    """
+    return None
 
 
 @pytest.fixture()
-def microvm_factory(request, record_property, results_dir, netns_factory):
+def microvm_factory(request, record_property, results_dir, netns_factory, ab_revision):
     """Fixture to create microvms simply."""
 
-    binary_dir = request.config.getoption("--binary-dir") or DEFAULT_BINARY_DIR
+    if ab_revision is not None:
+        binary_dirs = dict(zip("AB", request.config.getoption("--ab-binary-dirs")))
+        binary_dir = binary_dirs[ab_revision]
+        # Tags the EMF records of this test with the revision
+        record_property("ab_revision", ab_revision)
+    else:
+        binary_dir = request.config.getoption("--binary-dir") or DEFAULT_BINARY_DIR
     if isinstance(binary_dir, str):
         binary_dir = Path(binary_dir)
 
@@ -21,11 +21,11 @@ while still preventing the latter: We run cargo audit twice, once on main HEAD,
 of both invocations is the same, the test passes (with us being alerted to this situtation via a special pipeline that
 does not block PRs). If not, it fails, preventing PRs from introducing new vulnerable dependencies.
 """
-import statistics
 from pathlib import Path
 from tempfile import TemporaryDirectory
 from typing import Callable, List, Optional, TypeVar
 
+import numpy as np
 import scipy
 
 from framework import utils
@@ -171,7 +171,11 @@ def set_did_not_grow_comparator(
 
 
 def check_regression(
-    a_samples: List[float], b_samples: List[float], *, n_resamples: int = 9999
+    a_samples: List[float],
+    b_samples: List[float],
+    *,
+    n_resamples: int = 9999,
+    seed: Optional[int] = None,
 ):
     """Checks for a regression by performing a permutation test. A permutation test is a non-parametric test that takes
     three parameters: Two populations (sets of samples) and a function computing a "statistic" based on two populations.
@@ -186,16 +190,39 @@ def check_regression(
     the statistic for the initial populations will be somewhere "in the middle").
 
     Useful for performance tests.
+
+    The statistic is vectorized, meaning scipy evaluates it on whole batches of permutations at once (as a matrix with
+    one permutation per row) instead of calling into Python once per permutation. Passing a `seed` makes the
+    result reproducible.
     """
     return scipy.stats.permutation_test(
         (a_samples, b_samples),
         # Compute the difference of means, such that a positive different indicates potential for regression.
-        lambda x, y: statistics.mean(y) - statistics.mean(x),
-        vectorized=False,
+        lambda x, y, axis: np.mean(y, axis=axis) - np.mean(x, axis=axis),
+        vectorized=True,
         n_resamples=n_resamples,
+        random_state=seed,
     )
 
 
+def check_equivalence(
+    a_samples: List[float], b_samples: List[float], margin: float, *, alpha: float
+) -> bool:
+    """Checks whether the means of the two populations differ by less than `margin`, by performing two one-sided
+    t-tests (TOST) at significance level `alpha`. This is the case if and only if the (1 - 2 * alpha) confidence
+    interval of the difference of means lies entirely within (-margin, margin).
+
+    Where `check_regression` can only ever tell us that there is a change, this can tell us that there is none (of
+    relevant magnitude), which is what allows A/B-tests to stop early on unchanged metrics.
+    """
+    if len(a_samples) < 2 or len(b_samples) < 2:
+        return False
+
+    result = scipy.stats.ttest_ind(b_samples, a_samples, equal_var=False)
+    low, high = result.confidence_interval(1 - 2 * alpha)
+    return -margin < low and high < margin
+
+
 @with_filelock
 def git_clone(clone_path, commitish):
     """Clone the repository at `commit`.
@@ -0,0 +1,161 @@
+# Copyright 2025 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+"""A load generator for the Firecracker API server.
+
+Drives a weighted mix of API requests over a number of persistent
+connections (each with a number of requests in flight), either as fast as
+the server answers (closed loop) or at a fixed total rate. Latencies are
+measured on the client side, per endpoint.
+"""
+
+import asyncio
+import json
+import random
+import time
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+
+from framework.http_api import AsyncApiConnection, LatencyHistogram
+
+# micro-http accepts at most 10 connections, one of which we leave to `Api`
+MAX_API_CONNECTIONS = 9
+
+
+@dataclass(frozen=True)
+class ApiOp:
+    """A kind of request in a workload, picked with probability proportional to `weight`"""
+
+    method: str
+    path: str
+    body: object = None
+    weight: int = 1
+
+
+MMDS_DATA = {
+    "latest": {
+        "meta-data": {f"key-{i}": "x" * 32 for i in range(16)},
+        "user-data": "y" * 512,
+    }
+}
+
+WORKLOADS = {
+    # Populating and updating MMDS, like an orchestrator pushing instance metadata
+    "mmds": [
+        ApiOp("PUT", "/mmds", MMDS_DATA),
+        ApiOp("PATCH", "/mmds", {"latest": {"user-data": "z" * 512}}, weight=4),
+        ApiOp("GET", "/mmds", weight=4),
+    ],
+    # Polling the state of a running microVM
+    "poll": [
+        ApiOp("GET", "/balloon/statistics", weight=4),
+        ApiOp("GET", "/mmds", weight=2),
+        ApiOp("GET", "/machine-config"),
+        ApiOp("GET", "/vm/config"),
+    ],
+    # Everything at once, including metrics flushes and balloon updates
+    "mixed": [
+        ApiOp("GET", "/balloon/statistics", weight=4),
+        ApiOp("PATCH", "/balloon", {"amount_mib": 0}),
+        ApiOp("GET", "/mmds", weight=4),
+        ApiOp("PATCH", "/mmds", {"latest": {"user-data": "z" * 512}}, weight=2),
+        ApiOp("GET", "/machine-config"),
+        ApiOp("GET", "/vm/config"),
+        ApiOp("PUT", "/actions", {"action_type": "FlushMetrics"}),
+    ],
+}
+
+
+@dataclass
+class LoadResult:
+    """Latencies and errors of the requests made by `generate_load`"""
+
+    duration_s: float
+    latencies: dict = field(default_factory=lambda: defaultdict(LatencyHistogram))
+    errors: Counter = field(default_factory=Counter)
+
+    @property
+    def requests(self):
+        """Total number of requests made"""
+        return sum(len(histogram) for histogram in self.latencies.values())
+
+    @property
+    def throughput(self):
+        """Requests per second"""
+        return self.requests / self.duration_s
+
+    def overall(self):
+        """Latencies of all requests, irrespective of endpoint"""
+        merged = LatencyHistogram()
+        for histogram in self.latencies.values():
+            merged.merge(histogram)
+        return merged
+
+
+def _encode_body(body):
+    if body is None:
+        return None
+    return json.dumps(body, separators=(",", ":")).encode()
+
+
+async def _requester(conn, ops, bodies, rng, deadline, interval_s):
+    """Make requests on `conn` until `deadline`, every `interval_s` seconds if given"""
+    weights = [op.weight for op in ops]
+    next_send = time.monotonic()
+    while (now := time.monotonic()) < deadline:
+        if interval_s is not None:
+            if next_send > now:
+                await asyncio.sleep(next_send - now)
+            next_send += interval_s
+        [idx] = rng.choices(range(len(ops)), weights)
+        await conn.request(ops[idx].method, ops[idx].path, bodies[idx])
+
+
+async def generate_load(
+    socket_path,
+    ops,
+    *,
+    duration_s,
+    connections=1,
+    depth=1,
+    rate=None,
+    seed=0,
+):
+    """Make requests from `ops` for `duration_s` seconds.
+
+    There are `connections` connections with up to `depth` requests in flight
+    each. If `rate` is given, requests are sent at a total of `rate` per
+    second, otherwise each one is sent as soon as the previous one on the
+    same slot was answered.
+    """
+    assert connections <= MAX_API_CONNECTIONS, "micro-http would reject connections"
+    # Encode bodies upfront, so the client does as little work as possible per request
+    bodies = [_encode_body(op.body) for op in ops]
+    interval_s = None if rate is None else connections * depth / rate
+    conns = [await AsyncApiConnection.open(socket_path) for _ in range(connections)]
+
+    start = time.monotonic()
+    deadline = start + duration_s
+    slots = [conn for conn in conns for _ in range(depth)]
+    rngs = [random.Random(seed + i) for i in range(len(slots))]
+    try:
+        await asyncio.gather(
+            *(
+                _requester(conn, ops, bodies, rng, deadline, interval_s)
+                for conn, rng in zip(slots, rngs)
+            )
+        )
+    finally:
+        for conn in conns:
+            await conn.close()
+
+    result = LoadResult(duration_s=time.monotonic() - start)
+    for conn in conns:
+        for endpoint, histogram in conn.latencies.items():
+            result.latencies[endpoint].merge(histogram)
+        result.errors.update(conn.errors)
+    return result
+
+
+def run_load(socket_path, ops, **kwargs):
+    """Synchronous wrapper around `generate_load`"""
+    return asyncio.run(generate_load(socket_path, ops, **kwargs))
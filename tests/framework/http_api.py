@@ -3,7 +3,14 @@
 
 """A simple HTTP client for the Firecracker API"""
 
+import asyncio
+import json
+import math
+import socket
+import time
 import urllib
+from collections import Counter, defaultdict, deque
+from dataclasses import dataclass
 from http import HTTPStatus
 
 import requests
@@ -132,3 +139,293 @@ class Api:
         self.snapshot_load = Resource(self, "/snapshot/load")
         self.cpu_config = Resource(self, "/cpu-config")
         self.entropy = Resource(self, "/entropy")
+
+
+class LatencyHistogram:
+    """A histogram of latencies with bounded relative error, in the spirit of HdrHistogram.
+
+    Values (in nanoseconds) are counted in log-linear buckets: exactly below
+    `2**SUB_BUCKET_BITS`, and with a relative error of at most
+    `2**-(SUB_BUCKET_BITS - 1)` above that. Recording is O(1) and memory
+    usage only depends on the range of the values, not on their number.
+    """
+
+    SUB_BUCKET_BITS = 7
+
+    def __init__(self):
+        self.counts = Counter()
+        self.count = 0
+        self.total = 0
+        self.min = math.inf
+        self.max = 0
+
+    @classmethod
+    def _index(cls, value):
+        """Index of the bucket `value` falls into"""
+        shift = value.bit_length() - cls.SUB_BUCKET_BITS
+        if shift <= 0:
+            return value
+        half = 1 << (cls.SUB_BUCKET_BITS - 1)
+        return (shift + 1) * half + (value >> shift) - half
+
+    @classmethod
+    def _value(cls, index):
+        """Smallest value counted in the bucket at `index`"""
+        half = 1 << (cls.SUB_BUCKET_BITS - 1)
+        if index < 2 * half:
+            return index
+        shift, offset = divmod(index - 2 * half, half)
+        return (half + offset) << (shift + 1)
+
+    def record(self, value_ns: int):
+        """Count one latency of `value_ns` nanoseconds"""
+        self.counts[self._index(value_ns)] += 1
+        self.count += 1
+        self.total += value_ns
+        self.min = min(self.min, value_ns)
+        self.max = max(self.max, value_ns)
+
+    def merge(self, other):
+        """Add all values counted by `other` to this histogram"""
+        self.counts.update(other.counts)
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def mean(self):
+        """Mean of all values, in nanoseconds"""
+        return self.total / self.count
+
+    def percentile(self, q: float):
+        """The value (in nanoseconds) below which `q` percent of the values lie"""
+        assert self.count, "Percentile of empty histogram"
+        rank = max(math.ceil(q / 100 * self.count), 1)
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                return min(max(self._value(index), self.min), self.max)
+        return self.max
+
+    def summary_us(self, percentiles=(50, 90, 99, 99.9)):
+        """Mean, maximum and the given percentiles, in microseconds"""
+        summary = {f"p{q:g}": self.percentile(q) / 1000 for q in percentiles}
+        summary["mean"] = self.mean / 1000
+        summary["max"] = self.max / 1000
+        return summary
+
+
+@dataclass
+class ApiResponse:
+    """A response of the Firecracker API server"""
+
+    status_code: int
+    headers: dict
+    content: bytes
+
+    @property
+    def ok(self):
+        """Whether the request succeeded"""
+        return self.status_code < 300
+
+    def json(self):
+        """The JSON decoded body of the response"""
+        return json.loads(self.content)
+
+
+def _encode_request(method, path, body=None):
+    """Serialize an HTTP/1.1 request. `body` is JSON encoded, unless it already is bytes"""
+    head = f"{method} {path} HTTP/1.1\r\nHost: localhost\r\n"
+    if body is None:
+        return (head + "\r\n").encode()
+    if not isinstance(body, (bytes, bytearray)):
+        body = json.dumps(body, separators=(",", ":")).encode()
+    head += f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n"
+    return head.encode() + body
+
+
+class _ResponseParser:
+    """Incrementally splits the bytes received on a connection into responses"""
+
+    def __init__(self):
+        self._buf = bytearray()
+
+    def feed(self, data: bytes):
+        """Append bytes received from the server"""
+        self._buf += data
+
+    def next_response(self):
+        """Remove the next complete response from the buffer, or return None if there is none yet"""
+        head_end = self._buf.find(b"\r\n\r\n")
+        if head_end < 0:
+            return None
+
+        head = self._buf[:head_end].decode("latin-1")
+        status_line, *header_lines = head.split("\r\n")
+        headers = {}
+        for line in header_lines:
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        body_start = head_end + 4
+        body_end = body_start + int(headers.get("content-length", 0))
+        if len(self._buf) < body_end:
+            return None
+
+        content = bytes(self._buf[body_start:body_end])
+        del self._buf[:body_end]
+        return ApiResponse(int(status_line.split(" ", 2)[1]), headers, content)
+
+
+class _LatencyRecorder:
+    """Client side latencies and errors of API requests, per endpoint"""
+
+    def __init__(self):
+        self.latencies = defaultdict(LatencyHistogram)
+        self.errors = Counter()
+
+    def _record(self, endpoint, sent_ns, response):
+        self.latencies[endpoint].record(time.perf_counter_ns() - sent_ns)
+        if not response.ok:
+            self.errors[endpoint] += 1
+
+    def latency_summary_us(self):
+        """Latency percentiles in microseconds, for each endpoint requested so far"""
+        return {
+            endpoint: histogram.summary_us()
+            for endpoint, histogram in self.latencies.items()
+        }
+
+
+class ApiConnection(_LatencyRecorder):
+    """A persistent HTTP/1.1 connection to the Firecracker API socket.
+
+    Unlike `Api`, which goes through `requests`, this does the bare minimum
+    of work per request, and can pipeline requests (i.e. send the next ones
+    before the responses to the previous ones arrived). Latencies are
+    measured from sending a request to having received its full response,
+    and recorded per "<method> <path>" endpoint.
+    """
+
+    def __init__(self, socket_path, *, timeout=10):
+        super().__init__()
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.settimeout(timeout)
+        self._sock.connect(str(socket_path))
+        self._parser = _ResponseParser()
+        # Endpoint and send time of the requests still waiting for a response
+        self._in_flight = deque()
+
+    def _send(self, method, path, body):
+        self._sock.sendall(_encode_request(method, path, body))
+        self._in_flight.append((f"{method} {path}", time.perf_counter_ns()))
+
+    def _receive(self):
+        while (response := self._parser.next_response()) is None:
+            data = self._sock.recv(2**16)
+            if not data:
+                raise ConnectionError("Firecracker closed the API connection")
+            self._parser.feed(data)
+
+        endpoint, sent_ns = self._in_flight.popleft()
+        self._record(endpoint, sent_ns, response)
+        return response
+
+    def request(self, method, path, body=None):
+        """Make a single request, and wait for its response"""
+        self._send(method, path, body)
+        return self._receive()
+
+    def pipeline(self, requests, *, depth=16):
+        """Make all (method, path, body) `requests`, with up to `depth` of them in flight at once.
+
+        Returns the responses in the order of the requests.
+        """
+        responses = []
+        for method, path, body in requests:
+            if len(self._in_flight) >= depth:
+                responses.append(self._receive())
+            self._send(method, path, body)
+        while self._in_flight:
+            responses.append(self._receive())
+        return responses
+
+    def close(self):
+        """Close the connection"""
+        self._sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class AsyncApiConnection(_LatencyRecorder):
+    """An asyncio version of `ApiConnection`.
+
+    Requests awaited concurrently (e.g. with `asyncio.gather`) are pipelined
+    on the single connection, and their responses are matched up in order.
+    Use `AsyncApiConnection.open` to create one.
+    """
+
+    def __init__(self, reader, writer):
+        super().__init__()
+        self._reader = reader
+        self._writer = writer
+        self._parser = _ResponseParser()
+        # Endpoint, send time and future of the requests still waiting for a response
+        self._in_flight = deque()
+        self._receiver = asyncio.create_task(self._receive_responses())
+
+    @classmethod
+    async def open(cls, socket_path):
+        """Connect to the API socket at `socket_path`"""
+        reader, writer = await asyncio.open_unix_connection(str(socket_path))
+        return cls(reader, writer)
+
+    async def _receive_responses(self):
+        try:
+            while data := await self._reader.read(2**16):
+                self._parser.feed(data)
+                while (response := self._parser.next_response()) is not None:
+                    endpoint, sent_ns, future = self._in_flight.popleft()
+                    self._record(endpoint, sent_ns, response)
+                    if not future.done():
+                        future.set_result(response)
+            error = ConnectionError("Firecracker closed the API connection")
+        except Exception as exc:  # pylint: disable=broad-except
+            error = exc
+        while self._in_flight:
+            _, _, future = self._in_flight.popleft()
+            if not future.done():
+                future.set_exception(error)
+
+    async def request(self, method, path, body=None):
+        """Make a request, and wait for its response"""
+        if self._receiver.done():
+            raise ConnectionError("Firecracker closed the API connection")
+        future = asyncio.get_running_loop().create_future()
+        # Queue up the request before yielding to the event loop, so that the
+        # order of requests on the wire matches `_in_flight`
+        self._in_flight.append((f"{method} {path}", time.perf_counter_ns(), future))
+        self._writer.write(_encode_request(method, path, body))
+        await self._writer.drain()
+        return await future
+
+    async def close(self):
+        """Close the connection"""
+        self._writer.close()
+        await self._writer.wait_closed()
+        self._receiver.cancel()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
@@ -11,20 +11,27 @@ destroy microvms.
 
 # pylint:disable=too-many-lines
 
+import asyncio
+import codecs
+import contextlib
+import inspect
 import json
 import logging
 import os
+import queue
 import re
-import select
 import shutil
 import signal
+import threading
 import time
 import uuid
 from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from enum import Enum
 from functools import lru_cache
 from pathlib import Path
+from threading import Thread
 from typing import Optional
 
 from tenacity import retry, stop_after_attempt, wait_fixed
@@ -40,7 +47,8 @@ from framework.properties import global_props
 from framework.utils_cpu_templates import get_cpu_template_name
 from framework.utils_drive import VhostUserBlkBackend, VhostUserBlkBackendType
 from framework.utils_uffd import spawn_pf_handler, uffd_handler
-from host_tools.fcmetrics import FCMetricsMonitor
+from host_tools.fclog import FCLogReader
+from host_tools.fcmetrics import FCMetricsMonitor, FCMetricsReader
 from host_tools.memory import MemoryMonitor
 
 LOG = logging.getLogger("microvm")
@@ -58,13 +66,16 @@ class SnapshotType(Enum):
 
 
 def hardlink_or_copy(src, dst):
-    """If src and dst are in the same device, hardlink. Otherwise, copy."""
+    """If src and dst are in the same device, hardlink. Otherwise, copy.
+
+    Returns the number of bytes that actually had to be copied.
+    """
     dst.touch(exist_ok=False)
     if dst.stat().st_dev == src.stat().st_dev:
         dst.unlink()
         dst.hardlink_to(src)
-    else:
-        shutil.copyfile(src, dst)
+        return 0
+    return utils.copy_file(src, dst)
 
 
 @dataclass(frozen=True, repr=True)
@@ -102,9 +113,10 @@ class Snapshot:
         Use different names so a snapshot doesn't overwrite our original snapshot.
         """
         mem_src = chroot / self.mem.with_suffix(".src").name
-        hardlink_or_copy(self.mem, mem_src)
+        copied = hardlink_or_copy(self.mem, mem_src)
         vmstate_src = chroot / self.vmstate.with_suffix(".src").name
-        hardlink_or_copy(self.vmstate, vmstate_src)
+        copied += hardlink_or_copy(self.vmstate, vmstate_src)
+        LOG.debug("Copied %d bytes of snapshot files into %s", copied, chroot)
 
         return Snapshot(
             vmstate=vmstate_src,
@@ -137,14 +149,16 @@ class Snapshot:
 
         Deserialize the snapshot with `load_from`
         """
+        copied = 0
         for path in [self.vmstate, self.mem, self.ssh_key]:
             new_path = dst / path.name
-            hardlink_or_copy(path, new_path)
+            copied += hardlink_or_copy(path, new_path)
         new_disks = {}
         for disk_id, path in self.disks.items():
             new_path = dst / path.name
-            hardlink_or_copy(path, new_path)
+            copied += hardlink_or_copy(path, new_path)
             new_disks[disk_id] = new_path.name
+        LOG.debug("Copied %d bytes of snapshot files into %s", copied, dst)
         obj = {
             "vmstate": self.vmstate.name,
             "mem": self.mem.name,
@@ -163,6 +177,16 @@ class Snapshot:
         self.vmstate.unlink()
 
 
+@dataclass(frozen=True)
+class RestoreTimings:
+    """Host-side timings (in seconds) of restoring a microVM from a snapshot"""
+
+    spawn: float
+    load_snapshot: float
+    resume: float
+    first_ssh: Optional[float]
+
+
 class HugePagesConfig(str, Enum):
     """Enum describing the huge pages configurations supported Firecracker"""
 
@@ -240,8 +264,11 @@ class Microvm:
         self.api = None
         self.log_file = None
         self.metrics_file = None
+        self.metrics_reader = None
         self._spawned = False
         self._killed = False
+        # Arguments this microVM was spawned with ahead of time by a warm pool
+        self._prespawn_args = None
 
         # device dictionaries
         self.iface = {}
@@ -302,9 +329,11 @@ class Microvm:
             backend.kill()
         self.disks_vhost_user.clear()
 
-        assert (
-            "Shutting down VM after intercepting signal" not in self.log_data
-        ), self.log_data
+        if self.log_reader is not None:
+            assert (
+                self.log_reader.search("Shutting down VM after intercepting signal")
+                is None
+            ), self.log_data
 
         try:
             if self.firecracker_pid:
@@ -368,27 +397,32 @@ class Microvm:
         """
         Parses the firecracker logs for information regarding api server request processing times, and asserts they
         are within acceptable bounds.
+
+        Returns the number of API calls whose duration was found in the log.
         """
         # Log messages are either
-        # 2023-06-16T07:45:41.767987318 [fc44b23e-ce47-4635-9549-5779a6bd9cee:fc_api] The API server received a Get request on "/mmds".
+        # The API server received a Get request on "/mmds".
         # or
-        # 2023-06-16T07:47:31.204704732 [2f2427c7-e4de-4226-90e6-e3556402be84:fc_api] The API server received a Put request on "/actions" with body "{\"action_type\": \"InstanceStart\"}".
+        # The API server received a Put request on "/actions" with body "{\"action_type\": \"InstanceStart\"}".
+        # (after the `[id:thread]` prefix, which `LogRecord` strips)
         api_request_regex = re.compile(
-            r"\] The API server received a (?P<method>\w+) request on \"(?P<url>(/(\w|-)*)+)\"( with body (?P<body>.*))?\."
+            r"The API server received a (?P<method>\w+) request on \"(?P<url>(/(\w|-)*)+)\"( with body (?P<body>.*))?\."
         )
         api_request_times_regex = re.compile(
-            r"\] Total previous API call duration: (?P<execution_time>\d+) us.$"
+            r"Total previous API call duration: (?P<execution_time>\d+) us.$"
         )
 
         # Note: Processing of api requests is synchronous, so these messages cannot be torn by concurrency effects
-        log_lines = self.log_data.split("\n")
-
         ApiCall = namedtuple("ApiCall", "method url body")
 
         current_call = None
+        nr_calls = 0
 
-        for log_line in log_lines:
-            match = api_request_regex.search(log_line)
+        for record in self.log_reader.since(0):
+            if record.thread != "fc_api":
+                continue
+
+            match = api_request_regex.search(record.message)
 
             if match:
                 if current_call is not None:
@@ -400,7 +434,7 @@ class Microvm:
                     match.group("method"), match.group("url"), match.group("body")
                 )
 
-            match = api_request_times_regex.search(log_line)
+            match = api_request_times_regex.search(record.message)
 
             if match:
                 if current_call is None:
@@ -416,6 +450,9 @@ class Microvm:
                     ), f"{current_call.method} {current_call.url} API call exceeded maximum duration: {exec_time} ms. Body: {current_call.body}"
 
                 current_call = None
+                nr_calls += 1
+
+        return nr_calls
 
     @property
     def firecracker_version(self):
@@ -436,12 +473,24 @@ class Microvm:
         """Return the unique identifier of this microVM."""
         return self._microvm_id
 
+    @property
+    def log_file(self):
+        """The file Firecracker logs to, or None if it does not log to a file"""
+        return self._log_file
+
+    @log_file.setter
+    def log_file(self, path):
+        # e.g. after reconfiguring the logger through the API, the new file is
+        # read from its beginning
+        self._log_file = path
+        self.log_reader = FCLogReader(path) if path is not None else None
+
     @property
     def log_data(self):
         """Return the log data."""
-        if self.log_file is None:
+        if self.log_reader is None:
             return ""
-        return self.log_file.read_text()
+        return self.log_reader.text
 
     @property
     def console_data(self):
@@ -495,22 +544,17 @@ class Microvm:
 
     def get_metrics(self):
         """Return iterator to metric data points written by FC"""
-        with self.metrics_file.open() as fd:
-            for line in fd:
-                if not line.endswith("}\n"):
-                    LOG.warning("Line is not a proper JSON object. Partial write?")
-                    continue
-                yield json.loads(line)
+        return iter(self.metrics_reader.since(0))
 
     def get_all_metrics(self):
         """Return all metric data points written by FC."""
-        return list(self.get_metrics())
+        return self.metrics_reader.since(0)
 
     def flush_metrics(self):
         """Flush the microvm metrics and get the latest datapoint"""
         self.api.actions.put(action_type="FlushMetrics")
         # get the latest metrics
-        return self.get_all_metrics()[-1]
+        return self.metrics_reader.latest()
 
     def create_jailed_resource(self, path):
         """Create a hard link to some resource inside this microvm."""
@@ -614,6 +658,24 @@ class Microvm:
         """Start a microVM as a daemon or in a screen session."""
         # pylint: disable=subprocess-run-check
         # pylint: disable=too-many-branches
+        if self._prespawn_args is not None:
+            # This microVM was already spawned by a `MicroVMFactory` warm pool,
+            # so there is nothing left to do except for starting the monitors.
+            spawn_args = {
+                "log_file": log_file,
+                "log_level": log_level,
+                "log_show_level": log_show_level,
+                "log_show_origin": log_show_origin,
+                "metrics_path": metrics_path,
+            }
+            assert (
+                spawn_args == self._prespawn_args
+            ), f"microVM was spawned by the warm pool with {self._prespawn_args}, not {spawn_args}"
+            self._prespawn_args = None
+            if emit_metrics:
+                self.monitors.append(FCMetricsMonitor(self))
+            return
+
         self.jailer.setup()
         self.api = Api(
             self.jailer.api_socket_path(),
@@ -639,6 +701,7 @@ class Microvm:
             self.metrics_file = Path(self.path) / metrics_path
             self.metrics_file.touch()
             self.create_jailed_resource(self.metrics_file)
+            self.metrics_reader = FCMetricsReader(self.metrics_file)
             self.jailer.extra_args.update({"metrics-path": self.metrics_file.name})
         else:
             assert not emit_metrics
@@ -717,34 +780,31 @@ class Microvm:
         # and leave 0.2 delay between them.
         os.stat(self.jailer.api_socket_path())
 
-    @retry(wait=wait_fixed(0.2), stop=stop_after_attempt(5), reraise=True)
+    def wait_for_log(self, pattern, timeout_s=1):
+        """Wait until a line of the logging output matches `pattern`, returning the match."""
+        assert self.log_reader is not None, "Logging to a file is not enabled"
+        try:
+            _, match = self.log_reader.wait_for(pattern, timeout_s)
+        except TimeoutError as err:
+            raise AssertionError(
+                f"Pattern ({pattern!r}) not found in log data ({self.log_data!r})."
+            ) from err
+        return match
+
     def check_log_message(self, message):
         """Wait until `message` appears in logging output."""
-        assert (
-            message in self.log_data
-        ), f'Message ("{message}") not found in log data ("{self.log_data}").'
+        self.wait_for_log(re.escape(message))
 
-    @retry(wait=wait_fixed(0.2), stop=stop_after_attempt(5), reraise=True)
     def get_exit_code(self):
         """Get exit code from logging output"""
-        exit_msg_pattern = (
+        match = self.wait_for_log(
             r"Firecracker exiting (with error|successfully). exit_code=(\d+)"
         )
-        match = re.search(exit_msg_pattern, self.log_data)
-        if match:
-            exit_code = int(match.group(2))
-            return exit_code
-        raise AssertionError(f"unable to find exit code from the log: {self.log_data}")
+        return int(match.group(2))
 
-    @retry(wait=wait_fixed(0.2), stop=stop_after_attempt(5), reraise=True)
     def check_any_log_message(self, messages):
         """Wait until any message in `messages` appears in logging output."""
-        for message in messages:
-            if message in self.log_data:
-                return
-        raise AssertionError(
-            f"`{messages}` were not found in this log: {self.log_data}"
-        )
+        self.wait_for_log("|".join(re.escape(message) for message in messages))
 
     def serial_input(self, input_string):
         """Send a string to the Firecracker serial console via screen."""
@@ -1141,6 +1201,141 @@ class Microvm:
         _ = self.ssh_iface(0)
 
 
+async def gather_on(
+    microvms, cmd_string, *, timeout=100, check=False, on_line=None, limit=None
+):
+    """Run a command on all the given microVMs concurrently, from a single thread
+
+    The microVMs need to have their SSH connection up already (e.g. using
+    `wait_for_ssh_up`). At most `limit` commands run at the same time, if given.
+    If given, `on_line` is called with the microVM and each line of its stdout,
+    as soon as it is received.
+
+    Returns the results in the order of `microvms`. A command failing (if
+    `check`) or timing out on one microVM does not affect the others: the
+    exception is returned in place of its result.
+    """
+    semaphore = asyncio.Semaphore(limit) if limit else contextlib.nullcontext()
+
+    async def run_on(microvm):
+        async with semaphore:
+            return await microvm.ssh.arun(
+                cmd_string,
+                timeout,
+                check=check,
+                on_line=on_line and (lambda line: on_line(microvm, line)),
+            )
+
+    return await asyncio.gather(
+        *(run_on(microvm) for microvm in microvms), return_exceptions=True
+    )
+
+
+class WarmPool(Thread):
+    """A pool of jailed Firecracker processes that are spawned ahead of time.
+
+    A background thread keeps up to `size` microVMs built and spawned (e.g.
+    with their network namespace and chroot set up, and the API server up and
+    running), so that `MicroVMFactory.build` can hand them out without paying
+    for the host-side setup. Only `build` calls whose arguments match the ones
+    the pool was started with are served from the pool.
+    """
+
+    def __init__(self, factory, size, build_kwargs, spawn_kwargs):
+        Thread.__init__(self, daemon=True)
+        assert size > 0
+        self._factory = factory
+        self.size = size
+        self.build_kwargs = build_kwargs
+        # The arguments `Microvm.spawn` ends up with, defaults included, which
+        # the microVMs handed out need to be spawned with again. The monitors
+        # `emit_metrics` starts are only started once a microVM is handed out.
+        spawn_args = inspect.signature(Microvm.spawn).bind(None, **spawn_kwargs)
+        spawn_args.apply_defaults()
+        self.spawn_args = {
+            name: value
+            for name, value in spawn_args.arguments.items()
+            if name not in ("self", "emit_metrics")
+        }
+        self._ready = queue.Queue()
+        self._free_slots = threading.Semaphore(size)
+        self._should_stop = False
+        self._error = None
+
+        self.hits = 0
+        self.misses = 0
+        self.refill_latencies = []
+
+    def run(self):
+        """Keep the pool filled up until `stop` is called."""
+        while not self._should_stop:
+            # Wait for a microVM to be handed out before spawning the next one,
+            # but wake up regularly to check whether we should stop.
+            if not self._free_slots.acquire(timeout=0.1):
+                continue
+
+            start = time.perf_counter()
+            try:
+                vm = self._factory.create(**self.build_kwargs)
+                vm.spawn(**self.spawn_args)
+            except Exception as exc:  # pylint: disable=broad-exception-caught
+                LOG.error("Failed to refill microVM warm pool: %s", exc)
+                self._error = exc
+                return
+            self.refill_latencies.append(time.perf_counter() - start)
+
+            # pylint: disable=protected-access
+            vm._prespawn_args = self.spawn_args
+            self._ready.put(vm)
+
+    def get(self, build_kwargs):
+        """Get a spawned microVM built with `build_kwargs`, or None if there is none"""
+        if self._error is not None:
+            raise self._error
+
+        vm = None
+        if build_kwargs == self.build_kwargs:
+            try:
+                vm = self._ready.get_nowait()
+                self._free_slots.release()
+            except queue.Empty:
+                pass
+
+        if vm is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return vm
+
+    @retry(wait=wait_fixed(0.5), stop=stop_after_attempt(120), reraise=True)
+    def wait_until_full(self):
+        """Wait until all microVMs in the pool are spawned"""
+        if self._error is not None:
+            raise self._error
+        assert self._ready.qsize() == self.size, "warm pool is not full yet"
+
+    def stop(self):
+        """Stop refilling the pool.
+
+        microVMs that are still in the pool are owned by the factory, and are
+        cleaned up by `MicroVMFactory.kill`.
+        """
+        if self.is_alive():
+            self._should_stop = True
+            self.join()
+        LOG.info("microVM warm pool statistics: %s", self.stats)
+
+    @property
+    def stats(self):
+        """Hit/miss counts and refill latencies (in seconds) of this pool"""
+        return {
+            "size": self.size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "refill_latencies": self.refill_latencies,
+        }
+
+
 class MicroVMFactory:
     """MicroVM factory"""
 
@@ -1149,6 +1344,9 @@ class MicroVMFactory:
         self.binary_path = binary_path
         self.netns_factory = kwargs.pop("netns_factory", net_tools.NetNs)
         self.kwargs = kwargs
+        self.warm_pool = None
+        # Guards the netns factory, which is also used by the warm pool thread
+        self._lock = threading.Lock()
 
         assert self.fc_binary_path.exists(), "missing firecracker binary"
         assert self.jailer_binary_path.exists(), "missing jailer binary"
@@ -1163,21 +1361,53 @@ class MicroVMFactory:
         """The path to the jailer binary using which this factory will build VMs"""
         return self.binary_path / "jailer"
 
-    def build(self, kernel=None, rootfs=None, **kwargs):
-        """Build a microvm"""
+    def start_warm_pool(self, size, spawn_kwargs=None, **build_kwargs):
+        """Keep `size` microVMs spawned in the background, to be handed out by `build`
+
+        Only calls to `build` with the same `build_kwargs` are served from the
+        pool, and the microVMs it hands out need to be `spawn`ed with the same
+        `spawn_kwargs` (which default to the defaults of `Microvm.spawn`).
+        """
+        assert self.warm_pool is None, "warm pool already started"
+        self.warm_pool = WarmPool(self, size, build_kwargs, spawn_kwargs or {})
+        self.warm_pool.start()
+        return self.warm_pool
+
+    def stop_warm_pool(self):
+        """Stop refilling the warm pool, and return its statistics"""
+        if self.warm_pool is None:
+            return None
+        self.warm_pool.stop()
+        stats = self.warm_pool.stats
+        self.warm_pool = None
+        return stats
+
+    def create(self, **kwargs):
+        """Create a microvm and its network namespace, without a kernel or rootfs"""
         kwargs = self.kwargs | kwargs
         microvm_id = kwargs.pop("microvm_id", str(uuid.uuid4()))
+        with self._lock:
+            netns = kwargs.pop("netns", None) or self.netns_factory(microvm_id)
         vm = Microvm(
             microvm_id=microvm_id,
             fc_binary_path=kwargs.pop("fc_binary_path", self.fc_binary_path),
             jailer_binary_path=kwargs.pop(
                 "jailer_binary_path", self.jailer_binary_path
             ),
-            netns=kwargs.pop("netns", self.netns_factory(microvm_id)),
+            netns=netns,
             **kwargs,
         )
         vm.netns.setup()
         self.vms.append(vm)
+        return vm
+
+    def build(self, kernel=None, rootfs=None, **kwargs):
+        """Build a microvm"""
+        vm = None
+        if self.warm_pool is not None:
+            vm = self.warm_pool.get(kwargs)
+        if vm is None:
+            vm = self.create(**kwargs)
         if kernel is not None:
             vm.kernel_file = kernel
         if rootfs is not None:
@@ -1244,8 +1474,75 @@ class MicroVMFactory:
             last_snapshot.delete()
         current_snapshot.delete()
 
+    def _restore_timed(self, snapshot, uffd_handler_name):
+        """Build a microvm and restore `snapshot` into it, timing each step"""
+        start = time.perf_counter()
+        microvm = self.build()
+        # API call durations are flaky when restoring many microvms in parallel
+        microvm.time_api_requests = False
+        microvm.spawn()
+        spawned = time.perf_counter()
+
+        snapshot_copy = microvm.restore_from_snapshot(
+            snapshot, resume=False, uffd_handler_name=uffd_handler_name
+        )
+        loaded = time.perf_counter()
+
+        microvm.resume()
+        resumed = time.perf_counter()
+
+        first_ssh = None
+        if snapshot_copy.net_ifaces:
+            microvm.wait_for_ssh_up()
+            first_ssh = time.perf_counter() - resumed
+
+        timings = RestoreTimings(
+            spawn=spawned - start,
+            load_snapshot=loaded - spawned,
+            resume=resumed - loaded,
+            first_ssh=first_ssh,
+        )
+        return microvm, snapshot_copy, timings
+
+    def build_n_from_snapshot_parallel(
+        self,
+        snapshot,
+        nr_vms,
+        *,
+        concurrency=4,
+        uffd_handler_name=None,
+    ):
+        """A generator of `n` microvms restored from the same given snapshot, `concurrency` at a time
+
+        Yields `(microvm, RestoreTimings)` tuples. The microvms are restored in
+        batches of up to `concurrency` microvms in parallel, yielded in the
+        order they were submitted, and killed in the same order once the whole
+        batch has been consumed.
+        """
+        assert concurrency > 0
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            remaining = nr_vms
+            while remaining > 0:
+                batch_size = min(concurrency, remaining)
+                remaining -= batch_size
+
+                futures = [
+                    executor.submit(self._restore_timed, snapshot, uffd_handler_name)
+                    for _ in range(batch_size)
+                ]
+                batch = [future.result() for future in futures]
+
+                for microvm, _, timings in batch:
+                    yield microvm, timings
+
+                for microvm, snapshot_copy, _ in batch:
+                    microvm.kill()
+                    snapshot_copy.delete()
+
     def kill(self):
         """Clean up all built VMs"""
+        self.stop_warm_pool()
         for vm in self.vms:
             vm.kill()
             vm.jailer.cleanup()
@@ -1258,19 +1555,31 @@ class MicroVMFactory:
 
 
 class Serial:
-    """Class for serial console communication with a Microvm."""
+    """Class for serial console communication with a Microvm.
+
+    The console output is read in large chunks into a buffer holding the
+    output not consumed yet, in which expected strings or regexes are
+    searched for.
+    """
 
     RX_TIMEOUT_S = 60
+    # The screen log is a regular file, which cannot be waited on to grow
+    POLL_INTERVAL_S = 0.01
+    CHUNK_SIZE = 2**16
+    # Unconsumed output beyond this is dropped, oldest first
+    BUFFER_SIZE = 2**24
 
     def __init__(self, vm):
         """Initialize a new Serial object."""
-        self._poller = None
+        self._fd = None
         self._vm = vm
+        self._buf = bytearray()
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
 
     def open(self):
         """Open a serial connection."""
         # Open the screen log file.
-        if self._poller is not None:
+        if self._fd is not None:
             # serial already opened
             return
 
@@ -1279,9 +1588,7 @@ class Serial:
             time.sleep(0.2)
             attempt += 1
 
-        screen_log_fd = os.open(self._vm.screen_log, os.O_RDONLY)
-        self._poller = select.poll()
-        self._poller.register(screen_log_fd, select.POLLIN | select.POLLHUP)
+        self._fd = os.open(self._vm.screen_log, os.O_RDONLY)
 
     def tx(self, input_string, end="\n"):
         # pylint: disable=invalid-name
@@ -1289,32 +1596,124 @@ class Serial:
         r"""Send a string terminated by an end token (defaulting to "\n")."""
         self._vm.serial_input(input_string + end)
 
-    def rx_char(self):
-        """Read a single character."""
-        result = self._poller.poll(0.1)
+    def _fill(self):
+        """Append all output available right now to the buffer.
+
+        Returns how many bytes were read, and how many were dropped from the
+        front of the buffer to make room.
+        """
+        nread = 0
+        while chunk := os.read(self._fd, self.CHUNK_SIZE):
+            self._buf += chunk
+            nread += len(chunk)
+
+        dropped = max(len(self._buf) - self.BUFFER_SIZE, 0)
+        del self._buf[:dropped]
+        return nread, dropped
+
+    def _timeout(self, what):
+        self._vm.kill()
+        raise AssertionError(
+            f"Timed out waiting for {what} on the serial console. "
+            f"Last output: {self._buf[-1024:].decode(errors='replace')!r}"
+        )
 
-        for fd, flag in result:
-            if flag & select.POLLHUP:
-                assert False, "Oh! The console vanished before test completed."
+    def _expect(self, patterns, timeout):
+        """Wait for any of `patterns` to match, and consume the output up to the end of the match"""
+        regexes = []
+        for pattern in patterns:
+            if isinstance(pattern, str):
+                pattern = re.compile(re.escape(pattern.encode()))
+            elif isinstance(pattern.pattern, str):
+                pattern = re.compile(
+                    pattern.pattern.encode(), pattern.flags & ~re.UNICODE
+                )
+            regexes.append(pattern)
+        # Where to resume searching for each pattern once more output arrives
+        resume_at = [0] * len(regexes)
+
+        deadline = time.monotonic() + (timeout or self.RX_TIMEOUT_S)
+        while True:
+            # Matches keep referring to the searched object, so search a copy
+            data = bytes(self._buf)
+            matches = [
+                (match.end(), idx, match)
+                for idx, regex in enumerate(regexes)
+                if (match := regex.search(data, resume_at[idx]))
+            ]
+            if matches:
+                end, idx, match = min(matches, key=lambda m: (m[0], m[1]))
+                del self._buf[:end]
+                return idx, match, data[:end]
+
+            for idx, pattern in enumerate(patterns):
+                # Literal strings can only match across the end of the buffer,
+                # regexes could match anywhere
+                if isinstance(pattern, str):
+                    resume_at[idx] = max(len(self._buf) - len(pattern.encode()) + 1, 0)
+
+            while True:
+                nread, dropped = self._fill()
+                if nread:
+                    resume_at = [max(pos - dropped, 0) for pos in resume_at]
+                    break
+                if time.monotonic() > deadline:
+                    self._timeout(patterns)
+                time.sleep(self.POLL_INTERVAL_S)
+
+    def expect(self, *patterns, timeout=None):
+        """Wait until any of `patterns` appears in the output, and return its index and the match.
+
+        Patterns are either strings to look for literally, or compiled
+        regexes. If several patterns match, the one whose match ends first
+        wins. The output up to the end of the match is consumed.
+        """
+        idx, match, _ = self._expect(patterns, timeout)
+        return idx, match
+
+    def read(self, timeout=None):
+        """Consume and return all output not consumed yet, waiting up to `timeout` seconds for some"""
+        deadline = time.monotonic() + (timeout or self.RX_TIMEOUT_S)
+        while not self._buf:
+            if not self._fill()[0]:
+                if time.monotonic() > deadline:
+                    self._timeout("output")
+                time.sleep(self.POLL_INTERVAL_S)
+
+        data = self._decoder.decode(bytes(self._buf))
+        self._buf.clear()
+        return data
 
-            if flag & select.POLLIN:
-                output_char = str(os.read(fd, 1), encoding="utf-8", errors="ignore")
-                return output_char
+    def rx_char(self):
+        """Read a single character."""
+        if not self._buf and not self._fill()[0]:
+            time.sleep(self.POLL_INTERVAL_S)
+            return ""
 
-        return ""
+        output_char = str(self._buf[:1], encoding="utf-8", errors="ignore")
+        del self._buf[:1]
+        return output_char
 
     def rx(self, token="\n"):
         # pylint: disable=invalid-name
         # No need to have a snake_case naming style for a single word.
         r"""Read a string delimited by an end token (defaults to "\n")."""
-        rx_str = ""
-        start = time.time()
-        while True:
-            rx_str += self.rx_char()
-            if rx_str.endswith(token):
-                break
-            if (time.time() - start) >= self.RX_TIMEOUT_S:
-                self._vm.kill()
-                assert False
-
-        return rx_str
+        _, _, consumed = self._expect([token], self.RX_TIMEOUT_S)
+        return consumed.decode(errors="ignore")
+
+    def run_states(self, state, final_state, timeout=None):
+        """Feed the output to `state` (a `TestState`) until it turns into an instance of `final_state`.
+
+        Output is passed on in whatever chunks it was read in. After a state
+        matched, the rest of the chunk is passed to the next state.
+        """
+        deadline = time.monotonic() + (timeout or self.RX_TIMEOUT_S)
+        while not isinstance(state, final_state):
+            data = self.read(max(deadline - time.monotonic(), 0.001))
+            while data and not isinstance(state, final_state):
+                next_state = state.handle_input(self, data)
+                data = state.remainder if next_state is not state else ""
+                state = next_state
+            # Leave the output the final state did not see for later reads
+            self._buf[:0] = data.encode()
+        return state
@@ -0,0 +1,197 @@
+# Copyright 2025 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+"""A content-addressed, deduplicating store for Firecracker snapshots.
+
+All files of a snapshot (memory, vmstate, disks, ssh key) are split into
+fixed-size chunks, each of which is stored only once, keyed by its SHA-256.
+Chunks which only contain zeros are not stored at all, and turn into holes
+when the snapshot is materialized again. This way, successive snapshots of the
+same microVM (e.g. incremental snapshot chains) only use disk space for the
+chunks that actually changed.
+
+Layout of the store:
+
+    <root>/chunks/<digest[:2]>/<digest>
+    <root>/snapshots/<name>.json
+
+Snapshots are materialized into a staging directory, from which they are
+restored like any other snapshot, with, in order of preference:
+- reflinks of individual chunks (FICLONERANGE), if the filesystem supports it,
+- plain writes of the non-zero chunks into a sparse file.
+Files are never hardlinked to chunks, as the microVM writing to its disks, or
+the jailer changing their owner, would then modify the store.
+"""
+
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+
+import host_tools.network as net_tools
+from framework.microvm import Snapshot, SnapshotType
+from framework.utils import clone_range
+
+LOG = logging.getLogger("snapshot_store")
+
+# Size of the chunks files are split into. Needs to be a multiple of the
+# filesystem block size for chunks to be reflinked.
+DEFAULT_CHUNK_SIZE = 2 * 2**20
+
+
+class SnapshotStore:
+    """A content-addressed store for `Snapshot`s"""
+
+    def __init__(self, root: Path, chunk_size: int = DEFAULT_CHUNK_SIZE):
+        self.root = Path(root)
+        self.chunk_size = chunk_size
+        self.chunks_dir = self.root / "chunks"
+        self.snapshots_dir = self.root / "snapshots"
+        self.chunks_dir.mkdir(parents=True, exist_ok=True)
+        self.snapshots_dir.mkdir(parents=True, exist_ok=True)
+
+    def _chunk_path(self, digest: str) -> Path:
+        return self.chunks_dir / digest[:2] / digest
+
+    def _chunk_paths(self):
+        """All chunks in the store, skipping ones that are still being written"""
+        for path in self.chunks_dir.glob("*/*"):
+            if path.suffix != ".tmp":
+                yield path
+
+    def _manifest_path(self, name: str) -> Path:
+        return self.snapshots_dir / f"{name}.json"
+
+    def _put_file(self, path: Path):
+        """Store the chunks of `path`, returning its manifest entry and the number of new bytes stored"""
+        entry = {"name": path.name, "size": path.stat().st_size, "chunks": []}
+        new_bytes = 0
+
+        with path.open("rb") as src:
+            while data := src.read(self.chunk_size):
+                if data.count(0) == len(data):
+                    entry["chunks"].append(None)
+                    continue
+
+                digest = hashlib.sha256(data).hexdigest()
+                entry["chunks"].append(digest)
+
+                chunk_path = self._chunk_path(digest)
+                if chunk_path.exists():
+                    continue
+
+                # Write to a temporary file first, so that concurrent puts
+                # never observe partially written chunks.
+                chunk_path.parent.mkdir(exist_ok=True)
+                tmp_path = chunk_path.with_suffix(f".{os.getpid()}.tmp")
+                tmp_path.write_bytes(data)
+                os.replace(tmp_path, chunk_path)
+                new_bytes += len(data)
+
+        return entry, new_bytes
+
+    def _materialize_file(self, entry: dict, dst: Path):
+        """Recreate a file stored with `_put_file` at `dst`"""
+        with dst.open("wb") as out:
+            # Start out with a sparse file, and only fill in non-zero chunks
+            os.ftruncate(out.fileno(), entry["size"])
+            for idx, digest in enumerate(entry["chunks"]):
+                if digest is None:
+                    continue
+
+                offset = idx * self.chunk_size
+                with self._chunk_path(digest).open("rb") as chunk:
+                    if not clone_range(chunk.fileno(), out.fileno(), offset):
+                        os.pwrite(out.fileno(), chunk.read(), offset)
+
+    def put(self, name: str, snapshot: Snapshot) -> int:
+        """Store `snapshot` under `name`, returning the number of bytes that were not already in the store"""
+        new_bytes = 0
+
+        def put_file(path):
+            nonlocal new_bytes
+            entry, file_new_bytes = self._put_file(Path(path))
+            new_bytes += file_new_bytes
+            return entry
+
+        manifest = {
+            "vmstate": put_file(snapshot.vmstate),
+            "mem": put_file(snapshot.mem),
+            "ssh_key": put_file(snapshot.ssh_key),
+            "disks": {
+                disk_id: put_file(path) for disk_id, path in snapshot.disks.items()
+            },
+            "net_ifaces": [x.__dict__ for x in snapshot.net_ifaces],
+            "snapshot_type": snapshot.snapshot_type.value,
+            "meta": snapshot.meta,
+        }
+        self._manifest_path(name).write_text(json.dumps(manifest), encoding="utf-8")
+
+        LOG.info("Stored snapshot %s, adding %d new bytes", name, new_bytes)
+        return new_bytes
+
+    def materialize(self, name: str, dst: Path) -> Snapshot:
+        """Recreate the snapshot stored under `name` inside the `dst` directory
+
+        `dst` must not be the chroot of the microVM restoring the snapshot,
+        as `Microvm.restore_from_snapshot` moves the files into it itself.
+        """
+        dst = Path(dst)
+        dst.mkdir(parents=True, exist_ok=True)
+        manifest = json.loads(self._manifest_path(name).read_text(encoding="utf-8"))
+
+        def materialize_file(entry):
+            path = dst / entry["name"]
+            self._materialize_file(entry, path)
+            return path
+
+        return Snapshot(
+            vmstate=materialize_file(manifest["vmstate"]),
+            mem=materialize_file(manifest["mem"]),
+            net_ifaces=[
+                net_tools.NetIfaceConfig(**d) for d in manifest["net_ifaces"]
+            ],
+            disks={
+                disk_id: materialize_file(entry)
+                for disk_id, entry in manifest["disks"].items()
+            },
+            ssh_key=materialize_file(manifest["ssh_key"]),
+            snapshot_type=SnapshotType(manifest["snapshot_type"]),
+            meta=manifest["meta"],
+        )
+
+    def names(self):
+        """Names of all snapshots in the store"""
+        return sorted(path.stem for path in self.snapshots_dir.glob("*.json"))
+
+    def delete(self, name: str):
+        """Remove the snapshot `name` from the store. Its chunks are only freed by `gc`"""
+        self._manifest_path(name).unlink()
+
+    def gc(self) -> int:
+        """Delete all chunks not referenced by any snapshot, returning the number of bytes freed"""
+        referenced = set()
+        for name in self.names():
+            manifest = json.loads(self._manifest_path(name).read_text(encoding="utf-8"))
+            entries = [
+                manifest["vmstate"],
+                manifest["mem"],
+                manifest["ssh_key"],
+                *manifest["disks"].values(),
+            ]
+            for entry in entries:
+                referenced.update(digest for digest in entry["chunks"] if digest)
+
+        freed = 0
+        for chunk_path in self._chunk_paths():
+            if chunk_path.name not in referenced:
+                freed += chunk_path.stat().st_size
+                chunk_path.unlink()
+
+        LOG.info("Garbage collected %d bytes of unreferenced chunks", freed)
+        return freed
+
+    @property
+    def disk_usage(self) -> int:
+        """The number of bytes used by all chunks in the store"""
+        return sum(path.stat().st_size for path in self._chunk_paths())
@@ -13,25 +13,32 @@ class MatchStaticString:
         """Initialize using specified match string."""
         self._string = match_string
         self._input = ""
+        # Input following the last match
+        self.remainder = ""
 
-    def match(self, input_char) -> bool:
+    def match(self, input_chars) -> bool:
         """
-        Check if `_input` matches the match `_string`.
+        Check if `_string` occurs in the input seen so far.
 
-        Process one char at a time and build `_input` string.
-        Preserve built `_input` if partially matches `_string`.
-        Return True when `_input` is the same as `_string`.
+        Input can come one char or any number of chars at a time. Only the
+        end of `_input` which could be the start of a match is preserved.
+        Return True when `_string` was found, with the input following it
+        in `remainder`.
         """
-        if input_char == "":
-            return False
-        self._input += str(input_char)
-        if self._input == self._string[: len(self._input)]:
-            if len(self._input) == len(self._string):
-                self._input = ""
-                return True
+        self.remainder = ""
+        if input_chars == "" or self._string == "":
             return False
+        self._input += str(input_chars)
+
+        idx = self._input.find(self._string)
+        if idx >= 0:
+            self.remainder = self._input[idx + len(self._string) :]
+            self._input = ""
+            return True
 
-        self._input = self._input[1:]
+        # Keep the longest suffix that could still be the start of a match
+        keep = len(self._string) - 1
+        self._input = self._input[-keep:] if keep else ""
         return False
 
 
@@ -2,6 +2,7 @@
 # SPDX-License-Identifier: Apache-2.0
 """Generic utility functions that are used in the framework."""
 import errno
+import fcntl
 import json
 import logging
 import os
@@ -9,12 +10,12 @@ import platform
 import re
 import select
 import signal
+import struct
 import subprocess
 import time
 import typing
 from collections import defaultdict, namedtuple
 from contextlib import contextmanager
-from typing import Dict
 
 import packaging.version
 import psutil
@@ -29,7 +30,12 @@ from tenacity import (
 FLUSH_CMD = 'screen -S {session} -X colon "logfile flush 0^M"'
 CommandReturn = namedtuple("CommandReturn", "returncode stdout stderr")
 CMDLOG = logging.getLogger("commands")
-GET_CPU_LOAD = "top -bn1 -H -p {} -w512 | tail -n+8"
+
+# _IOW(0x94, 9, int) and _IOW(0x94, 13, struct file_clone_range), see linux/fs.h
+FICLONE = 0x40049409
+FICLONERANGE = 0x4020940D
+# Size of the buffer used to copy data if copy_file_range is not available
+COPY_BUFSIZE = 2**20
 
 
 def get_threads(pid: int) -> dict:
@@ -56,59 +62,6 @@ def set_cpu_affinity(pid: int, cpulist: list) -> list:
     return psutil.Process(pid).cpu_affinity(real_cpulist)
 
 
-def get_cpu_utilization(pid: int) -> Dict[str, float]:
-    """Return current process per thread CPU utilization."""
-    _, stdout, _ = check_output(GET_CPU_LOAD.format(pid))
-    cpu_utilization = {}
-
-    # Take all except the last line
-    lines = stdout.strip().split(sep="\n")
-    for line in lines:
-        # sometimes the firecracker process will have gone away, in which case top does not return anything
-        if not line:
-            continue
-
-        info = line.strip().split()
-        # We need at least CPU utilization and threads names cols (which
-        # might be two cols e.g `fc_vcpu 0`).
-        info_len = len(info)
-        assert info_len > 11, line
-
-        cpu_percent = float(info[8])
-
-        # Handles `fc_vcpu 0` case as well.
-        thread_name = info[11] + (" " + info[12] if info_len > 12 else "")
-        cpu_utilization[thread_name] = cpu_percent
-
-    return cpu_utilization
-
-
-def track_cpu_utilization(
-    pid: int, iterations: int, omit: int
-) -> Dict[str, list[float]]:
-    """Tracks cpu utilization of a process for certain number of
-    iterations. Sleeps for first `omit` seconds.
-    """
-    assert iterations > 0
-
-    # Sleep first `omit` secconds
-    time.sleep(omit)
-
-    cpu_utilization = {}
-    for _ in range(iterations):
-        current_cpu_utilization = get_cpu_utilization(pid)
-        assert len(current_cpu_utilization) > 0
-
-        for thread_name, value in current_cpu_utilization.items():
-            if not cpu_utilization.get(thread_name):
-                cpu_utilization[thread_name] = []
-            cpu_utilization[thread_name].append(value)
-
-        # 1 second granularity
-        time.sleep(1)
-    return cpu_utilization
-
-
 @contextmanager
 def chroot(path):
     """
@@ -547,6 +500,104 @@ class Timeout:
         signal.alarm(0)
 
 
+def reflink(src_fd, dst_fd) -> bool:
+    """Make `dst_fd` share all data blocks of `src_fd` (copy-on-write)
+
+    Returns False if the filesystem does not support reflinks for these files.
+    """
+    try:
+        fcntl.ioctl(dst_fd, FICLONE, src_fd)
+    except OSError:
+        return False
+    return True
+
+
+def clone_range(src_fd, dst_fd, dst_offset, src_offset=0, length=0) -> bool:
+    """Reflink `length` bytes of `src_fd` into `dst_fd` at `dst_offset`
+
+    A `length` of 0 means until the end of `src_fd`. Returns False if the
+    filesystem does not support reflinks for these files.
+    """
+    file_clone_range = struct.pack("qQQQ", src_fd, src_offset, length, dst_offset)
+    try:
+        fcntl.ioctl(dst_fd, FICLONERANGE, file_clone_range)
+    except OSError:
+        return False
+    return True
+
+
+def _copy_range(src_fd, dst_fd, offset, length) -> int:
+    """Copy `length` bytes at `offset` from `src_fd` to the same offset in `dst_fd`"""
+    copied = 0
+    # os.copy_file_range is only available if Python was built against glibc >= 2.27
+    use_copy_file_range = hasattr(os, "copy_file_range")
+    while copied < length:
+        pos = offset + copied
+        count = length - copied
+        if use_copy_file_range:
+            try:
+                written = os.copy_file_range(src_fd, dst_fd, count, pos, pos)
+            except OSError as err:
+                # copy_file_range is not supported across filesystems on all kernels
+                if err.errno not in (errno.EXDEV, errno.ENOSYS, errno.EOPNOTSUPP):
+                    raise
+                use_copy_file_range = False
+                continue
+        else:
+            data = os.pread(src_fd, min(COPY_BUFSIZE, count), pos)
+            written = os.pwrite(dst_fd, data, pos)
+        if written == 0:
+            break
+        copied += written
+    return copied
+
+
+def _data_segments(fd, size):
+    """Yield the (offset, length) of all data segments of a sparse file"""
+    offset = 0
+    while offset < size:
+        try:
+            data = os.lseek(fd, offset, os.SEEK_DATA)
+        except OSError as err:
+            if err.errno == errno.ENXIO:
+                # only a hole left until the end of the file
+                return
+            if err.errno == errno.EINVAL:
+                # SEEK_DATA is not supported, so treat everything as data
+                yield offset, size - offset
+                return
+            raise
+        hole = os.lseek(fd, data, os.SEEK_HOLE)
+        yield data, hole - data
+        offset = hole
+
+
+def copy_file(src, dst) -> int:
+    """Copy `src` to `dst`, moving as little data as possible.
+
+    Tries, in order:
+    - reflinking the whole file (FICLONE), which does not move any data,
+    - copying only the data segments of `src` (skipping holes, which are
+      plentiful e.g. in memory snapshots of recently booted microVMs) using
+      `copy_file_range`, which lets the kernel do the copy,
+    - falling back to reading and writing the data segments if
+      `copy_file_range` is not supported.
+
+    Returns the number of bytes actually copied.
+    """
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        src_fd, dst_fd = fsrc.fileno(), fdst.fileno()
+        if reflink(src_fd, dst_fd):
+            return 0
+
+        size = os.fstat(src_fd).st_size
+        os.ftruncate(dst_fd, size)
+        return sum(
+            _copy_range(src_fd, dst_fd, offset, length)
+            for offset, length in _data_segments(src_fd, size)
+        )
+
+
 def pvh_supported() -> bool:
     """Checks if PVH boot is supported"""
     return platform.architecture() == "x86_64"
@@ -2,12 +2,18 @@
 # SPDX-License-Identifier: Apache-2.0
 """File containing utility methods for iperf-based performance tests"""
 
+import asyncio
 import concurrent.futures
 import json
 import time
+from collections import defaultdict
+from dataclasses import dataclass, field
+
+import numpy as np
 
 from framework import utils
-from framework.utils import CmdBuilder, CpuMap, track_cpu_utilization
+from framework.utils import CmdBuilder, CpuMap
+from host_tools.cpu_load import ThreadCpuSampler, track_cpu_utilization
 
 
 class IPerf3Test:
@@ -75,7 +81,7 @@ class IPerf3Test:
             data = {"cpu_load_raw": cpu_load_future.result(), "g2h": [], "h2g": []}
 
             for mode, future in clients:
-                data[mode].append(json.loads(future.result()))
+                data[mode].append(future.result())
 
             return data
 
@@ -119,7 +125,12 @@ class IPerf3Test:
             .build()
         )
 
-        return self._microvm.ssh.check_output(cmd).stdout
+        # iperf3 prints a single JSON document once it is done, which we parse
+        # while receiving it
+        timeout = self._runtime + self._omit + 60
+        with self._microvm.ssh.stream(cmd, timeout, check=True) as output:
+            [result] = output.json_objects()
+        return result
 
     def host_command(self, port_offset):
         """Builds the command used for spawning an iperf3 server on the host"""
@@ -174,3 +185,226 @@ def emit_iperf3_metrics(metrics, iperf_result, omit):
             sum(interval["sum"]["bits_per_second"] for interval in point_in_time),
             "Bits/Second",
         )
+
+
+@dataclass
+class FleetResult:
+    """Per interval throughput and per thread CPU usage of a `IPerf3Fleet` run
+
+    Both are aligned to the same one second intervals, after the warm up.
+    """
+
+    # (vm index, tap name, direction) -> bits per second in each interval,
+    # summed over the connections on that tap
+    throughput: dict = field(default_factory=lambda: defaultdict(lambda: 0))
+    # (vm index, thread name) -> percent of a host CPU in each interval
+    cpu: dict = field(default_factory=dict)
+
+    @property
+    def intervals(self):
+        """Number of intervals for which there is both throughput and CPU data"""
+        series = list(self.throughput.values()) + list(self.cpu.values())
+        return min(len(values) for values in series)
+
+    @property
+    def modes(self):
+        """The directions in which there was traffic"""
+        return sorted({mode for _, _, mode in self.throughput})
+
+    def total_throughput(self, mode=None):
+        """Aggregate bits per second of all microVMs (in direction `mode`, if given) in each interval"""
+        return sum(
+            (
+                values[: self.intervals]
+                for (_, _, direction), values in self.throughput.items()
+                if mode in (None, direction)
+            ),
+            np.zeros(self.intervals),
+        )
+
+    def host_cores(self):
+        """Number of host CPUs used by all Firecracker threads in each interval"""
+        return (
+            np.nansum(
+                np.stack([values[: self.intervals] for values in self.cpu.values()]),
+                axis=0,
+            )
+            / 100
+        )
+
+    def throughput_per_host_core(self):
+        """Aggregate bits per second per host CPU used by Firecracker, in each interval"""
+        return self.total_throughput() / self.host_cores()
+
+    def rows(self):
+        """The whole dataset, as one flat dict per series and interval"""
+        for (vm_idx, tap, mode), values in self.throughput.items():
+            for interval, value in enumerate(values[: self.intervals]):
+                yield {
+                    "vm": vm_idx,
+                    "tap": tap,
+                    "mode": mode,
+                    "interval": interval,
+                    "bits_per_second": value,
+                }
+        for (vm_idx, thread), values in self.cpu.items():
+            for interval, value in enumerate(values[: self.intervals]):
+                yield {
+                    "vm": vm_idx,
+                    "thread": thread,
+                    "interval": interval,
+                    "cpu_percent": value,
+                }
+
+    def save(self, path):
+        """Write the dataset to `path` as JSON lines"""
+        with open(path, "w", encoding="utf-8") as file:
+            for row in self.rows():
+                file.write(json.dumps(row, default=float) + "\n")
+
+
+class IPerf3Fleet:
+    """Runs iperf3 on all network interfaces of many microVMs at the same time
+
+    Every interface of every microVM gets `connections` iperf3 clients in
+    the guest, each talking to its own iperf3 server in the microVM's
+    network namespace. Neither is pinned, as the point is to measure how
+    much traffic the host can push when it is shared by many microVMs.
+    """
+
+    def __init__(
+        self,
+        microvms,
+        *,
+        base_port,
+        runtime,
+        omit,
+        mode,
+        connections,
+        iperf="iperf3",
+        payload_length="DEFAULT",
+    ):
+        self._microvms = microvms
+        self._runtime = runtime
+        self._omit = omit
+        self._connections = connections
+        # One IPerf3Test per interface, for building the commands, with
+        # consecutive port ranges as the interfaces share a network namespace
+        self._tests = [
+            [
+                IPerf3Test(
+                    microvm=vm,
+                    base_port=base_port + iface_idx * connections,
+                    runtime=runtime,
+                    omit=omit,
+                    mode=mode,
+                    num_clients=connections,
+                    connect_to=iface["iface"].host_ip,
+                    iperf=iperf,
+                    payload_length=payload_length,
+                )
+                for iface_idx, iface in enumerate(vm.iface.values())
+            ]
+            for vm in microvms
+        ]
+
+    def _start_servers(self):
+        for vm, tests in zip(self._microvms, self._tests):
+            servers = [
+                test.host_command(idx).build()
+                for test in tests
+                for idx in range(self._connections)
+            ]
+            vm.netns.check_output(f"sh -c '{' && '.join(servers)}'")
+
+    def _clients_command(self, vm, tests):
+        """A single shell command running all iperf3 clients of `vm`, and printing their results in order"""
+        clients = []
+        for iface_idx, test in enumerate(tests):
+            for idx in range(self._connections):
+                stream = iface_idx * self._connections + idx
+                cmd = (
+                    test.guest_command(idx)
+                    .with_arg(test.client_mode_to_iperf3_flag(test.client_mode(idx)))
+                    .with_arg("--affinity", stream % vm.vcpus_count)
+                    .with_arg("--logfile", f"/tmp/iperf3-{stream}.json")
+                    .build()
+                )
+                clients.append(f"{cmd} &")
+        logs = " ".join(f"/tmp/iperf3-{idx}.json" for idx in range(len(clients)))
+        return f"rm -f {logs}; {' '.join(clients)} wait; cat {logs}"
+
+    async def _run_clients(self):
+        timeout = self._runtime + self._omit + 60
+        return await asyncio.gather(
+            *(
+                vm.ssh.arun(self._clients_command(vm, tests), timeout, check=True)
+                for vm, tests in zip(self._microvms, self._tests)
+            )
+        )
+
+    def run_test(self):
+        """Run iperf3 on all microVMs, and collect a `FleetResult`"""
+        self._start_servers()
+        # Wait for the iperf3 servers to start
+        time.sleep(2)
+
+        samplers = [ThreadCpuSampler(vm.firecracker_pid) for vm in self._microvms]
+        for sampler in samplers:
+            sampler.start()
+        try:
+            outputs = asyncio.run(self._run_clients())
+        finally:
+            for sampler in samplers:
+                sampler.stop()
+
+        result = FleetResult()
+        for vm_idx, (vm, tests, output) in enumerate(
+            zip(self._microvms, self._tests, outputs)
+        ):
+            reports = _json_documents(output.stdout)
+            for test, iface in zip(tests, vm.iface.values()):
+                tap = iface["iface"].tap_name
+                for idx in range(self._connections):
+                    report = next(reports)
+                    assert "error" not in report, f"{vm.id}/{tap}: {report['error']}"
+                    # Drop the warm up, and a possible short interval at the end
+                    intervals = report["intervals"][self._omit :][: self._runtime]
+                    series = np.array(
+                        [interval["sum"]["bits_per_second"] for interval in intervals]
+                    )
+                    key = (vm_idx, tap, test.client_mode(idx))
+                    result.throughput[key] = result.throughput[key] + series
+
+        for vm_idx, sampler in enumerate(samplers):
+            # The samplers started along with the clients, i.e. before the warm up
+            for thread, values in sampler.utilization(window_s=1).items():
+                result.cpu[(vm_idx, thread)] = values[self._omit :]
+
+        return result
+
+
+def _json_documents(text):
+    """Yield the JSON documents in `text`, which follow each other separated by whitespace"""
+    decoder = json.JSONDecoder()
+    offset = 0
+    while True:
+        offset = len(text) - len(text[offset:].lstrip())
+        if offset == len(text):
+            return
+        document, offset = decoder.raw_decode(text, offset)
+        yield document
+
+
+def emit_fleet_metrics(metrics, result: FleetResult):
+    """Consume the `FleetResult` produced by the high density network performance tests"""
+    names = {"g2h": "throughput_guest_to_host", "h2g": "throughput_host_to_guest"}
+    for mode in result.modes:
+        for value in result.total_throughput(mode):
+            metrics.put_metric(names[mode], value, "Bits/Second")
+    for value in result.total_throughput():
+        metrics.put_metric("throughput", value, "Bits/Second")
+    for value in result.host_cores():
+        metrics.put_metric("host_cores_used", value, "Count")
+    for value in result.throughput_per_host_core():
+        metrics.put_metric("throughput_per_host_core", value, "Bits/Second")
@@ -0,0 +1,250 @@
+# Copyright 2025 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+"""Time resolved measurements of how closely devices follow their rate limiters.
+
+A greedy load is driven through a rate limited device, while the bytes that
+went through it are sampled on the host every 10 ms. The resulting trace is
+compared against the envelope of the configured token bucket: at no point
+can more than `one_time_burst + size + rate * t` bytes have gone through,
+and a greedy load should get close to it.
+"""
+
+import concurrent.futures
+import os
+import time
+from dataclasses import dataclass
+from threading import Event, Thread
+
+import numpy as np
+
+from host_tools.cpu_load import ThreadCpuSampler
+
+# A rate of more than this much above the configured one counts as a burst
+BURST_TOLERANCE = 1.1
+
+
+@dataclass(frozen=True)
+class Bucket:
+    """A bandwidth token bucket, as configured through the API"""
+
+    size: int
+    refill_time: int
+    one_time_burst: int = 0
+
+    @property
+    def rate(self):
+        """The sustained rate the bucket allows, in bytes per second"""
+        return self.size * 1000 / self.refill_time
+
+    def rate_limiter(self):
+        """The rate limiter API object with this bucket for bandwidth"""
+        bandwidth = {"size": self.size, "refill_time": self.refill_time}
+        if self.one_time_burst:
+            bandwidth["one_time_burst"] = self.one_time_burst
+        return {"bandwidth": bandwidth}
+
+
+class ByteCounterSampler(Thread):
+    """Samples a cumulative byte counter, returned by `read`, at `rate_hz`"""
+
+    def __init__(self, read, rate_hz: float = 100, max_samples: int = 360_000):
+        super().__init__(daemon=True)
+        self._read = read
+        self.interval_s = 1 / rate_hz
+        self.timestamps = np.full(max_samples, np.nan)
+        self.values = np.full(max_samples, np.nan)
+        self.samples = 0
+        self._stop_event = Event()
+
+    def run(self):
+        next_sample = time.monotonic()
+        while self.samples < len(self.values):
+            before = time.monotonic()
+            self.values[self.samples] = self._read()
+            self.timestamps[self.samples] = (before + time.monotonic()) / 2
+            self.samples += 1
+            next_sample += self.interval_s
+            if self._stop_event.wait(max(next_sample - time.monotonic(), 0)):
+                break
+
+    def stop(self):
+        """Stop sampling, and wait for the sampler to finish"""
+        self._stop_event.set()
+        self.join()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+class ProcIoCounter:
+    """Reads `field` (e.g. "rchar" or "wchar") of /proc/<pid>/io, keeping the file open"""
+
+    def __init__(self, pid, field):
+        self.field = field
+        self._fd = os.open(f"/proc/{pid}/io", os.O_RDONLY)
+
+    def __call__(self):
+        for line in os.pread(self._fd, 4096, 0).decode().splitlines():
+            name, _, value = line.partition(": ")
+            if name == self.field:
+                return int(value)
+        raise KeyError(self.field)
+
+    def close(self):
+        """Close the file"""
+        os.close(self._fd)
+
+
+@dataclass
+class RateLimiterTrace:
+    """The bytes that went through a rate limited device over time"""
+
+    # Seconds since the load started
+    timestamps: np.ndarray
+    # Bytes since the load started
+    transferred: np.ndarray
+    # (seconds since the load started, `Bucket`) for every bucket configured
+    phases: list
+    # Seconds of host CPU time used by the VMM thread
+    vmm_cpu_s: float
+
+    @property
+    def duration_s(self):
+        """Length of the trace"""
+        return self.timestamps[-1]
+
+    def _phase_bounds(self, idx):
+        start = self.phases[idx][0]
+        end = self.phases[idx + 1][0] if idx + 1 < len(self.phases) else np.inf
+        return start, min(end, self.duration_s)
+
+    def _transferred_at(self, seconds):
+        return np.interp(seconds, self.timestamps, self.transferred)
+
+    def rates(self, window_s=0.01):
+        """Start of each `window_s` long window, and the bytes per second in it"""
+        grid = np.arange(0, self.duration_s, window_s)
+        return grid[:-1], np.diff(self._transferred_at(grid)) / window_s
+
+    def envelope(self):
+        """The most bytes the configured buckets allow to have gone through by each sample
+
+        A bucket configured later (i.e. through a PATCH) starts out full.
+        """
+        allowed = np.full(len(self.timestamps), np.inf)
+        for idx, (_, bucket) in enumerate(self.phases):
+            start, end = self._phase_bounds(idx)
+            in_phase = (self.timestamps >= start) & (self.timestamps <= end)
+            allowed[in_phase] = (
+                self._transferred_at(start)
+                + bucket.one_time_burst
+                + bucket.size
+                + bucket.rate * (self.timestamps[in_phase] - start)
+            )
+        return allowed
+
+    def conformance_excess(self):
+        """The most bytes that went through beyond what the buckets allow, at any point in time"""
+        return max(np.max(self.transferred - self.envelope()), 0)
+
+    def phase_stats(self, idx):
+        """Accuracy and burst shape of the bucket configured in phase `idx`
+
+        The burst lasts until the rate (over 100 ms) first drops to within
+        `BURST_TOLERANCE` of the configured one. Its size is the number of
+        bytes that went through on top of the configured rate, which with a
+        greedy load should be `size + one_time_burst`. Afterwards, the rate
+        is steady, and compared to the configured one over 100 ms and 10 ms
+        windows.
+        """
+        start, end = self._phase_bounds(idx)
+        bucket = self.phases[idx][1]
+
+        windows, rates = self.rates(0.1)
+        in_phase = (windows >= start) & (windows + 0.1 <= end)
+        conforming = in_phase & (rates <= bucket.rate * BURST_TOLERANCE)
+        burst_end = windows[np.argmax(conforming)] if conforming.any() else end
+        steady = in_phase & (windows >= burst_end)
+
+        fine_windows, fine_rates = self.rates(0.01)
+        fine_steady = (fine_windows >= burst_end) & (fine_windows + 0.01 <= end)
+        fine_error = (fine_rates[fine_steady] - bucket.rate) / bucket.rate * 100
+
+        burst_bytes = (
+            self._transferred_at(burst_end)
+            - self._transferred_at(start)
+            - bucket.rate * (burst_end - start)
+        )
+        return {
+            "rate_error": (np.median(rates[steady]) - bucket.rate) / bucket.rate * 100,
+            "rate_error_10ms_p1": np.percentile(fine_error, 1),
+            "rate_error_10ms_p99": np.percentile(fine_error, 99),
+            "burst_bytes": burst_bytes,
+            "burst_error": (
+                (burst_bytes - bucket.size - bucket.one_time_burst)
+                / (bucket.size + bucket.one_time_burst)
+                * 100
+            ),
+            "burst_duration": burst_end - start,
+        }
+
+    def save(self, path):
+        """Store the trace in a compressed .npz file"""
+        np.savez_compressed(
+            path,
+            timestamps=self.timestamps,
+            transferred=self.transferred,
+            phase_starts=np.array([start for start, _ in self.phases]),
+            buckets=np.array(
+                [
+                    (bucket.size, bucket.refill_time, bucket.one_time_burst)
+                    for _, bucket in self.phases
+                ]
+            ),
+        )
+
+
+def trace_rate_limiter(microvm, counter, load, patch, buckets, phase_duration_s):
+    """Trace how a greedy load goes through a rate limited device.
+
+    `counter` returns the cumulative number of bytes that went through the
+    device, `load(duration_s)` drives the device for `duration_s` seconds and
+    `patch(bucket)` configures the rate limiter with a `Bucket`.
+
+    Each of `buckets` is configured for `phase_duration_s` seconds in turn.
+    The first one is configured (i.e. filled) just before the load starts,
+    the others while it is running.
+    """
+    patch(buckets[0])
+    # Let the bucket fill up
+    time.sleep(buckets[0].refill_time / 1000)
+
+    phases = []
+    with (
+        ThreadCpuSampler(microvm.firecracker_pid, rate_hz=10) as cpu,
+        ByteCounterSampler(counter) as sampler,
+        concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor,
+    ):
+        start = time.monotonic()
+        running = executor.submit(load, len(buckets) * phase_duration_s)
+        phases.append((0.0, buckets[0]))
+        for idx, bucket in enumerate(buckets[1:], 1):
+            time.sleep(max(start + idx * phase_duration_s - time.monotonic(), 0))
+            patch(bucket)
+            phases.append((time.monotonic() - start, bucket))
+        running.result()
+
+    timestamps = sampler.timestamps[: sampler.samples]
+    values = sampler.values[: sampler.samples]
+    # Start from the last sample before the load
+    first = max(np.searchsorted(timestamps, start) - 1, 0)
+    return RateLimiterTrace(
+        timestamps=timestamps[first:] - start,
+        transferred=values[first:] - values[first],
+        phases=phases,
+        vmm_cpu_s=cpu.totals().get("firecracker", 0.0),
+    )
@@ -0,0 +1,217 @@
+# Copyright 2025 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+"""Small-packet UDP benchmarks between a guest and its network namespace on the host"""
+
+import json
+import shlex
+import socket
+import struct
+import subprocess
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from framework.http_api import LatencyHistogram
+from host_tools import netlink
+from host_tools.cpu_load import ThreadCpuSampler
+
+HOST_TOOL = Path(__file__).parent.parent / "host_tools" / "udp_pps.py"
+GUEST_TOOL = "/tmp/udp_pps.py"
+
+# How long to wait for a response before considering the request lost
+RR_TIMEOUT_S = 1
+
+
+@dataclass
+class UdpResult:
+    """Packets that went through the virtio-net device, and the host CPU time spent on them"""
+
+    packets: int
+    duration_s: float
+    # Per Firecracker thread name, seconds of host CPU time
+    cpu_s: dict
+    # Round trip times, for request/response runs
+    rtt: LatencyHistogram = field(default_factory=LatencyHistogram)
+    lost: int = 0
+
+    @property
+    def pps(self):
+        """Packets per second"""
+        return self.packets / self.duration_s
+
+    def cpu_per_packet_us(self, prefix):
+        """Microseconds of host CPU time spent per packet by threads whose name starts with `prefix`"""
+        cpu_s = sum(
+            value for name, value in self.cpu_s.items() if name.startswith(prefix)
+        )
+        return cpu_s / self.packets * 1e6
+
+
+def _flood_duration(summaries, senders):
+    """How long concurrent `udp_pps.py flood` processes sent packets, from their JSON summaries
+
+    Each flood only times its own sending, not e.g. starting the process (or
+    ssh), so this is the longest of their durations.
+    """
+    durations = [json.loads(summary)["duration_s"] for summary in summaries]
+    assert len(durations) == senders, summaries
+    return max(durations)
+
+
+class UdpBenchmark:
+    """UDP request/response and packets per second benchmarks over one interface of a microVM
+
+    The guest side runs `host_tools/udp_pps.py`. On the host, request/response
+    is driven from this process, through a socket opened in the microVM's
+    network namespace, and floods are sent by `udp_pps.py` processes.
+    """
+
+    def __init__(self, microvm, *, port=5300, payload_size=64, iface="eth0"):
+        assert payload_size >= 8, "requests carry a 64 bit sequence number"
+        self._vm = microvm
+        self._iface = microvm.iface[iface]["iface"]
+        self._tap = microvm.iface[iface]["tap"]
+        self._port = port
+        self._payload_size = payload_size
+        microvm.ssh.scp_put(HOST_TOOL, GUEST_TOOL)
+
+    def _guest_tool(self, *args):
+        return f"python3 {GUEST_TOOL} {' '.join(str(arg) for arg in args)}"
+
+    def _host_tool(self, *args):
+        return [
+            *shlex.split(self._vm.netns.cmd_prefix()),
+            "python3",
+            str(HOST_TOOL),
+            *(str(arg) for arg in args),
+        ]
+
+    @contextmanager
+    def _guest_server(self, mode, duration_s):
+        """Run `udp_pps.py` as a server in the guest for the duration of the block"""
+        command = self._guest_tool(mode, self._iface.guest_ip, self._port, duration_s)
+        # Matches the server, but not the shell running pkill
+        pattern = shlex.quote(f"[p]ython3 {GUEST_TOOL} {mode}")
+        try:
+            with self._vm.ssh.stream(command) as stream:
+                objects = stream.json_objects()
+                assert next(objects) == {"listening": self._port}
+                yield
+        finally:
+            # Closing the stream only kills ssh on the host, so stop the server
+            # in the guest, and wait until its port is free for the next one
+            self._vm.ssh.check_output(
+                f"pkill -KILL -f {pattern}; "
+                f"while pgrep -f {pattern} >/dev/null; do sleep 0.01; done"
+            )
+
+    def _guest_rx_packets(self):
+        _, stdout, _ = self._vm.ssh.check_output(
+            f"cat /sys/class/net/{self._iface.dev_name}/statistics/rx_packets"
+        )
+        return int(stdout)
+
+    def request_response(self, duration_s, warmup_s=2):
+        """Send one request at a time to an echo server in the guest, recording round trip times"""
+        with netlink.in_netns(self._vm.netns.path):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.settimeout(RR_TIMEOUT_S)
+        sock.bind((self._iface.host_ip, 0))
+        sock.connect((self._iface.guest_ip, self._port))
+        request = bytearray(self._payload_size)
+        response = bytearray(self._payload_size)
+        rtt = LatencyHistogram()
+        lost = 0
+
+        def exchange(seq):
+            struct.pack_into("=Q", request, 0, seq)
+            start = time.perf_counter_ns()
+            sock.send(request)
+            # Skip late responses to earlier requests
+            while True:
+                size = sock.recv_into(response)
+                if size >= 8 and struct.unpack_from("=Q", response)[0] == seq:
+                    return time.perf_counter_ns() - start
+
+        with sock, self._guest_server("echo", warmup_s + duration_s + 10):
+            seq = 0
+            deadline = time.monotonic() + warmup_s
+            while time.monotonic() < deadline:
+                seq += 1
+                try:
+                    exchange(seq)
+                except TimeoutError:
+                    pass
+
+            with ThreadCpuSampler(self._vm.firecracker_pid) as sampler:
+                start = time.monotonic()
+                deadline = start + duration_s
+                while time.monotonic() < deadline:
+                    seq += 1
+                    try:
+                        rtt.record(exchange(seq))
+                    except TimeoutError:
+                        lost += 1
+                duration_s = time.monotonic() - start
+
+        return UdpResult(
+            # Every exchange is one packet in each direction
+            packets=2 * len(rtt),
+            duration_s=duration_s,
+            cpu_s=sampler.totals(),
+            rtt=rtt,
+            lost=lost,
+        )
+
+    def pps(self, mode, duration_s, senders=1):
+        """Flood the receiving side (the host for "g2h", the guest for "h2g") from `senders` processes
+
+        Counts the packets the receiving side's network interface received,
+        i.e. all the packets that made it through the virtio-net device.
+        """
+        if mode == "g2h":
+            # A sink on the host, so that the packets are not answered with ICMP
+            sink_cmd = self._host_tool(
+                "sink", self._iface.host_ip, self._port, duration_s + 10
+            )
+            flood = self._guest_tool(
+                "flood", self._iface.host_ip, self._port, self._payload_size, duration_s
+            )
+            with subprocess.Popen(sink_cmd, stdout=subprocess.PIPE, text=True) as sink:
+                try:
+                    listening = json.loads(sink.stdout.readline())
+                    assert listening == {"listening": self._port}
+                    with ThreadCpuSampler(self._vm.firecracker_pid) as sampler:
+                        before = self._tap.stats()["rx_packets"]
+                        _, stdout, _ = self._vm.ssh.check_output(
+                            f"for i in $(seq {senders}); do {flood} & done; wait",
+                            timeout=duration_s + 60,
+                        )
+                        packets = self._tap.stats()["rx_packets"] - before
+                finally:
+                    sink.kill()
+            duration_s = _flood_duration(stdout.splitlines(), senders)
+        else:
+            flood = self._host_tool(
+                "flood",
+                self._iface.guest_ip,
+                self._port,
+                self._payload_size,
+                duration_s,
+            )
+            with self._guest_server("sink", duration_s + 10):
+                with ThreadCpuSampler(self._vm.firecracker_pid) as sampler:
+                    before = self._guest_rx_packets()
+                    floods = [
+                        subprocess.Popen(flood, stdout=subprocess.PIPE, text=True)
+                        for _ in range(senders)
+                    ]
+                    summaries = []
+                    for proc in floods:
+                        summaries.append(proc.communicate(timeout=duration_s + 60)[0])
+                        assert proc.returncode == 0
+                    packets = self._guest_rx_packets() - before
+            duration_s = _flood_duration(summaries, senders)
+
+        return UdpResult(packets=packets, duration_s=duration_s, cpu_s=sampler.totals())
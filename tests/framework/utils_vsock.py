@@ -38,7 +38,7 @@ class HostEchoWorker(Thread):
         self.blob_path = blob_path
         self.hash = None
         self.error = None
-        self.sock = _vsock_connect_to_guest(self.uds_path, ECHO_SERVER_PORT)
+        self.sock = vsock_connect_to_guest(self.uds_path, ECHO_SERVER_PORT)
 
     def run(self):
         """Thread code payload.
@@ -202,7 +202,7 @@ def make_host_port_path(uds_path, port):
     return "{}_{}".format(uds_path, port)
 
 
-def _vsock_connect_to_guest(uds_path, port):
+def vsock_connect_to_guest(uds_path, port):
     """Return a Unix socket, connected to the guest vsock port `port`."""
     sock = socket(AF_UNIX, SOCK_STREAM)
     sock.connect(uds_path)
@@ -217,14 +217,11 @@ def _vsock_connect_to_guest(uds_path, port):
 
 
 def _copy_vsock_data_to_guest(ssh_connection, blob_path, vm_blob_path, vsock_helper):
-    # Copy the data file and a vsock helper to the guest.
-
-    cmd = "mkdir -p /tmp/vsock"
-    ecode, _, _ = ssh_connection.run(cmd)
-    assert ecode == 0, "Failed to set up tmpfs drive on the guest."
-
-    ssh_connection.scp_put(vsock_helper, "/tmp/vsock_helper")
-    ssh_connection.scp_put(blob_path, vm_blob_path)
+    # Copy the data file and a vsock helper to the guest, in a single transfer.
+    ssh_connection.tar_put(
+        [(vsock_helper, "tmp/vsock_helper"), (blob_path, vm_blob_path.lstrip("/"))],
+        "/",
+    )
 
 
 def check_vsock_device(vm, bin_vsock_path, test_fc_session_root_path, ssh_connection):
@@ -1,10 +1,21 @@
 # Copyright 2018 Amazon.com, Inc. or its affiliates. All Rights Reserved.
 # SPDX-License-Identifier: Apache-2.0
 """Utilities for measuring cpu utilisation for a process."""
+import logging
+import os
 import time
-from threading import Thread
+from collections import defaultdict
+from threading import Event, Thread
+from typing import Dict
 
-from framework import utils
+import numpy as np
+
+LOG = logging.getLogger("cpu_load")
+
+CLOCK_TICKS_PER_S = os.sysconf("SC_CLK_TCK")
+
+# Columns of the per thread counter arrays of `ThreadCpuSampler`
+COUNTERS = ("utime", "stime", "runtime", "run_delay")
 
 
 class CpuLoadExceededException(Exception):
@@ -61,17 +72,14 @@ class CpuLoadMonitor(Thread):
 
         It is up to the caller to check the queue.
         """
-        while not self._should_stop:
-            utilization = utils.get_cpu_utilization(self._process_pid)
+        with ThreadCpuSampler(self._process_pid, rate_hz=20) as sampler:
+            while not self._should_stop:
+                time.sleep(0.05)  # 50 milliseconds granularity.
 
-            try:
-                fc_thread_util = utilization["firecracker"]
-                if fc_thread_util > self._threshold:
-                    self._cpu_load_samples.append(fc_thread_util)
-            except KeyError:
-                pass  # no firecracker process
-
-            time.sleep(0.05)  # 50 milliseconds granularity.
+        # Per second utilization of the main thread (no firecracker process if missing)
+        for fc_thread_util in sampler.utilization(window_s=1).get("firecracker", []):
+            if fc_thread_util > self._threshold:
+                self._cpu_load_samples.append(fc_thread_util)
 
     def check_samples(self):
         """Check that there are no samples above the threshold."""
@@ -89,6 +97,185 @@ class CpuLoadMonitor(Thread):
 
     def __exit__(self, _type, _value, _traceback):
         """Exit context"""
-        self.check_samples()
         self.signal_stop()
         self.join()
+        self.check_samples()
+
+
+class ThreadCpuSampler(Thread):
+    """Samples the CPU usage of every thread of a process from /proc, at `rate_hz`.
+
+    Each sample reads the cumulative user and system time of each thread from
+    `/proc/<pid>/task/<tid>/stat`, and the time it spent running and waiting
+    for a CPU from `/proc/<pid>/task/<tid>/schedstat`, into preallocated
+    arrays. The files are kept open, so that a sample does not spawn any
+    processes or even open any files. Values per interval are only computed
+    after sampling stopped, as differences of consecutive samples.
+    """
+
+    def __init__(self, pid: int, rate_hz: float = 100, max_samples: int = 36_000):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval_s = 1 / rate_hz
+        self.max_samples = max_samples
+        self.timestamps = np.full(max_samples, np.nan)
+        self.samples = 0
+        # Thread name and (max_samples, len(COUNTERS)) array of cumulative
+        # counters (in seconds), per thread ID
+        self.names = {}
+        self.counters = {}
+        self._files = {}
+        self._stop_event = Event()
+
+    def _open_thread(self, tid):
+        task_dir = f"/proc/{self.pid}/task/{tid}"
+        try:
+            self._files[tid] = (
+                os.open(f"{task_dir}/stat", os.O_RDONLY),
+                os.open(f"{task_dir}/schedstat", os.O_RDONLY),
+            )
+        except FileNotFoundError:
+            # The thread exited in the meantime
+            return
+        self.counters[tid] = np.full((self.max_samples, len(COUNTERS)), np.nan)
+
+    def _close_thread(self, tid):
+        for fd in self._files.pop(tid):
+            os.close(fd)
+
+    def _sample(self):
+        """Read the counters of all threads. Returns False once the process is gone"""
+        try:
+            tids = os.listdir(f"/proc/{self.pid}/task")
+        except FileNotFoundError:
+            return False
+
+        idx = self.samples
+        self.timestamps[idx] = time.monotonic()
+        for tid in tids:
+            if tid not in self._files:
+                self._open_thread(tid)
+
+        for tid, (stat_fd, schedstat_fd) in list(self._files.items()):
+            try:
+                stat = os.pread(stat_fd, 4096, 0).decode()
+                schedstat = os.pread(schedstat_fd, 4096, 0).split()
+            except ProcessLookupError:
+                self._close_thread(tid)
+                continue
+
+            # The thread name can contain spaces and parentheses, so split
+            # at the last closing parenthesis.
+            name, _, fields = stat.partition(" (")[2].rpartition(") ")
+            self.names[tid] = name
+            fields = fields.split()
+            self.counters[tid][idx] = (
+                int(fields[11]) / CLOCK_TICKS_PER_S,
+                int(fields[12]) / CLOCK_TICKS_PER_S,
+                int(schedstat[0]) / 1e9,
+                int(schedstat[1]) / 1e9,
+            )
+
+        self.samples += 1
+        return True
+
+    def run(self):
+        next_sample = time.monotonic()
+        while self.samples < self.max_samples and self._sample():
+            next_sample += self.interval_s
+            if self._stop_event.wait(max(next_sample - time.monotonic(), 0)):
+                break
+        else:
+            if self.samples == self.max_samples:
+                LOG.warning("Stopped sampling CPU usage of %d, buffer full", self.pid)
+
+        for tid in list(self._files):
+            self._close_thread(tid)
+
+    def stop(self):
+        """Stop sampling, and wait for the sampler to finish"""
+        self._stop_event.set()
+        self.join()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def utilization(self, counter="runtime", window_s=None) -> Dict[str, np.ndarray]:
+        """Per thread name, the share of `counter` (in percent of one CPU) in each interval.
+
+        Intervals are the ones between consecutive samples, or `window_s`
+        seconds if given. Threads sharing the same name are summed up. Values
+        are NaN for intervals in which a thread did not exist (yet).
+        """
+        if self.samples < 2:
+            return {}
+
+        column = COUNTERS.index(counter)
+        rows = np.arange(self.samples)
+        if window_s is not None:
+            timestamps = self.timestamps[: self.samples]
+            # Tolerate the last window being one sampling interval short
+            boundaries = np.arange(
+                timestamps[0], timestamps[-1] + self.interval_s, window_s
+            )
+            rows = np.minimum(np.searchsorted(timestamps, boundaries), self.samples - 1)
+        elapsed = np.diff(self.timestamps[rows])
+
+        by_name = defaultdict(list)
+        for tid, name in self.names.items():
+            by_name[name].append(np.diff(self.counters[tid][rows, column]) / elapsed)
+
+        result = {}
+        for name, usages in by_name.items():
+            usages = np.stack(usages)
+            result[name] = np.where(
+                np.isnan(usages).all(axis=0), np.nan, np.nansum(usages, axis=0) * 100
+            )
+        return result
+
+    def percentiles(self, counter="runtime", qs=(50, 90, 99)):
+        """Per thread name, percentiles of the share of `counter` in each interval between samples"""
+        return {
+            name: {f"p{q:g}": np.nanpercentile(usage, q) for q in qs}
+            for name, usage in self.utilization(counter).items()
+            if not np.isnan(usage).all()
+        }
+
+    def totals(self, counter="runtime") -> Dict[str, float]:
+        """Per thread name, the amount of `counter` (in seconds) accumulated while sampling"""
+        column = COUNTERS.index(counter)
+        result = defaultdict(float)
+        for tid, name in self.names.items():
+            values = self.counters[tid][: self.samples, column]
+            values = values[~np.isnan(values)]
+            if len(values) > 0:
+                result[name] += values[-1] - values[0]
+        return dict(result)
+
+
+def track_cpu_utilization(
+    pid: int, iterations: int, omit: int, rate_hz: float = 100
+) -> Dict[str, list[float]]:
+    """Tracks cpu utilization of a process for `iterations` seconds, sampling at
+    `rate_hz`, and returns the per thread utilization of each second. Sleeps for
+    first `omit` seconds.
+    """
+    assert iterations > 0
+
+    # Sleep first `omit` secconds
+    time.sleep(omit)
+
+    sampler = ThreadCpuSampler(pid, rate_hz)
+    with sampler:
+        time.sleep(iterations)
+
+    cpu_utilization = sampler.utilization(window_s=1)
+    assert len(cpu_utilization) > 0
+    return {
+        name: [value for value in values if not np.isnan(value)]
+        for name, values in cpu_utilization.items()
+    }
@@ -2,46 +2,136 @@
 # SPDX-License-Identifier: Apache-2.0
 """Utilities for creating filesystems on the host."""
 
+import itertools
 import os
+import shutil
 import tempfile
 
-from framework import utils
+from framework import defs, utils
 
+MB = 2**20
 
-class FilesystemFile:
-    """Facility for creating and working with filesystems."""
+
+class DriveFactory:
+    """Creates filesystem files by cloning pre-formatted images.
+
+    Every (size, format) combination is only formatted once, into a sparse
+    "golden" image. Drives are then cloned from it: reflinked where the
+    filesystem supports it (btrfs, XFS), so that no data is copied at all,
+    and otherwise copied skipping holes, so that only the few MiB of
+    filesystem metadata are. Either way, the guest writing to one drive does
+    not affect the image or any other drive.
+
+    The factory keeps track of all the files it created, and removes them in
+    `cleanup`.
+    """
 
     KNOWN_FILEFS_FORMATS = {"ext4"}
-    path = None
 
-    def __init__(self, path: str = None, size: int = 256, fs_format: str = "ext4"):
-        """Create a new file system in a file.
+    def __init__(self, cache_dir=None):
+        self._cache_dir = cache_dir
+        self._golden = {}
+        self._created = set()
+        self._counter = itertools.count()
 
-        Raises if the file system format is not supported, if the file already
-        exists, or if it ends in '/'.
+    @property
+    def cache_dir(self):
+        """The directory holding the golden images, created on first use
+
+        Defaults to a directory in the test session root. It is on disk, not
+        in memory, because e.g. the qemu vhost-user-blk backend always uses
+        O_DIRECT, which tmpfs does not support. It is also where the microVM
+        chroots are, so drives created in them can be reflinked.
         """
+        if self._cache_dir is None:
+            os.makedirs(defs.DEFAULT_TEST_SESSION_ROOT_PATH, exist_ok=True)
+            self._cache_dir = tempfile.mkdtemp(
+                prefix="drives-", dir=defs.DEFAULT_TEST_SESSION_ROOT_PATH
+            )
+        return self._cache_dir
 
-        # If no path is supplied, use a temporary file.
-        # This is useful to force placing the file on disk, not in memory,
-        # because qemu vhost-user-blk backend always uses O_DIRECT,
-        # but O_DIRECT is not supported by tmpfs.
-        if path is None:
-            _, path = tempfile.mkstemp(suffix=f".{fs_format}", dir="/tmp")
+    def _golden_image(self, size, fs_format):
+        """The path of the golden image for `size` MiB of `fs_format`, formatting it if needed"""
+        key = (size, fs_format)
+        if key not in self._golden:
+            path = os.path.join(self.cache_dir, f"golden-{size}M.{fs_format}")
+            # A sparse file, mkfs only writes the filesystem metadata
+            with open(path, "wb") as file:
+                file.truncate(size * MB)
+            utils.check_output(f"mkfs.{fs_format} -qF {path}")
+            self._golden[key] = path
+        return self._golden[key]
+
+    def create(self, path=None, size=256, fs_format="ext4", preallocate=False):
+        """Create a file at `path` with a `size` MiB `fs_format` filesystem, returning its path
 
+        If no path is supplied, the file is created in `cache_dir`. With
+        `preallocate`, all blocks of the file are allocated on the host
+        (unwritten, so this is as cheap as a sparse file), so that the guest
+        writing to it does not cause any allocation on the host. Benchmarks
+        want this.
+        """
         if fs_format not in self.KNOWN_FILEFS_FORMATS:
             raise ValueError("Format not in: + " + str(self.KNOWN_FILEFS_FORMATS))
-        # Here we append the format as a
-        path = os.path.join(path + "." + fs_format)
-
-        if os.path.isfile(path):
+        if path is None:
+            path = os.path.join(self.cache_dir, f"scratch-{next(self._counter)}")
+        path = path + "." + fs_format
+        if os.path.exists(path):
             raise FileExistsError("File already exists: " + path)
 
-        utils.check_output(
-            "dd status=none if=/dev/zero"
-            "    of=" + path + "    bs=1M count=" + str(size)
-        )
-        utils.check_output("mkfs.ext4 -qF " + path)
-        self.path = path
+        utils.copy_file(self._golden_image(size, fs_format), path)
+        self._created.add(path)
+        if preallocate:
+            fd = os.open(path, os.O_WRONLY)
+            try:
+                os.posix_fallocate(fd, 0, size * MB)
+            finally:
+                os.close(fd)
+        return path
+
+    def remove(self, path):
+        """Remove a file created by `create`"""
+        self._created.discard(path)
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def cleanup(self):
+        """Remove all files created by `create`, and the golden images"""
+        for path in list(self._created):
+            self.remove(path)
+        self._golden.clear()
+        if self._cache_dir is not None:
+            shutil.rmtree(self._cache_dir, ignore_errors=True)
+            self._cache_dir = None
+
+
+DRIVE_FACTORY = DriveFactory()
+
+
+class FilesystemFile:
+    """Facility for creating and working with filesystems."""
+
+    KNOWN_FILEFS_FORMATS = DriveFactory.KNOWN_FILEFS_FORMATS
+    path = None
+
+    def __init__(
+        self,
+        path: str = None,
+        size: int = 256,
+        fs_format: str = "ext4",
+        preallocate: bool = False,
+        factory: DriveFactory = DRIVE_FACTORY,
+    ):
+        """Create a new file system in a file, at `path` with the format appended.
+
+        Raises if the file system format is not supported, if the file already
+        exists, or if it ends in '/'. The file is removed when `remove` is
+        called, or at the latest when `factory` is cleaned up.
+        """
+        self._factory = factory
+        self.path = factory.create(path, size, fs_format, preallocate)
 
     def __repr__(self):
         return f"<FilesystemFile path={self.path} size={self.size()}>"
@@ -55,10 +145,12 @@ class FilesystemFile:
         """Return the size of the filesystem."""
         return os.stat(self.path).st_size
 
-    def __del__(self):
-        """Destructor cleaning up filesystem from where it was created."""
-        if self.path:
-            try:
-                os.remove(self.path)
-            except OSError:
-                pass
+    def remove(self):
+        """Remove the filesystem file."""
+        self._factory.remove(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.remove()
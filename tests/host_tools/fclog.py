@@ -0,0 +1,198 @@
+# Copyright 2025 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+"""Incremental reading and parsing of Firecracker log files.
+
+Firecracker log lines look like
+
+    2023-06-16T07:45:41.767987318 [anonymous-instance:fc_api:INFO:src/firecracker/src/api_server/mod.rs:123] The API server received ...
+
+where the level and the origin are only present if enabled in the logger
+configuration.
+"""
+
+import ctypes
+import os
+import re
+import select
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from threading import RLock
+
+LOG_LINE_REGEX = re.compile(
+    r"^(?P<timestamp>\d{4}-\d\d-\d\dT[\d:.]+) "
+    r"\[(?P<instance>[^:\]]*):(?P<thread>[^:\]]*)"
+    r"(?::(?P<level>ERROR|WARN|INFO|DEBUG|TRACE))?"
+    r"(?::(?P<origin>[^\]]*))?\] "
+    r"(?P<message>.*)$"
+)
+
+
+# From <sys/inotify.h>
+IN_MODIFY = 0x00000002
+
+_LIBC = ctypes.CDLL(None, use_errno=True)
+
+
+class _ModifyWatch:
+    """Waits for a file to be written to, using inotify"""
+
+    def __init__(self, path: Path):
+        self._fd = _LIBC.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        if _LIBC.inotify_add_watch(self._fd, os.fsencode(path), IN_MODIFY) < 0:
+            errno = ctypes.get_errno()
+            os.close(self._fd)
+            raise OSError(errno, "inotify_add_watch failed", str(path))
+
+    def wait(self, timeout_s):
+        """Block until the file was written to, or `timeout_s` passed"""
+        ready, _, _ = select.select([self._fd], [], [], timeout_s)
+        if ready:
+            # Only whether there were events matters, not how many
+            try:
+                while os.read(self._fd, 4096):
+                    pass
+            except BlockingIOError:
+                pass
+
+    def close(self):
+        """Remove the watch"""
+        os.close(self._fd)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+@dataclass(frozen=True)
+class LogRecord:
+    """A single line of a Firecracker log.
+
+    Lines not following the log format (e.g. the continuation of a multi line
+    message) only have a `message`.
+    """
+
+    message: str
+    timestamp: str = None
+    instance: str = None
+    thread: str = None
+    level: str = None
+    origin: str = None
+
+    @classmethod
+    def parse(cls, line: str):
+        """Parse a line of the log, without trailing newline"""
+        match = LOG_LINE_REGEX.match(line)
+        if match is None:
+            return cls(line)
+        return cls(**match.groupdict())
+
+
+class FCLogReader:
+    """Incrementally reads the log Firecracker appends to its log file.
+
+    Like `FCMetricsReader`, this remembers how far into the file it has
+    already read, so that every line is read and parsed exactly once, no
+    matter how often the log is inspected. Matchers registered with
+    `add_matcher` are called for every record, in order.
+
+    Cursors are indices into the list of all records read so far.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._offset = 0
+        self._partial = b""
+        self._chunks = []
+        self._records = []
+        self._matchers = []
+        # Reentrant, so that matcher callbacks can use the reader
+        self._lock = RLock()
+
+    def _read_new(self):
+        """Parse all complete lines appended to the file since the last call"""
+        with self._lock:
+            with self.path.open("rb") as file:
+                file.seek(self._offset)
+                data = file.read()
+            self._offset += len(data)
+
+            lines = (self._partial + data).split(b"\n")
+            self._partial = lines.pop()
+            lines = [line.decode(errors="replace") for line in lines]
+            if lines:
+                self._chunks.append("\n".join(lines) + "\n")
+            for line in lines:
+                record = LogRecord.parse(line)
+                self._records.append(record)
+                self._dispatch(record)
+
+            return len(self._records)
+
+    def _dispatch(self, record):
+        for regex, callback in self._matchers:
+            if match := regex.search(record.message):
+                callback(record, match)
+
+    def add_matcher(self, pattern, callback):
+        """Call `callback(record, match)` for every record whose message matches `pattern`, including past ones"""
+        self._read_new()
+        with self._lock:
+            regex = re.compile(pattern)
+            for record in self._records:
+                if match := regex.search(record.message):
+                    callback(record, match)
+            self._matchers.append((regex, callback))
+
+    def __len__(self):
+        return self._read_new()
+
+    @property
+    def text(self):
+        """The complete lines of the log read so far"""
+        self._read_new()
+        with self._lock:
+            if len(self._chunks) > 1:
+                self._chunks = ["".join(self._chunks)]
+            return self._chunks[0] if self._chunks else ""
+
+    def since(self, cursor=0):
+        """Return all records from `cursor` onwards"""
+        end = self._read_new()
+        return self._records[cursor:end]
+
+    def search(self, pattern, cursor=0):
+        """Return the first record from `cursor` onwards matching `pattern`, and the match, or None"""
+        regex = re.compile(pattern)
+        for record in self.since(cursor):
+            if match := regex.search(record.message):
+                return record, match
+        return None
+
+    def wait_for(self, pattern, timeout_s=10, cursor=0):
+        """Wait for a record from `cursor` onwards to match `pattern`, and return it and the match
+
+        Only looks at every record once, i.e. while waiting only the lines
+        appended to the log in the meantime are parsed and matched. Rather
+        than polling, blocks until Firecracker writes to the log.
+        """
+        regex = re.compile(pattern)
+        deadline = time.monotonic() + timeout_s
+        # Watch before reading, so that writes in between are not missed
+        with _ModifyWatch(self.path) as watch:
+            while True:
+                end = self._read_new()
+                for record in self._records[cursor:end]:
+                    if match := regex.search(record.message):
+                        return record, match
+                cursor = end
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(
+                        f"No log message matching {pattern!r} in {self.path}"
+                    )
+                watch.wait(remaining)
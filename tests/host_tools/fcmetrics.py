@@ -5,6 +5,7 @@
 """Provides:
 - Mechanism to collect and export Firecracker metrics every 60seconds to CloudWatch
 - Utility functions to validate Firecracker metrics format and to validate Firecracker device metrics.
+- An incremental reader for the metrics file written by Firecracker.
 """
 
 import datetime
@@ -13,7 +14,8 @@ import logging
 import math
 import platform
 import time
-from threading import Thread
+from pathlib import Path
+from threading import Lock, Thread
 
 import jsonschema
 import pytest
@@ -22,6 +24,74 @@ from framework.properties import global_props
 from host_tools.metrics import get_metrics_logger
 
 
+class FCMetricsReader:
+    """Incrementally reads the metrics datapoints Firecracker appends to its metrics file.
+
+    Remembers how far into the file it has already read, so that every call
+    only parses the lines appended since the previous one. A trailing line
+    without newline (e.g. because Firecracker is still writing it) is kept
+    back until it is complete.
+
+    Cursors are indices into the list of all datapoints read so far.
+    """
+
+    def __init__(self, path: Path, poll_interval_s=0.05):
+        self.path = Path(path)
+        self._poll_interval_s = poll_interval_s
+        self._offset = 0
+        self._partial = b""
+        self._datapoints = []
+        # The reader is shared between tests and the FCMetricsMonitor thread
+        self._lock = Lock()
+
+    def _read_new(self):
+        """Parse all complete lines appended to the file since the last call"""
+        with self._lock:
+            with self.path.open("rb") as file:
+                file.seek(self._offset)
+                data = file.read()
+            self._offset += len(data)
+
+            lines = (self._partial + data).split(b"\n")
+            self._partial = lines.pop()
+            for line in lines:
+                try:
+                    self._datapoints.append(json.loads(line))
+                except json.JSONDecodeError:
+                    logging.warning("Line is not a proper JSON object: %s", line)
+
+            return len(self._datapoints)
+
+    def __len__(self):
+        return self._read_new()
+
+    def latest(self):
+        """Return the most recent datapoint, or None if there is none yet"""
+        if self._read_new() == 0:
+            return None
+        return self._datapoints[-1]
+
+    def since(self, cursor=0):
+        """Return all datapoints from `cursor` onwards"""
+        end = self._read_new()
+        return self._datapoints[cursor:end]
+
+    def wait_for_next(self, cursor=None, timeout_s=60):
+        """Wait for the datapoint at `cursor` to be written, and return it
+
+        If `cursor` is None, waits for the next datapoint after the ones
+        written so far.
+        """
+        if cursor is None:
+            cursor = self._read_new()
+        deadline = time.monotonic() + timeout_s
+        while self._read_new() <= cursor:
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"No metrics datapoint #{cursor} in {self.path}")
+            time.sleep(self._poll_interval_s)
+        return self._datapoints[cursor]
+
+
 def create_metrics_schema_objects(metrics):
     """
     Helper functions to create jsonschema objects for
@@ -438,6 +508,19 @@ def get_emf_unit_for_fc_metrics(full_key):
     return "Count"
 
 
+def flatten_metrics(node, prefix: str = ""):
+    """Convert a tree of metrics into a dict mapping the dot separated path of each leaf to its value"""
+    # Pre-order tree traversal
+    if not isinstance(node, dict):
+        return {prefix: node}
+
+    result = {}
+    for child_metric_name, child_metrics in node.items():
+        child_prefix = f"{prefix}.{child_metric_name}" if prefix else child_metric_name
+        result.update(flatten_metrics(child_metrics, child_prefix))
+    return result
+
+
 def flush_fc_metrics_to_cw(fc_metrics, metrics):
     """
     Flush Firecracker metrics to CloudWatch. Use an existing metrics logger with existing dimensions so that it is
@@ -449,17 +532,7 @@ def flush_fc_metrics_to_cw(fc_metrics, metrics):
         means the FcMonitor cannot be used in negative tests that might cause such metrics to be emitted.
     """
 
-    # Pre-order tree traversal to convert a tree into its list of paths with dot separate segments
-    def flatten_dict(node, prefix: str):
-        if not isinstance(node, dict):
-            return {prefix: node}
-
-        result = {}
-        for child_metric_name, child_metrics in node.items():
-            result.update(flatten_dict(child_metrics, f"{prefix}.{child_metric_name}"))
-        return result
-
-    flattened_metrics = flatten_dict(fc_metrics, "fc_metrics")
+    flattened_metrics = flatten_metrics(fc_metrics, "fc_metrics")
 
     for key, value in flattened_metrics.items():
         if ".utc_timestamp_ms." in key:
@@ -505,7 +578,7 @@ class FCMetricsMonitor(Thread):
         self.metrics_index = 0
         self.running = False
 
-        self.metrics_logger = get_metrics_logger()
+        self.metrics_logger = get_metrics_logger(batched=True)
         self.metrics_logger.set_dimensions(
             {
                 "instance": global_props.instance,
@@ -518,14 +591,13 @@ class FCMetricsMonitor(Thread):
     def _flush_metrics(self):
         """
         Since vm.flush_metrics provides only the latest metrics,
-        we call vm.get_all_metrics() instead to be able to collect
-        and upload all metrics emitted by the microvm.
+        we read all datapoints emitted by the microvm since the last
+        call instead, to be able to collect and upload all of them.
         This utility function is created to keep common code in one
         place and is called every `self.timer` seconds once the daemon
         starts and then once when the daemon stops.
         """
-        all_metrics = self.vm.get_all_metrics()
-        for metrics in all_metrics[self.metrics_index :]:
+        for metrics in self.vm.metrics_reader.since(self.metrics_index):
             flush_fc_metrics_to_cw(metrics, self.metrics_logger)
             self.metrics_index += 1
 
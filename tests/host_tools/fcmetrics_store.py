@@ -0,0 +1,149 @@
+# Copyright 2025 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+"""A columnar store for the metrics datapoints emitted by Firecracker.
+
+Each datapoint is flattened exactly once into a row of a preallocated
+float64 matrix, with one column per dot separated metric path (e.g.
+`net_eth0.rx_bytes_count`). Analysis of long running microVMs then works on
+whole columns at a time, instead of walking nested dicts in Python.
+
+Note that most Firecracker metrics are counters that are reset on every
+flush, i.e. each datapoint holds the increments since the previous one.
+"""
+
+from pathlib import Path
+
+import numpy as np
+
+from host_tools.fcmetrics import flatten_metrics
+
+TIMESTAMP_COLUMN = "utc_timestamp_ms"
+
+
+class FCMetricsStore:
+    """Flattened Firecracker metrics datapoints, stored column-wise"""
+
+    def __init__(self, capacity: int = 256):
+        self.columns = {}
+        self._data = np.full((capacity, 0), np.nan)
+        self._len = 0
+        # Number of datapoints already consumed from a `FCMetricsReader`
+        self._cursor = 0
+
+    @classmethod
+    def from_datapoints(cls, datapoints):
+        """Create a store holding the given datapoints"""
+        datapoints = list(datapoints)
+        store = cls(capacity=max(len(datapoints), 1))
+        store.extend(datapoints)
+        return store
+
+    def __len__(self):
+        return self._len
+
+    def _reserve(self, rows: int, cols: int):
+        """Grow the backing matrix (by at least a factor of two) to hold `rows` x `cols` values"""
+        cur_rows, cur_cols = self._data.shape
+        if rows <= cur_rows and cols <= cur_cols:
+            return
+
+        new_rows = max(rows, cur_rows * 2) if rows > cur_rows else cur_rows
+        new_cols = max(cols, cur_cols * 2) if cols > cur_cols else cur_cols
+        data = np.full((new_rows, new_cols), np.nan)
+        data[: self._len, :cur_cols] = self._data[: self._len]
+        self._data = data
+
+    def append(self, datapoint: dict):
+        """Flatten `datapoint` into a new row"""
+        flat = {
+            path: value
+            for path, value in flatten_metrics(datapoint).items()
+            if isinstance(value, (int, float))
+        }
+        for path in flat:
+            if path not in self.columns:
+                self.columns[path] = len(self.columns)
+
+        self._reserve(self._len + 1, len(self.columns))
+        row = self._data[self._len]
+        for path, value in flat.items():
+            row[self.columns[path]] = value
+        self._len += 1
+
+    def extend(self, datapoints):
+        """Append all of `datapoints`"""
+        for datapoint in datapoints:
+            self.append(datapoint)
+
+    def ingest(self, reader):
+        """Append all datapoints a `FCMetricsReader` read since the previous call, returning how many there were"""
+        datapoints = reader.since(self._cursor)
+        self.extend(datapoints)
+        self._cursor += len(datapoints)
+        return len(datapoints)
+
+    def column(self, path: str):
+        """The values of the metric `path` over time, NaN where a datapoint did not contain it"""
+        if path not in self.columns:
+            raise KeyError(f"No metric {path} in the store")
+        return self._data[: self._len, self.columns[path]]
+
+    def matching(self, prefix: str):
+        """Names of all metrics starting with `prefix`"""
+        return [path for path in self.columns if path.startswith(prefix)]
+
+    @property
+    def timestamps_s(self):
+        """The time at which each datapoint was emitted, in seconds since the Unix epoch"""
+        return self.column(TIMESTAMP_COLUMN) / 1000
+
+    def intervals_s(self):
+        """The time elapsed between consecutive datapoints, in seconds"""
+        return np.diff(self.timestamps_s)
+
+    def deltas(self, path: str):
+        """Differences of `path` between consecutive datapoints. Meaningful for gauges, which are not reset on flush"""
+        return np.diff(self.column(path))
+
+    def rates(self, path: str):
+        """Per second rate of the counter `path` for the interval leading up to each datapoint (but the first)"""
+        return self.column(path)[1:] / self.intervals_s()
+
+    def per_device(self, device: str, metric: str):
+        """Values of `metric` for each individual instance of `device`, e.g. `per_device("net", "rx_bytes_count")`
+
+        Returns a dict mapping the device group (e.g. `net_eth0`) to a column.
+        The aggregate group (e.g. `net`) is not included.
+        """
+        result = {}
+        for path in self.matching(f"{device}_"):
+            group, _, name = path.partition(".")
+            if name == metric:
+                result[group] = self.column(path)
+        return result
+
+    def device_total(self, device: str, metric: str):
+        """Sum of `metric` over all individual instances of `device`"""
+        columns = list(self.per_device(device, metric).values())
+        if not columns:
+            return np.zeros(self._len)
+        return np.nansum(np.stack(columns), axis=0)
+
+    def save_npz(self, path: Path):
+        """Store all datapoints in a compressed .npz file"""
+        np.savez_compressed(
+            path,
+            columns=np.array(list(self.columns), dtype=str),
+            data=self._data[: self._len, : len(self.columns)],
+        )
+
+    @classmethod
+    def load_npz(cls, path: Path):
+        """Load datapoints previously stored with `save_npz`"""
+        with np.load(path) as npz:
+            data = npz["data"]
+            store = cls(capacity=max(data.shape[0], 1))
+            store.columns = {str(name): idx for idx, name in enumerate(npz["columns"])}
+        store._data = data
+        store._len = data.shape[0]
+        return store
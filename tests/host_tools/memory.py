@@ -3,10 +3,19 @@
 
 """Utilities for measuring memory utilization for a process."""
 
+import os
 import time
 from threading import Thread
 
-import psutil
+import numpy as np
+
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+# Bytes read from /proc/<pid>/pagemap at once, i.e. the entries of 4 GiB of memory
+PAGEMAP_CHUNK = 8 * 2**20
+# How often the pagemap entries of all of guest memory are read, unless the
+# VMM overhead grew by more than `PAGEMAP_SLACK` bytes since
+PAGEMAP_PERIOD_S = 1
+PAGEMAP_SLACK = 256 * 2**10
 
 
 class MemoryUsageExceededError(Exception):
@@ -26,6 +35,33 @@ class MemoryMonitor(Thread):
 
     The guest's memory region is skipped, as the main interest is the
     VMM memory usage.
+
+    The address ranges of guest memory are looked up in `/proc/<pid>/maps`
+    only once they are mapped. After that, every sample just takes the
+    resident set size of the whole process from `/proc/<pid>/statm`, and
+    subtracts the pages of guest memory that are present according to
+    `/proc/<pid>/pagemap`. Unlike parsing `/proc/<pid>/smaps`, this costs
+    nothing per mapping of the process.
+
+    Reading the pagemap costs 8 bytes per page of guest memory, so it is
+    only read again once the RSS changed, and then at most every
+    `PAGEMAP_PERIOD_S`. In between, the guest is assumed to have as many
+    pages present as last time. As this overestimates the overhead while the
+    guest faults in memory, the pagemap is read right away once that
+    estimate grew by more than `PAGEMAP_SLACK`, e.g. while the guest boots,
+    but not while its memory usage is steady, e.g. during a benchmark.
+
+    Guest memory backed by shared memory (e.g. a memfd, for vhost-user) is
+    not part of the anonymous and file backed RSS in `/proc/<pid>/status`,
+    which then is all VMM overhead, without reading the pagemap at all.
+
+    Samples are estimates: besides the above, before Linux 6.2 the RSS in
+    `statm` and `status` is summed from per-thread counters that are only
+    flushed every 64 page faults, i.e. it can be off by up to 256 KiB per
+    thread. So a sample over the threshold is only reported after
+    confirming it with an exact count, the RSS in
+    `/proc/<pid>/smaps_rollup` (which walks the page tables) minus the guest
+    pages present according to a fresh read of the pagemap.
     """
 
     # If guest memory is >3328MB, it is split in a 2nd region
@@ -40,6 +76,18 @@ class MemoryMonitor(Thread):
         self._period_s = period_s
         self._should_stop = False
         self._current_rss = 0
+        # Address ranges of guest memory counted in the RSS, once mapped
+        self._guest_ranges = None
+        self._guest_shared = False
+        # Guest pages present, and the RSS, overhead and time when counted
+        self._guest_pages = 0
+        self._counted_rss = None
+        self._counted_overhead = 0
+        self._counted_at = 0
+        # Time series of the VMM memory overhead, in bytes
+        self.timestamps = []
+        self.samples = []
+        self.peak = 0
         self.daemon = True
 
     def signal_stop(self):
@@ -58,28 +106,114 @@ class MemoryMonitor(Thread):
         If overhead memory exceeds the maximum value, it is saved and memory
         monitoring ceases. It is up to the caller to check.
         """
-
-        guest_mem_bytes = self._vm.mem_size_bytes
+        pid = self._vm.firecracker_pid
         try:
-            ps = psutil.Process(self._vm.firecracker_pid)
-        except (psutil.NoSuchProcess, FileNotFoundError):
+            fds = {
+                name: os.open(f"/proc/{pid}/{name}", os.O_RDONLY)
+                for name in ("statm", "status", "pagemap")
+            }
+        except FileNotFoundError:
             return
-        while not self._should_stop:
-            try:
-                mmaps = ps.memory_maps(grouped=False)
-            except psutil.NoSuchProcess:
-                return
-            mem_total = 0
-            for mmap in mmaps:
-                if self.is_guest_mem(mmap.size, guest_mem_bytes):
+
+        try:
+            while not self._should_stop:
+                try:
+                    mem_total = self._sample(pid, **fds)
+                    if mem_total > self.threshold:
+                        mem_total = self._exact_overhead(pid, fds["pagemap"])
+                except (FileNotFoundError, ProcessLookupError):
+                    return
+
+                self._current_rss = mem_total
+                self.timestamps.append(time.monotonic())
+                self.samples.append(mem_total)
+                self.peak = max(self.peak, mem_total)
+                if mem_total > self.threshold:
+                    self._exceeded = pid
+                    return
+
+                time.sleep(self._period_s)
+        finally:
+            for fd in fds.values():
+                os.close(fd)
+
+    def _sample(self, pid, statm, status, pagemap):
+        """Return the current RSS of the process, excluding guest memory"""
+        if self._guest_ranges is None:
+            self._guest_ranges = self._find_guest_ranges(pid)
+
+        if self._guest_shared:
+            rss_kib = 0
+            for line in os.pread(status, 4096, 0).decode().splitlines():
+                name, _, value = line.partition(":")
+                if name in ("RssAnon", "RssFile"):
+                    rss_kib += int(value.split()[0])
+            return rss_kib * 1024
+
+        # Read the RSS before the guest pages: if the guest faults in memory
+        # in between, this errs on the side of less overhead.
+        resident_pages = int(os.pread(statm, 256, 0).split()[1])
+        overhead = (resident_pages - self._guest_pages) * PAGE_SIZE
+        if self._guest_ranges and resident_pages != self._counted_rss:
+            now = time.monotonic()
+            if (
+                now - self._counted_at >= PAGEMAP_PERIOD_S
+                or overhead > self._counted_overhead + PAGEMAP_SLACK
+            ):
+                self._guest_pages = self._count_guest_pages(pagemap)
+                overhead = (resident_pages - self._guest_pages) * PAGE_SIZE
+                self._counted_rss, self._counted_at = resident_pages, now
+                self._counted_overhead = overhead
+
+        return overhead
+
+    def _exact_overhead(self, pid, pagemap):
+        """The exact RSS of the process, excluding guest memory"""
+        rss_kib = 0
+        with open(f"/proc/{pid}/smaps_rollup", encoding="utf-8") as rollup:
+            for line in rollup:
+                name, _, value = line.partition(":")
+                if name == "Rss":
+                    rss_kib = int(value.split()[0])
+                    break
+        guest_pages = self._count_guest_pages(pagemap) if self._guest_ranges else 0
+        return rss_kib * 1024 - guest_pages * PAGE_SIZE
+
+    def _count_guest_pages(self, pagemap):
+        """The number of pages of guest memory present in RAM"""
+        guest_pages = 0
+        for start, end in self._guest_ranges:
+            # One 8 byte pagemap entry per page
+            first, last = start // PAGE_SIZE * 8, end // PAGE_SIZE * 8
+            for offset in range(first, last, PAGEMAP_CHUNK):
+                size = min(PAGEMAP_CHUNK, last - offset)
+                entries = np.frombuffer(os.pread(pagemap, size, offset), np.uint64)
+                # Bit 63 is set for pages present in RAM
+                guest_pages += int(np.count_nonzero(entries >> np.uint64(63)))
+        return guest_pages
+
+    def _find_guest_ranges(self, pid):
+        """The address ranges of guest memory, or None if it is not mapped yet"""
+        guest_mem_bytes = self._vm.mem_size_bytes
+        ranges = []
+        found_bytes = 0
+        shared = True
+        with open(f"/proc/{pid}/maps", encoding="utf-8") as maps:
+            for line in maps:
+                addresses, perms, _, _, _, *path = line.split(maxsplit=5)
+                start, end = (int(address, 16) for address in addresses.split("-"))
+                if not self.is_guest_mem(end - start, guest_mem_bytes):
                     continue
-                mem_total += mmap.rss
-            self._current_rss = mem_total
-            if mem_total > self.threshold:
-                self._exceeded = ps
-                return
+                found_bytes += end - start
+                # Hugetlbfs pages are not part of the RSS in statm
+                if "hugepage" not in "".join(path):
+                    ranges.append((start, end))
+                    shared = shared and perms[3] == "s"
 
-            time.sleep(self._period_s)
+        if found_bytes < guest_mem_bytes:
+            return None
+        self._guest_shared = shared and bool(ranges)
+        return ranges
 
     def is_guest_mem(self, size, guest_mem_bytes):
         """
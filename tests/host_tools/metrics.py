@@ -36,6 +36,13 @@ You can override the destination of the metrics to stdout with:
     AWS_EMF_NAMESPACE=$USER-test
     AWS_EMF_ENVIRONMENT=local ./tools/devtest test
 
+# Batching
+
+High volumes of metrics (e.g. Firecracker's own metrics, see `fcmetrics.py`)
+should use `get_metrics_logger(batched=True)`, which coalesces them and sends
+them to the agent in batches through an `EMFEmitter`. `LocalEMFAgent` records
+everything sent to it, and can be used to test this offline.
+
 # References:
 
 - https://docs.aws.amazon.com/AmazonCloudWatch/latest/monitoring/CloudWatch_Embedded_Metric_Format_Specification.html
@@ -43,25 +50,48 @@ You can override the destination of the metrics to stdout with:
 """
 
 import asyncio
+import atexit
 import json
+import logging
 import os
 import socket
+import socketserver
+import threading
+import time
+from functools import lru_cache
 from pathlib import Path
 from urllib.parse import urlparse
 
 from aws_embedded_metrics.constants import DEFAULT_NAMESPACE
 from aws_embedded_metrics.logger.metrics_logger_factory import create_metrics_logger
 
+LOG = logging.getLogger("metrics")
+
+# The largest payload of a UDP datagram over IPv4
+MAX_UDP_PAYLOAD = 65_507
+# Limits imposed by the EMF specification
+MAX_METRICS_PER_DIRECTIVE = 100
+MAX_VALUES_PER_METRIC = 100
+
 
 class MetricsWrapper:
-    """A convenient metrics logger"""
+    """A convenient metrics logger
 
-    def __init__(self, logger):
+    If an `EMFEmitter` is given, metrics are sent through it instead of
+    through the aws-embedded-metrics logger.
+    """
+
+    def __init__(self, logger, emitter=None):
         self.data = {}
         self.logger = logger
+        self.emitter = emitter
+        self.dimensions = {}
+        self.properties = {}
 
     def set_dimensions(self, *args, **kwargs):
         """Set dimensions"""
+        if args:
+            self.dimensions = dict(args[-1])
         if self.logger:
             self.logger.set_dimensions(*args, **kwargs)
 
@@ -71,17 +101,22 @@ class MetricsWrapper:
             self.data[name] = {"unit": unit, "values": []}
         self.data[name]["values"].append(data)
 
-        if self.logger:
+        if self.emitter:
+            self.emitter.put_metric(self.dimensions, name, data, unit, self.properties)
+        elif self.logger:
             self.logger.put_metric(name, data, unit)
 
-    def set_property(self, *args, **kwargs):
+    def set_property(self, key, value):
         """Set a property"""
+        self.properties[key] = value
         if self.logger:
-            self.logger.set_property(*args, **kwargs)
+            self.logger.set_property(key, value)
 
     def flush(self):
         """Flush any remaining metrics"""
-        if self.logger:
+        if self.emitter:
+            self.emitter.flush()
+        elif self.logger:
             asyncio.run(self.logger.flush())
 
     def store_data(self, dir_path):
@@ -91,36 +126,296 @@ class MetricsWrapper:
             json.dump(self.data, f)
 
 
-def get_metrics_logger():
-    """Get a new metrics logger object"""
+def get_metrics_logger(batched=False):
+    """Get a new metrics logger object
+
+    If `batched` is True and metrics go to a CloudWatch agent (rather than
+    stdout), they are coalesced and sent through the shared `EMFEmitter`,
+    which is more suitable for high volumes of metrics.
+    """
     # if no metrics namespace, don't output metrics
     if "AWS_EMF_NAMESPACE" in os.environ:
         logger = create_metrics_logger()
         logger.reset_dimensions(False)
     else:
         logger = None
-    return MetricsWrapper(logger)
+
+    emitter = None
+    if batched and logger and os.environ.get("AWS_EMF_ENVIRONMENT") != "local":
+        emitter = get_emf_emitter()
+    return MetricsWrapper(logger, emitter)
+
+
+class EMFEmitter:
+    """Sends EMF log messages to a CloudWatch agent, in batches.
+
+    Metrics are coalesced per dimension set: all values of a metric put with
+    the same dimensions and properties are sent as a single array, in as few
+    EMF messages as the EMF limits allow. Messages are newline separated and
+    packed into batches of at most `max_batch_bytes`, each of which is sent
+    in a single datagram (or write, for TCP) over a socket that is kept open
+    between flushes.
+
+    Once `max_pending` values are waiting to be sent, the caller putting the
+    last one flushes synchronously (and over TCP, blocks until the agent
+    accepted the data). Messages which cannot be sent, e.g. because they
+    exceed the datagram limit, are counted in `dropped`.
+    """
+
+    def __init__(
+        self, endpoint: str, max_batch_bytes=MAX_UDP_PAYLOAD, max_pending=10_000
+    ):
+        endpoint = urlparse(endpoint)
+        self.address = (endpoint.hostname, endpoint.port)
+        self.protocol = "tcp" if endpoint.scheme == "tcp" else "udp"
+        self.max_batch_bytes = max_batch_bytes
+        self.max_pending = max_pending
+
+        self.namespace = os.environ.get("AWS_EMF_NAMESPACE", DEFAULT_NAMESPACE)
+        self.log_group = os.environ.get(
+            "AWS_EMF_LOG_GROUP_NAME", f"{self.namespace}-metrics"
+        )
+        self.log_stream = os.environ.get("AWS_EMF_LOG_STREAM_NAME", "")
+
+        self.sent = 0
+        self.sent_batches = 0
+        self.dropped = 0
+
+        # (dimensions, properties) as JSON -> metric name -> (unit, [values])
+        self._pending = {}
+        self._pending_count = 0
+        self._raw = []
+        self._sock = None
+        self._lock = threading.RLock()
+
+    @property
+    def stats(self):
+        """Counters of sent and dropped messages"""
+        return {
+            "sent": self.sent,
+            "sent_batches": self.sent_batches,
+            "dropped": self.dropped,
+        }
+
+    def _fill_aws_metadata(self, emf_msg: dict):
+        emf_msg["_aws"]["LogGroupName"] = self.log_group
+        emf_msg["_aws"]["LogStreamName"] = self.log_stream
+        for metrics in emf_msg["_aws"]["CloudWatchMetrics"]:
+            metrics["Namespace"] = self.namespace
+
+    def _add_pending(self, count=1):
+        self._pending_count += count
+        if self._pending_count >= self.max_pending:
+            self.flush()
+
+    def emit_raw(self, emf_msg: dict):
+        """Queue a complete EMF message"""
+        with self._lock:
+            self._fill_aws_metadata(emf_msg)
+            self._raw.append(emf_msg)
+            self._add_pending()
+
+    def put_metric(self, dimensions: dict, name, value, unit, properties=None):
+        """Queue a single value of a metric with the given dimensions and properties"""
+        key = (
+            json.dumps(dimensions, sort_keys=True),
+            json.dumps(properties or {}, sort_keys=True),
+        )
+        with self._lock:
+            metrics = self._pending.setdefault(key, {})
+            metrics.setdefault(name, (unit, []))[1].append(value)
+            self._add_pending()
+
+    def _coalesced_messages(self, timestamp_ms):
+        """Turn all pending metrics into EMF messages"""
+        for (dimensions, properties), metrics in self._pending.items():
+            dimensions = json.loads(dimensions)
+            remaining = dict(metrics)
+            while remaining:
+                names = list(remaining)[:MAX_METRICS_PER_DIRECTIVE]
+                emf_msg = {
+                    "_aws": {
+                        "Timestamp": timestamp_ms,
+                        "CloudWatchMetrics": [
+                            {
+                                "Dimensions": [list(dimensions)],
+                                "Metrics": [
+                                    {"Name": name, "Unit": remaining[name][0]}
+                                    for name in names
+                                ],
+                            }
+                        ],
+                    },
+                    **json.loads(properties),
+                    **dimensions,
+                }
+                for name in names:
+                    unit, values = remaining[name]
+                    emf_msg[name] = values[:MAX_VALUES_PER_METRIC]
+                    if len(values) > MAX_VALUES_PER_METRIC:
+                        remaining[name] = (unit, values[MAX_VALUES_PER_METRIC:])
+                    else:
+                        del remaining[name]
+                self._fill_aws_metadata(emf_msg)
+                yield emf_msg
+
+    def _send(self, batch: bytes, count: int):
+        """Send a batch of `count` messages, reconnecting once if the socket broke"""
+        for attempt in range(2):
+            try:
+                if self._sock is None:
+                    if self.protocol == "udp":
+                        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                        self._sock.connect(self.address)
+                    else:
+                        self._sock = socket.create_connection(self.address)
+                self._sock.sendall(batch)
+                self.sent += count
+                self.sent_batches += 1
+                return
+            except OSError as err:
+                if self._sock is not None:
+                    self._sock.close()
+                    self._sock = None
+                if attempt == 1:
+                    LOG.warning("Dropping %d EMF messages: %s", count, err)
+                    self.dropped += count
+
+    def flush(self):
+        """Send all pending messages"""
+        with self._lock:
+            messages = self._raw + list(
+                self._coalesced_messages(int(time.time() * 1000))
+            )
+            self._raw, self._pending, self._pending_count = [], {}, 0
+
+            batch, batch_len = [], 0
+            for emf_msg in messages:
+                line = (json.dumps(emf_msg) + "\n").encode("utf-8")
+                if len(line) > self.max_batch_bytes:
+                    LOG.warning("Dropping EMF message of %d bytes", len(line))
+                    self.dropped += 1
+                    continue
+                if batch_len + len(line) > self.max_batch_bytes:
+                    self._send(b"".join(batch), len(batch))
+                    batch, batch_len = [], 0
+                batch.append(line)
+                batch_len += len(line)
+            if batch:
+                self._send(b"".join(batch), len(batch))
+
+    def close(self):
+        """Send all pending messages, and close the socket"""
+        with self._lock:
+            self.flush()
+            if self._sock is not None:
+                self._sock.close()
+                self._sock = None
+
+
+@lru_cache(maxsize=None)
+def _get_emitter(endpoint: str):
+    emitter = EMFEmitter(endpoint)
+    atexit.register(emitter.close)
+    return emitter
+
+
+def get_emf_emitter():
+    """The shared EMFEmitter for the agent at AWS_EMF_AGENT_ENDPOINT, or None if there is none"""
+    endpoint = os.environ.get("AWS_EMF_AGENT_ENDPOINT")
+    return _get_emitter(endpoint) if endpoint else None
 
 
 def emit_raw_emf(emf_msg: dict):
-    """Emites a raw EMF log message to the local cloudwatch agent"""
-    if "AWS_EMF_AGENT_ENDPOINT" not in os.environ:
-        return
-
-    namespace = os.environ.get("AWS_EMF_NAMESPACE", DEFAULT_NAMESPACE)
-    emf_msg["_aws"]["LogGroupName"] = os.environ.get(
-        "AWS_EMF_LOG_GROUP_NAME", f"{namespace}-metrics"
-    )
-    emf_msg["_aws"]["LogStreamName"] = os.environ.get("AWS_EMF_LOG_STREAM_NAME", "")
-    for metrics in emf_msg["_aws"]["CloudWatchMetrics"]:
-        metrics["Namespace"] = namespace
-
-    emf_endpoint = urlparse(os.environ["AWS_EMF_AGENT_ENDPOINT"])
-    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
-        sock.sendto(
-            (json.dumps(emf_msg) + "\n").encode("utf-8"),
-            (emf_endpoint.hostname, emf_endpoint.port),
+    """Emits a raw EMF log message to the local cloudwatch agent
+
+    Messages are batched, and only sent once enough of them accumulated,
+    when the emitter is flushed, or at exit.
+    """
+    emitter = get_emf_emitter()
+    if emitter:
+        emitter.emit_raw(emf_msg)
+
+
+class _EMFUDPServer(socketserver.ThreadingUDPServer):
+    # Large enough for any datagram
+    max_packet_size = 2**16
+
+
+class LocalEMFAgent:
+    """A stand-in for the CloudWatch agent, which records all EMF messages it receives
+
+    Can be used as a context manager.
+    """
+
+    def __init__(self, protocol="udp"):
+        self.protocol = protocol
+        self.messages = []
+        self.received_bytes = 0
+        self._lock = threading.Lock()
+        agent = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            """Records all newline separated EMF messages of a datagram or TCP connection"""
+
+            def handle(self):
+                if agent.protocol == "udp":
+                    agent.record(self.request[0].splitlines())
+                else:
+                    with self.request.makefile("rb") as lines:
+                        agent.record(lines)
+
+        server_cls = (
+            _EMFUDPServer if protocol == "udp" else socketserver.ThreadingTCPServer
         )
+        self._server = server_cls(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def endpoint(self):
+        """The endpoint to pass to an `EMFEmitter` (or AWS_EMF_AGENT_ENDPOINT)"""
+        host, port = self._server.server_address
+        return f"{self.protocol}://{host}:{port}"
+
+    def record(self, lines):
+        """Record newline separated EMF messages"""
+        for line in lines:
+            if not line.strip():
+                continue
+            with self._lock:
+                self.received_bytes += len(line)
+                self.messages.append(json.loads(line))
+
+    def values(self, name):
+        """All values received for the metric `name`"""
+        with self._lock:
+            messages = list(self.messages)
+
+        result = []
+        for emf_msg in messages:
+            value = emf_msg.get(name)
+            if value is None:
+                continue
+            result.extend(value if isinstance(value, list) else [value])
+        return result
+
+    def start(self):
+        """Start accepting messages"""
+        self._thread.start()
+
+    def stop(self):
+        """Stop accepting messages"""
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
 
 
 UNIT_REDUCTIONS = {
@@ -0,0 +1,227 @@
+# Copyright 2025 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+"""A minimal rtnetlink client, for configuring tap devices without `ip`.
+
+Requests are queued and then sent to the kernel in a single `sendmsg`, which
+answers all of them in one go. Bringing up a tap with an address, MTU and TX
+queue length thus takes one round trip, instead of one `ip` process per
+setting.
+
+A netlink socket, like a `/dev/net/tun` file, belongs to the network
+namespace of the thread that opened it, so both are opened in `in_netns`.
+"""
+
+import fcntl
+import ipaddress
+import os
+import socket
+import struct
+from contextlib import contextmanager
+
+NLMSGHDR = struct.Struct("=IHHII")
+NLMSGERR = struct.Struct("=i")
+RTATTR = struct.Struct("=HH")
+IFINFOMSG = struct.Struct("=BxHiII")
+IFADDRMSG = struct.Struct("=BBBBI")
+IFREQ_FLAGS = struct.Struct("=16sH22x")
+IFREQ_INDEX = struct.Struct("=16si20x")
+
+NLM_F_REQUEST = 0x1
+NLM_F_ACK = 0x4
+NLM_F_REPLACE = 0x100
+NLM_F_CREATE = 0x400
+NLMSG_ERROR = 0x2
+NLMSG_DONE = 0x3
+
+RTM_NEWLINK = 16
+RTM_GETLINK = 18
+RTM_NEWADDR = 20
+
+IFLA_MTU = 4
+IFLA_TXQLEN = 13
+IFLA_STATS64 = 23
+IFA_ADDRESS = 1
+IFA_LOCAL = 2
+IFA_BROADCAST = 4
+
+IFF_UP = 0x1
+IFF_LOWER_UP = 0x10000
+
+SIOCGIFINDEX = 0x8933
+TUNSETIFF = 0x400454CA
+TUNSETPERSIST = 0x400454CB
+IFF_TAP = 0x0002
+IFF_NO_PI = 0x1000
+
+# The leading fields of `struct rtnl_link_stats64`
+LINK_STATS = (
+    "rx_packets",
+    "tx_packets",
+    "rx_bytes",
+    "tx_bytes",
+    "rx_errors",
+    "tx_errors",
+    "rx_dropped",
+    "tx_dropped",
+)
+LINK_STATS64 = struct.Struct(f"={len(LINK_STATS)}Q")
+
+
+@contextmanager
+def in_netns(path):
+    """Move the calling thread into the network namespace at `path` for the duration of the block"""
+    own = os.open("/proc/thread-self/ns/net", os.O_RDONLY | os.O_CLOEXEC)
+    target = os.open(path, os.O_RDONLY | os.O_CLOEXEC)
+    try:
+        os.setns(target, os.CLONE_NEWNET)
+        yield
+    finally:
+        os.setns(own, os.CLONE_NEWNET)
+        os.close(target)
+        os.close(own)
+
+
+def create_tap(name: str):
+    """Create a persistent tap device, in the network namespace of the calling thread"""
+    fd = os.open("/dev/net/tun", os.O_RDWR | os.O_CLOEXEC)
+    try:
+        ifreq = IFREQ_FLAGS.pack(name.encode(), IFF_TAP | IFF_NO_PI)
+        fcntl.ioctl(fd, TUNSETIFF, ifreq)
+        fcntl.ioctl(fd, TUNSETPERSIST, 1)
+    finally:
+        os.close(fd)
+
+
+def _attr(kind, payload: bytes):
+    length = RTATTR.size + len(payload)
+    return (RTATTR.pack(length, kind) + payload).ljust((length + 3) & ~3, b"\0")
+
+
+def _parse_attrs(data: bytes, offset: int):
+    """The attributes in `data` from `offset` onwards, as a dict of type to payload"""
+    attrs = {}
+    while offset + RTATTR.size <= len(data):
+        length, kind = RTATTR.unpack_from(data, offset)
+        attrs[kind] = data[offset + RTATTR.size : offset + length]
+        offset += (length + 3) & ~3
+    return attrs
+
+
+class RtNetlink:
+    """A NETLINK_ROUTE socket, operating on the network namespace it was created in"""
+
+    def __init__(self):
+        self._sock = socket.socket(
+            socket.AF_NETLINK,
+            socket.SOCK_RAW | socket.SOCK_CLOEXEC,
+            socket.NETLINK_ROUTE,
+        )
+        self._sock.bind((0, 0))
+        self._seq = 0
+        self._queued = []
+        # What each request in flight does, for error messages
+        self._pending = {}
+        self._replies = {}
+
+    def _queue(self, msg_type, flags, body, what):
+        self._seq += 1
+        header = NLMSGHDR.pack(
+            NLMSGHDR.size + len(body),
+            msg_type,
+            flags | NLM_F_REQUEST | NLM_F_ACK,
+            self._seq,
+            0,
+        )
+        self._queued.append(header + body)
+        self._pending[self._seq] = what
+        return self._seq
+
+    def if_index(self, name: str):
+        """The index of the interface called `name`"""
+        ifreq = IFREQ_INDEX.pack(name.encode(), 0)
+        ifreq = fcntl.ioctl(self._sock, SIOCGIFINDEX, ifreq)
+        return IFREQ_INDEX.unpack(ifreq)[1]
+
+    def set_link(self, index, *, up=None, mtu=None, txqlen=None):
+        """Queue a change of the state, MTU and/or TX queue length of an interface"""
+        flags = change = 0
+        if up is not None:
+            flags, change = (IFF_UP if up else 0), IFF_UP
+        body = IFINFOMSG.pack(socket.AF_UNSPEC, 0, index, flags, change)
+        if mtu is not None:
+            body += _attr(IFLA_MTU, struct.pack("=I", mtu))
+        if txqlen is not None:
+            body += _attr(IFLA_TXQLEN, struct.pack("=I", txqlen))
+        self._queue(RTM_NEWLINK, 0, body, f"set link {index}")
+
+    def add_address(self, index, address: str):
+        """Queue assigning `address` (e.g. "192.168.0.1/30") to an interface
+
+        Like `ifconfig`, IPv4 addresses also get the broadcast address of
+        their network.
+        """
+        iface = ipaddress.ip_interface(address)
+        family = socket.AF_INET if iface.version == 4 else socket.AF_INET6
+        body = IFADDRMSG.pack(family, iface.network.prefixlen, 0, 0, index)
+        body += _attr(IFA_LOCAL, iface.ip.packed) + _attr(IFA_ADDRESS, iface.ip.packed)
+        if iface.version == 4:
+            body += _attr(IFA_BROADCAST, iface.network.broadcast_address.packed)
+        self._queue(
+            RTM_NEWADDR,
+            NLM_F_CREATE | NLM_F_REPLACE,
+            body,
+            f"add address {address} to link {index}",
+        )
+
+    def _get_link(self, index):
+        seq = self._queue(
+            RTM_GETLINK,
+            0,
+            IFINFOMSG.pack(socket.AF_UNSPEC, 0, index, 0, 0),
+            f"get link {index}",
+        )
+        self.commit()
+        return self._replies.pop(seq)
+
+    def link_flags(self, index):
+        """The current `IFF_*` flags of an interface"""
+        return IFINFOMSG.unpack_from(self._get_link(index))[3]
+
+    def link_stats(self, index):
+        """The packet, byte, error and drop counters of an interface, as a dict"""
+        reply = self._get_link(index)
+        stats = _parse_attrs(reply, IFINFOMSG.size)[IFLA_STATS64]
+        return dict(zip(LINK_STATS, LINK_STATS64.unpack_from(stats)))
+
+    def commit(self):
+        """Send all queued requests at once, and wait until the kernel acknowledged each of them
+
+        Raises an `OSError` for the first request that failed. The kernel
+        still carries out the others.
+        """
+        if not self._queued:
+            return
+        queued, self._queued = self._queued, []
+        self._sock.sendmsg(queued)
+
+        error = None
+        while self._pending:
+            data = self._sock.recv(65536)
+            offset = 0
+            while offset < len(data):
+                length, msg_type, _, seq, _ = NLMSGHDR.unpack_from(data, offset)
+                payload = data[offset + NLMSGHDR.size : offset + length]
+                offset += (length + 3) & ~3
+                if msg_type == NLMSG_ERROR:
+                    [errno] = NLMSGERR.unpack_from(payload)
+                    what = self._pending.pop(seq)
+                    if errno and error is None:
+                        error = OSError(-errno, f"{os.strerror(-errno)}: {what}")
+                elif msg_type != NLMSG_DONE:
+                    self._replies[seq] = payload
+        if error is not None:
+            raise error
+
+    def close(self):
+        """Close the socket"""
+        self._sock.close()
@@ -2,19 +2,339 @@
 # SPDX-License-Identifier: Apache-2.0
 """Utilities for test host microVM network setup."""
 
+import asyncio
+import codecs
+import gzip
 import ipaddress
+import json
 import os
 import random
 import re
+import selectors
+import shlex
 import signal
+import socket
 import string
+import subprocess
+import tarfile
+import threading
+import time
+import uuid
 from dataclasses import dataclass, field
 from pathlib import Path
 
 from tenacity import retry, stop_after_attempt, wait_fixed
 
 from framework import utils
-from framework.utils import Timeout
+from framework.utils import CommandReturn, Timeout
+from framework.utils_vsock import vsock_connect_to_guest
+from host_tools import netlink
+
+# The maximum number of sessions a SSHConnection keeps open. Guest sshd only
+# allows 10 sessions per connection by default.
+MAX_SSH_SESSIONS = 8
+
+
+class SSHSession:
+    """A shell in the guest, kept running over a channel of a ControlMaster
+    connection, to which commands are sent one after another.
+
+    Compared to running each command in its own `ssh` client, this saves
+    spawning a process on the host and opening a new channel per command.
+    Each command runs in a fresh `$SHELL -c`, with stdin redirected from
+    /dev/null, and is followed by a random marker on stdout and stderr that
+    delimits its output (and carries its exit code).
+    """
+
+    def __init__(self, command):
+        self._proc = subprocess.Popen(
+            command,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        os.set_blocking(self._proc.stdout.fileno(), False)
+        os.set_blocking(self._proc.stderr.fileno(), False)
+
+    @property
+    def alive(self):
+        """Whether the session can still be used to run commands"""
+        return self._proc.poll() is None
+
+    def kill(self):
+        """Tear down the session, e.g. because a command timed out
+
+        The shell in the guest is not given a chance to exit gracefully: it
+        only runs commands sent by `run`, so there is nothing to wait for.
+        """
+        if self.alive:
+            self._proc.kill()
+        self._proc.wait()
+        self._proc.stdin.close()
+        self._proc.stdout.close()
+        self._proc.stderr.close()
+
+    def run(self, cmd_string, timeout=None) -> CommandReturn:
+        """Run a command in the shell
+
+        If the session dies before the command completed (e.g. because the
+        guest rebooted), returns exit code 255, like `ssh` itself would.
+        """
+        marker = f"__ssh_session_{uuid.uuid4().hex}__".encode()
+        script = (
+            f'"${{SHELL:-sh}}" -c {shlex.quote(cmd_string)} </dev/null; '
+            f"printf '%s %d\\n' {marker.decode()} $?; "
+            f"printf '%s\\n' {marker.decode()} >&2\n"
+        )
+        stdout_done = re.compile(re.escape(marker) + rb" (\d+)\n\Z")
+        stdout, stderr = bytearray(), bytearray()
+        exit_code = None
+        stderr_done = False
+
+        try:
+            self._proc.stdin.write(script.encode())
+            self._proc.stdin.flush()
+        except BrokenPipeError:
+            self.kill()
+            return CommandReturn(255, "", "SSH session closed")
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with selectors.DefaultSelector() as selector:
+            selector.register(self._proc.stdout, selectors.EVENT_READ, stdout)
+            selector.register(self._proc.stderr, selectors.EVENT_READ, stderr)
+
+            while exit_code is None or not stderr_done:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    self.kill()
+                    raise subprocess.TimeoutExpired(
+                        cmd_string, timeout, bytes(stdout), bytes(stderr)
+                    )
+
+                for key, _ in selector.select(remaining):
+                    data = os.read(key.fd, 2**16)
+                    if not data:
+                        # The session died before the command completed
+                        self.kill()
+                        return CommandReturn(255, stdout.decode(), stderr.decode())
+                    key.data.extend(data)
+
+                # Only look at the end of the output, so that long outputs
+                # do not get searched over and over again
+                if exit_code is None:
+                    tail = bytes(stdout[-(len(marker) + 16) :])
+                    match = stdout_done.search(tail)
+                    if match:
+                        exit_code = int(match.group(1))
+                        del stdout[len(stdout) - len(tail) + match.start() :]
+                if not stderr_done and stderr.endswith(marker + b"\n"):
+                    stderr_done = True
+                    del stderr[-len(marker) - 1 :]
+
+        return CommandReturn(exit_code, stdout.decode(), stderr.decode())
+
+
+@dataclass(frozen=True)
+class TransferStats:
+    """Statistics of a bulk file transfer to or from a guest"""
+
+    # Size of the transferred files
+    nbytes: int
+    # Bytes that went over the wire, after compression
+    wire_bytes: int
+    duration_s: float
+
+    @property
+    def throughput(self):
+        """Transferred file data in bytes per second"""
+        return self.nbytes / self.duration_s
+
+
+class _CountingFile:
+    """A file-like wrapper counting the bytes read or written through it"""
+
+    def __init__(self, file):
+        self.file = file
+        self.count = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        # The underlying file is owned by the caller
+        pass
+
+    def write(self, data):
+        """Write `data` to the underlying file"""
+        self.count += len(data)
+        return self.file.write(data)
+
+    def read(self, size=-1):
+        """Read up to `size` bytes from the underlying file"""
+        data = self.file.read(size)
+        self.count += len(data)
+        return data
+
+    def flush(self):
+        """Flush the underlying file"""
+        self.file.flush()
+
+
+# Only extract regular files and directories from tar archives received from
+# guests, if this Python version supports extraction filters
+TAR_EXTRACT_KWARGS = {"filter": "data"} if hasattr(tarfile, "data_filter") else {}
+
+# Characters relevant for finding the end of a JSON document
+JSON_STRUCTURAL_CHARS = re.compile(r'[{}\[\]"\\]')
+
+
+class GuestCommandStream:
+    """The output of a command running in the guest, made available while it is produced
+
+    Iterating over the stream yields stdout line by line. Once stdout is
+    exhausted, `returncode` and `stderr` are set, and with `check`, a non-zero
+    exit code raises a `ChildProcessError`. Closing the stream before that,
+    e.g. by leaving its `with` block early, kills the `ssh` client on the
+    host. As no terminal is allocated, the command in the guest keeps running
+    until it exits on its own, so long running ones need to be stopped
+    separately.
+    """
+
+    def __init__(self, command, cmd_string, timeout=None, *, check=False):
+        self.cmd_string = cmd_string
+        self.timeout = timeout
+        self.check = check
+        self.returncode = None
+        self.stderr = None
+        self._consumed = False
+        self._proc = subprocess.Popen(
+            command,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            # So that we can kill anything holding on to the pipes
+            start_new_session=True,
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """Kill the ssh client if it is still running"""
+        if self._proc.poll() is None:
+            os.killpg(self._proc.pid, signal.SIGKILL)
+        self._proc.wait()
+        self._proc.stdout.close()
+        self._proc.stderr.close()
+
+    def chunks(self):
+        """Yield stdout in chunks of text, as soon as they are received"""
+        assert not self._consumed, "output of the command was already consumed"
+        self._consumed = True
+
+        decoder = codecs.getincrementaldecoder("utf-8")()
+        stderr = bytearray()
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        try:
+            with selectors.DefaultSelector() as selector:
+                selector.register(self._proc.stdout, selectors.EVENT_READ)
+                selector.register(self._proc.stderr, selectors.EVENT_READ)
+
+                while selector.get_map():
+                    remaining = None
+                    if deadline is not None:
+                        remaining = deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        raise subprocess.TimeoutExpired(
+                            self.cmd_string, self.timeout, stderr=bytes(stderr)
+                        )
+
+                    for key, _ in selector.select(remaining):
+                        data = os.read(key.fd, 2**16)
+                        if not data:
+                            selector.unregister(key.fileobj)
+                        elif key.fileobj is self._proc.stderr:
+                            stderr.extend(data)
+                        elif text := decoder.decode(data):
+                            yield text
+
+            if text := decoder.decode(b"", final=True):
+                yield text
+            self.returncode = self._proc.wait()
+            self.stderr = stderr.decode()
+        finally:
+            self.close()
+
+        if self.check and self.returncode != 0:
+            raise ChildProcessError(
+                _format_failure(
+                    self.cmd_string,
+                    CommandReturn(self.returncode, "<streamed>", self.stderr),
+                )
+            )
+
+    def lines(self):
+        """Yield stdout line by line, as soon as each line is complete"""
+        partial = ""
+        for chunk in self.chunks():
+            *lines, partial = (partial + chunk).split("\n")
+            for line in lines:
+                yield line + "\n"
+        if partial:
+            yield partial
+
+    def __iter__(self):
+        return self.lines()
+
+    def json_objects(self):
+        """Yield every top-level JSON object (or array) in stdout, as soon as it is complete
+
+        Useful for tools that print a JSON document per reporting interval
+        (e.g. `iperf3 --json-stream`, or fio with `--status-interval`). Any
+        text between documents is ignored.
+        """
+        pieces = []
+        depth = 0
+        in_string = False
+        # Whether the last chunk ended in a backslash inside a string
+        escaped = False
+
+        for chunk in self.chunks():
+            start = 0
+            skip = 0 if escaped else -1
+            escaped = False
+
+            for match in JSON_STRUCTURAL_CHARS.finditer(chunk):
+                idx, char = match.start(), match.group()
+                if idx == skip:
+                    continue
+                if depth == 0:
+                    if char in "{[":
+                        start, depth = idx, 1
+                    continue
+
+                if in_string:
+                    if char == "\\":
+                        skip = idx + 1
+                        escaped = skip == len(chunk)
+                    elif char == '"':
+                        in_string = False
+                elif char == '"':
+                    in_string = True
+                elif char in "{[":
+                    depth += 1
+                elif char in "}]":
+                    depth -= 1
+                    if depth == 0:
+                        pieces.append(chunk[start : idx + 1])
+                        yield json.loads("".join(pieces))
+                        pieces = []
+
+            if depth > 0:
+                pieces.append(chunk[start:])
 
 
 class SSHConnection:
@@ -26,7 +346,9 @@ class SSHConnection:
     the image and the path of the ssh key.
 
     Establishes a ControlMaster upon construction, which is then re-used
-    for all subsequent SSH interactions.
+    for all subsequent SSH interactions. Commands are run in a pool of
+    `SSHSession`s over this connection, so that multiple commands can run
+    concurrently, each on its own channel.
     """
 
     def __init__(
@@ -46,6 +368,13 @@ class SSHConnection:
 
         self._on_error = None
 
+        self._sessions = []
+        self._sessions_lock = threading.Lock()
+        self._session_slots = threading.BoundedSemaphore(MAX_SSH_SESSIONS)
+        # Whether we need to check the ControlMaster is still alive before
+        # running the next command
+        self._check_pending = False
+
         self.options = [
             "-o",
             f"ControlPath={self._control_path}",
@@ -158,7 +487,12 @@ class SSHConnection:
         return int(pid_match.group(1))
 
     def close(self):
-        """Closes the ControlPersist connection"""
+        """Closes all sessions and the ControlPersist connection"""
+        with self._sessions_lock:
+            sessions, self._sessions = self._sessions, []
+        for session in sessions:
+            session.kill()
+
         master_pid = self._check_liveness()
 
         stop_cmd = ["ssh", "-O", "stop", *self.options, self.user_host]
@@ -176,20 +510,321 @@ class SSHConnection:
             # "found a process with supposedly dead Firecracker's jailer ID"
             os.kill(master_pid, signal.SIGKILL)
 
+    def _run_in_session(self, cmd_string, timeout):
+        """Run a command in an idle session, starting a new one if there is none"""
+        with self._session_slots:
+            with self._sessions_lock:
+                session = self._sessions.pop() if self._sessions else None
+
+            if session is None:
+                command = ["ssh", *self.options, self.user_host, "sh"]
+                if self.netns is not None:
+                    command = ["ip", "netns", "exec", self.netns] + command
+                session = SSHSession(command)
+
+            try:
+                result = session.run(cmd_string, timeout)
+            except subprocess.TimeoutExpired as exc:
+                # Log whatever the command printed before it timed out
+                partial = CommandReturn(
+                    None,
+                    (exc.output or b"").decode(errors="replace"),
+                    (exc.stderr or b"").decode(errors="replace"),
+                )
+                utils.CMDLOG.warning(
+                    "Timeout executing command: %s\n",
+                    _format_failure(cmd_string, partial),
+                )
+                raise
+            finally:
+                if session.alive:
+                    with self._sessions_lock:
+                        self._sessions.append(session)
+                else:
+                    self._check_pending = True
+
+            utils.CMDLOG.debug(_format_failure(cmd_string, result))
+            return result
+
     def run(self, cmd_string, timeout=100, *, check=False, debug=False):
         """
         Execute the command passed as a string in the ssh context.
 
-        If `debug` is set, pass `-vvv` to `ssh`. Note that this will clobber stderr.
+        Whether the ControlMaster connection is still alive is only checked
+        lazily, after a session broke down.
+
+        If `debug` is set, run the command in its own `ssh -vvv` instead. Note that this will clobber stderr.
+        """
+        if debug or self._check_pending:
+            self._check_liveness()
+            self._check_pending = False
+
+        if debug:
+            command = ["ssh", "-vvv", *self.options, self.user_host, cmd_string]
+            return self._exec(command, timeout, check=check)
+
+        try:
+            result = self._run_in_session(cmd_string, timeout)
+            if check and result.returncode != 0:
+                raise ChildProcessError(_format_failure(cmd_string, result))
+        except Exception as exc:
+            if self._on_error:
+                self._on_error(exc)
+
+            raise
+
+        return result
+
+    def _bulk_transfer(
+        self, remote_cmd, transfer, *, upload, vsock_uds_path, timeout
+    ):
+        """Run `remote_cmd` in the guest, and `transfer` data to (if `upload`)
+        or from it through a file object connected to its stdin/stdout, either
+        via SSH or via vsock"""
+        if vsock_uds_path is not None:
+            port = random.randint(10000, 60000)
+            if upload:
+                remote_cmd = f"socat -u VSOCK-LISTEN:{port} - | ({remote_cmd})"
+            else:
+                remote_cmd = f"({remote_cmd}) | socat -u - VSOCK-LISTEN:{port}"
+
+        command = ["ssh", *self.options, self.user_host, remote_cmd]
+        if self.netns is not None:
+            command = ["ip", "netns", "exec", self.netns] + command
+
+        start = time.perf_counter()
+        with subprocess.Popen(
+            command,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        ) as proc:
+            # Drain stderr while transferring, lest ssh blocks writing to it
+            stderr = bytearray()
+            drainer = threading.Thread(
+                target=lambda: stderr.extend(proc.stderr.read()), daemon=True
+            )
+            # `transfer` blocks on the guest, so enforce the deadline by tearing
+            # down the channel under its feet, which makes it fail
+            sockets = []
+            expired = threading.Event()
+
+            def expire():
+                expired.set()
+                proc.kill()
+                for sock in sockets:
+                    sock.shutdown(socket.SHUT_RDWR)
+
+            watchdog = threading.Timer(timeout, expire)
+            drainer.start()
+            watchdog.start()
+            try:
+                if vsock_uds_path is None:
+                    channel = proc.stdin if upload else proc.stdout
+                    payload_bytes, wire_bytes = transfer(channel)
+                else:
+                    # Wait for socat in the guest to listen
+                    sock = retry(wait=wait_fixed(0.1), stop=stop_after_attempt(100))(
+                        vsock_connect_to_guest
+                    )(vsock_uds_path, port)
+                    sockets.append(sock)
+                    with sock, sock.makefile("rwb") as channel:
+                        payload_bytes, wire_bytes = transfer(channel)
+                        channel.flush()
+                        sock.shutdown(socket.SHUT_WR)
+                        # Wait for the guest to close the connection
+                        channel.read()
+                # Signal EOF to the guest
+                proc.stdin.close()
+                proc.wait()
+            except Exception as exc:
+                proc.kill()
+                if expired.is_set():
+                    raise subprocess.TimeoutExpired(remote_cmd, timeout) from exc
+                raise
+            finally:
+                watchdog.cancel()
+                drainer.join()
+
+            if expired.is_set():
+                raise subprocess.TimeoutExpired(
+                    remote_cmd, timeout, stderr=bytes(stderr)
+                )
+            if proc.returncode != 0:
+                raise ChildProcessError(
+                    _format_failure(
+                        remote_cmd,
+                        CommandReturn(proc.returncode, "", stderr.decode()),
+                    )
+                )
+
+        return TransferStats(payload_bytes, wire_bytes, time.perf_counter() - start)
+
+    def tar_put(
+        self,
+        local_paths,
+        remote_dir,
+        *,
+        compress=False,
+        vsock_uds_path=None,
+        timeout=600,
+    ):
+        """Copy files (or directories) into `remote_dir` in the guest, all in a single tar stream.
+
+        `local_paths` can contain (local path, path relative to `remote_dir`)
+        tuples, to store files under a different name. If `vsock_uds_path` is
+        given, the data goes over the vsock device with this UDS on the host
+        instead of SSH.
+        """
+
+        def send(channel):
+            nbytes = 0
+
+            def count(tarinfo):
+                nonlocal nbytes
+                nbytes += tarinfo.size
+                return tarinfo
+
+            wire = _CountingFile(channel)
+            sink = wire
+            if compress:
+                sink = gzip.GzipFile(fileobj=wire, mode="wb", compresslevel=1)
+            with sink, tarfile.open(fileobj=sink, mode="w|") as tar:
+                for path in local_paths:
+                    path, arcname = path if isinstance(path, tuple) else (path, None)
+                    tar.add(path, arcname or Path(path).name, filter=count)
+            return nbytes, wire.count
+
+        remote_dir = shlex.quote(str(remote_dir))
+        remote_cmd = f"mkdir -p {remote_dir} && tar -x -C {remote_dir}"
+        if compress:
+            remote_cmd = f"mkdir -p {remote_dir} && gzip -d | tar -x -C {remote_dir}"
+        return self._bulk_transfer(
+            remote_cmd,
+            send,
+            upload=True,
+            vsock_uds_path=vsock_uds_path,
+            timeout=timeout,
+        )
+
+    def tar_get(
+        self,
+        remote_paths,
+        local_dir,
+        *,
+        compress=False,
+        vsock_uds_path=None,
+        timeout=600,
+    ):
+        """Copy files (or directories) from the guest into `local_dir`, all in a single tar stream.
+
+        Like with `scp_get`, remote paths are expanded by the shell in the
+        guest, so they can contain wildcards. If `vsock_uds_path` is given,
+        the data goes over the vsock device with this UDS on the host instead
+        of SSH.
+        """
+
+        def receive(channel):
+            nbytes = 0
+            wire = _CountingFile(channel)
+            source = wire
+            if compress:
+                source = gzip.GzipFile(fileobj=wire, mode="rb")
+            # Every path gets its own archive (so that it is extracted into
+            # `local_dir` directly), so read past end-of-archive markers
+            with source, tarfile.open(
+                fileobj=source, mode="r|", ignore_zeros=True
+            ) as tar:
+                for member in tar:
+                    nbytes += member.size
+                    tar.extract(member, local_dir, **TAR_EXTRACT_KWARGS)
+            return nbytes, wire.count
+
+        remote_cmd = (
+            f"for path in {' '.join(str(path) for path in remote_paths)}; do "
+            'tar -c -C "$(dirname "$path")" "$(basename "$path")" || exit; done'
+        )
+        if compress:
+            remote_cmd += " | gzip -1"
+        return self._bulk_transfer(
+            remote_cmd,
+            receive,
+            upload=False,
+            vsock_uds_path=vsock_uds_path,
+            timeout=timeout,
+        )
+
+    def stream(self, cmd_string, timeout=None, *, check=False):
+        """
+        Execute the command passed as a string in the ssh context, returning a
+        `GuestCommandStream` through which its output can be consumed while
+        the command is still running, instead of buffering all of it.
         """
-        self._check_liveness()
+        if self._check_pending:
+            self._check_liveness()
+            self._check_pending = False
 
         command = ["ssh", *self.options, self.user_host, cmd_string]
+        if self.netns is not None:
+            command = ["ip", "netns", "exec", self.netns] + command
 
-        if debug:
-            command.insert(1, "-vvv")
+        return GuestCommandStream(command, cmd_string, timeout, check=check)
+
+    async def arun(self, cmd_string, timeout=100, *, check=False, on_line=None):
+        """
+        Execute the command passed as a string in the ssh context, asynchronously.
 
-        return self._exec(command, timeout, check=check)
+        The command runs in its own `ssh` client on the ControlMaster connection,
+        without blocking the event loop, so that a single thread can drive commands
+        on many microVMs. If given, `on_line` is called with every line of stdout
+        as soon as it is received.
+        """
+        command = ["ssh", *self.options, self.user_host, cmd_string]
+        if self.netns is not None:
+            command = ["ip", "netns", "exec", self.netns] + command
+
+        async def read_stdout(stream):
+            lines = []
+            async for line in stream:
+                line = line.decode()
+                lines.append(line)
+                if on_line:
+                    on_line(line)
+            return "".join(lines)
+
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                *command,
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                # Allow for long lines, e.g. JSON output on a single line
+                limit=2**24,
+                # So that on timeout, we can kill anything holding on to the pipes
+                start_new_session=True,
+            )
+            try:
+                stdout, stderr, returncode = await asyncio.wait_for(
+                    asyncio.gather(
+                        read_stdout(proc.stdout), proc.stderr.read(), proc.wait()
+                    ),
+                    timeout,
+                )
+            except asyncio.TimeoutError as exc:
+                os.killpg(proc.pid, signal.SIGKILL)
+                await proc.wait()
+                raise subprocess.TimeoutExpired(cmd_string, timeout) from exc
+
+            result = CommandReturn(returncode, stdout, stderr.decode())
+            if check and result.returncode != 0:
+                raise ChildProcessError(_format_failure(cmd_string, result))
+        except Exception as exc:
+            if self._on_error:
+                self._on_error(exc)
+
+            raise
+
+        return result
 
     def check_output(self, cmd_string, timeout=100, *, debug=False):
         """Same as `run`, but raises an exception on non-zero return code of remote command"""
@@ -209,6 +844,13 @@ class SSHConnection:
             raise
 
 
+def _format_failure(cmd_string, result: CommandReturn):
+    return (
+        f"\nCommand:\n{cmd_string}\nstdout:\n{result.stdout}\n"
+        f"stderr:\n{result.stderr}\nReturned error code: {result.returncode}"
+    )
+
+
 def mac_from_ip(ip_address):
     """Create a MAC address based on the provided IP.
 
@@ -245,19 +887,23 @@ def random_str(k):
 class Tap:
     """Functionality for creating a tap and cleaning up after it."""
 
-    def __init__(self, name, netns, ip=None):
+    def __init__(self, name, netns, ip=None, mtu=None, tx_queue_len=None):
         """Set up the name and network namespace for this tap interface.
 
-        It also creates a new tap device, brings it up and moves the interface
-        to the specified namespace.
+        It also creates a new tap device directly in the specified namespace
+        (to avoid conflicts) and, if given an IP, assigns it and brings the
+        interface up. All settings are applied in a single netlink request.
         """
         self._name = name
         self._netns = netns
-        # Create the tap device tap0 directly in the network namespace to avoid
-        # conflicts
-        self.netns.check_output(f"ip tuntap add mode tap name {name}")
+        with netlink.in_netns(netns.path):
+            netlink.create_tap(name)
+        rtnl = netns.rtnl
+        self.index = rtnl.if_index(name)
         if ip:
-            self.netns.check_output(f"ifconfig {name} {ip} up")
+            rtnl.add_address(self.index, ip)
+        rtnl.set_link(self.index, up=bool(ip) or None, mtu=mtu, txqlen=tx_queue_len)
+        rtnl.commit()
 
     @property
     def name(self):
@@ -271,7 +917,16 @@ class Tap:
 
     def set_tx_queue_len(self, tx_queue_len):
         """Set the length of the tap's TX queue."""
-        self.netns.check_output(f"ip link set {self.name} txqueuelen {tx_queue_len}")
+        self.netns.rtnl.set_link(self.index, txqlen=tx_queue_len)
+        self.netns.rtnl.commit()
+
+    def has_carrier(self):
+        """Is a process (i.e. Firecracker) attached to the tap"""
+        return bool(self.netns.rtnl.link_flags(self.index) & netlink.IFF_LOWER_UP)
+
+    def stats(self):
+        """The packet, byte, error and drop counters of the tap, as seen from the host"""
+        return self.netns.rtnl.link_stats(self.index)
 
     def __repr__(self):
         return f"<Tap name={self.name} netns={self.netns.id}>"
@@ -315,6 +970,11 @@ class NetNs:
 
     id: str
     taps: dict[str, Tap] = field(init=False, default_factory=dict)
+    # The pool this namespace is returned to on cleanup, if any
+    pool: "NetNsPool" = field(default=None, repr=False, compare=False)
+    _rtnl: netlink.RtNetlink = field(
+        init=False, default=None, repr=False, compare=False
+    )
 
     @property
     def path(self):
@@ -324,6 +984,14 @@ class NetNs:
         """
         return Path("/var/run/netns") / self.id
 
+    @property
+    def rtnl(self):
+        """A netlink socket operating on this namespace"""
+        if self._rtnl is None:
+            with netlink.in_netns(self.path):
+                self._rtnl = netlink.RtNetlink()
+        return self._rtnl
+
     def cmd_prefix(self):
         """Return the jailer context netns file prefix."""
         return f"ip netns exec {self.id}"
@@ -332,23 +1000,39 @@ class NetNs:
         """Run a command inside the netns."""
         return utils.check_output(f"{self.cmd_prefix()} {cmd}")
 
+    @staticmethod
+    def setup_all(namespaces):
+        """Create all of `namespaces` that do not exist yet, with a single `ip` process"""
+        _ip_batch(f"netns add {ns.id}" for ns in namespaces if not ns.path.exists())
+
+    @staticmethod
+    def destroy_all(namespaces):
+        """Delete all of `namespaces`, with a single `ip` process"""
+        for ns in namespaces:
+            if ns._rtnl is not None:
+                ns._rtnl.close()
+                ns._rtnl = None
+            ns.taps.clear()
+        _ip_batch(f"netns del {ns.id}" for ns in namespaces if ns.path.exists())
+
     def setup(self):
         """Set up this network namespace."""
-        if not self.path.exists():
-            utils.check_output(f"ip netns add {self.id}")
+        self.setup_all([self])
 
     def cleanup(self):
-        """Clean up this network namespace."""
-        if self.path.exists():
-            utils.check_output(f"ip netns del {self.id}")
+        """Clean up this network namespace, or return it to its pool."""
+        if self.pool is not None:
+            self.pool.put(self)
+        else:
+            self.destroy_all([self])
 
-    def add_tap(self, name, ip):
+    def add_tap(self, name, ip, **kwargs):
         """Add a TAP device to the namespace
 
         We assume that a Tap is always configured with the same IP.
         """
         if name not in self.taps:
-            tap = Tap(name, self, ip)
+            tap = Tap(name, self, ip, **kwargs)
             self.taps[name] = tap
         return self.taps[name]
 
@@ -359,8 +1043,67 @@ class NetNs:
         Otherwise trying to reuse the TAP may return
             `Resource busy (os error 16)`
         """
-        for tap in self.taps:
-            _, stdout, _ = self.check_output(f"cat /sys/class/net/{tap}/carrier")
-            if stdout.strip() != "0":
-                return True
-        return False
+        return any(tap.has_carrier() for tap in self.taps.values())
+
+
+def _ip_batch(commands):
+    """Run `ip` commands (without the leading `ip`) in a single `ip -batch` process"""
+    script = "".join(f"{command}\n" for command in commands)
+    if not script:
+        return
+    proc = subprocess.run(
+        ["ip", "-batch", "-"],
+        input=script,
+        capture_output=True,
+        text=True,
+        check=False,
+    )
+    if proc.returncode != 0:
+        raise ChildProcessError(
+            f"ip -batch failed with {proc.returncode}:\n{script}\n"
+            f"[stderr] {proc.stderr}"
+        )
+
+
+class NetNsPool:
+    """Network namespaces created in batches up front, and reused once returned
+
+    Namespaces handed out by `get` are returned to the pool by their
+    `cleanup`, and only deleted by `close`.
+    """
+
+    def __init__(self, prefix: str, size: int = 8):
+        self.prefix = prefix
+        self._all = []
+        self._free = []
+        # `get` is also called from the warm pool thread of `MicroVMFactory`
+        self._lock = threading.Lock()
+        self._grow(size)
+
+    def _grow(self, count):
+        start = len(self._all)
+        new = [NetNs(f"{self.prefix}{start + i}", pool=self) for i in range(count)]
+        NetNs.setup_all(new)
+        self._all.extend(new)
+        self._free.extend(new)
+
+    def get(self, _netns_id=None):
+        """Get a free network namespace"""
+        with self._lock:
+            if not self._free:
+                self._grow(max(len(self._all), 1))
+            ns = self._free.pop(0)
+        while ns.is_used():
+            time.sleep(0.01)
+        return ns
+
+    def put(self, ns: NetNs):
+        """Return a namespace to the pool"""
+        with self._lock:
+            self._free.append(ns)
+
+    def close(self):
+        """Delete all namespaces of the pool"""
+        NetNs.destroy_all(self._all)
+        self._all.clear()
+        self._free.clear()
@@ -0,0 +1,101 @@
+# Copyright 2025 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+"""
+A small-packet UDP traffic tool, run in the guest or in a network namespace
+on the host.
+
+    python3 udp_pps.py echo <bind_ip> <port> <duration_s>
+        Send every datagram received back to its sender.
+    python3 udp_pps.py sink <bind_ip> <port> <duration_s>
+        Receive and discard datagrams.
+    python3 udp_pps.py flood <dst_ip> <port> <size> <duration_s>
+        Send datagrams of `size` bytes as fast as possible.
+
+Servers print a `{"listening": port}` line once they are ready. On exit,
+every mode prints a line with a JSON summary of the packets it handled.
+Only uses the standard library, as it is copied into the guest.
+"""
+
+import errno
+import json
+import socket
+import sys
+import time
+
+# Large enough to absorb bursts without dropping, while the tool is descheduled
+SOCKET_BUFFER_BYTES = 8 * 2**20
+
+
+def eprint(*args, **kwargs):
+    """Print to stderr"""
+    print(*args, file=sys.stderr, **kwargs)
+
+
+def _server_socket(ip_address, port):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_BUFFER_BYTES)
+    sock.bind((ip_address, port))
+    # Wake up regularly to check for the deadline
+    sock.settimeout(0.1)
+    print(json.dumps({"listening": port}), flush=True)
+    return sock
+
+
+def serve(ip_address, port, duration_s, echo):
+    """Receive (and echo, if `echo`) datagrams for `duration_s` seconds"""
+    sock = _server_socket(ip_address, port)
+    buf = bytearray(65536)
+    packets = nbytes = 0
+    deadline = time.monotonic() + duration_s
+    while time.monotonic() < deadline:
+        try:
+            size, sender = sock.recvfrom_into(buf)
+        except socket.timeout:
+            continue
+        packets += 1
+        nbytes += size
+        if echo:
+            sock.sendto(memoryview(buf)[:size], sender)
+    return {"packets": packets, "bytes": nbytes}
+
+
+def flood(ip_address, port, size, duration_s):
+    """Send datagrams of `size` bytes for `duration_s` seconds"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCKET_BUFFER_BYTES)
+    sock.connect((ip_address, port))
+    payload = b"x" * size
+    packets = dropped = 0
+    start = time.monotonic()
+    deadline = start + duration_s
+    # Only look at the clock every so often, it costs as much as a send
+    while time.monotonic() < deadline:
+        for _ in range(256):
+            try:
+                sock.send(payload)
+                packets += 1
+            except ConnectionRefusedError:
+                # An ICMP port unreachable for an earlier datagram
+                dropped += 1
+            except OSError as err:
+                if err.errno != errno.ENOBUFS:
+                    raise
+                dropped += 1
+    duration_s = time.monotonic() - start
+    return {"packets": packets, "dropped": dropped, "duration_s": duration_s}
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 5:
+        eprint(__doc__)
+        sys.exit(1)
+
+    mode, ip, dst_port = sys.argv[1], sys.argv[2], int(sys.argv[3])
+    if mode in ("echo", "sink"):
+        summary = serve(ip, dst_port, float(sys.argv[4]), echo=mode == "echo")
+    elif mode == "flood" and len(sys.argv) == 6:
+        summary = flood(ip, dst_port, int(sys.argv[4]), float(sys.argv[5]))
+    else:
+        eprint(__doc__)
+        sys.exit(1)
+    print(json.dumps(summary), flush=True)
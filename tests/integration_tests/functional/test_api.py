@@ -4,6 +4,7 @@
 
 # Disable pylint C0302: Too many lines in module
 # pylint: disable=C0302
+import asyncio
 import os
 import platform
 import re
@@ -16,6 +17,7 @@ import pytest
 import host_tools.drive as drive_tools
 import host_tools.network as net_tools
 from framework import utils, utils_cpuid
+from framework.http_api import ApiConnection, AsyncApiConnection
 from framework.utils import get_firecracker_version_from_toml
 from framework.utils_cpu_templates import SUPPORTED_CPU_TEMPLATES
 
@@ -1351,3 +1353,33 @@ def test_negative_snapshot_load_api(microvm_factory):
     # The snapshot/memory files above don't exist, but the request is otherwise syntactically valid.
     # In this case, Firecracker exits.
     vm.mark_killed()
+
+
+def test_api_pipelining(uvm_plain):
+    """
+    Test that pipelined requests on a single API connection are answered in order.
+    """
+    test_microvm = uvm_plain
+    test_microvm.spawn()
+    test_microvm.basic_config()
+
+    with ApiConnection(test_microvm.api.socket) as conn:
+        responses = conn.pipeline(
+            [("PUT", "/mmds", {"counter": i}) for i in range(100)]
+            + [("GET", "/mmds", None), ("PATCH", "/machine-config", {"foo": 1})]
+        )
+        assert [r.status_code for r in responses[:100]] == [204] * 100
+        assert responses[100].json() == {"counter": 99}
+        assert not responses[101].ok
+
+        assert len(conn.latencies["PUT /mmds"]) == 100
+        assert conn.errors == {"PATCH /machine-config": 1}
+
+    async def get_mmds_concurrently():
+        async with await AsyncApiConnection.open(test_microvm.api.socket) as conn:
+            return await asyncio.gather(
+                *(conn.request("GET", "/mmds") for _ in range(50))
+            )
+
+    responses = asyncio.run(get_mmds_concurrently())
+    assert all(r.json() == {"counter": 99} for r in responses)
@@ -2,8 +2,11 @@
 # SPDX-License-Identifier: Apache-2.0
 """Ensure multiple microVMs work correctly when spawned simultaneously."""
 
+import asyncio
 from concurrent.futures import ThreadPoolExecutor
 
+from framework.microvm import gather_on
+
 NO_OF_MICROVMS = 20
 
 
@@ -19,7 +22,45 @@ def test_run_concurrency(microvm_factory, guest_kernel, rootfs):
         microvm.basic_config(vcpu_count=1, mem_size_mib=128)
         microvm.add_net_iface()
         microvm.start()
+        microvm.wait_for_ssh_up()
+        return microvm
 
     with ThreadPoolExecutor(max_workers=NO_OF_MICROVMS) as tpe:
-        for _ in range(NO_OF_MICROVMS):
-            tpe.submit(launch1)
+        microvms = list(tpe.map(lambda _: launch1(), range(NO_OF_MICROVMS)))
+
+    # All guests respond, driven from a single thread
+    lines = []
+    results = asyncio.run(
+        gather_on(
+            microvms,
+            "cat /proc/uptime",
+            check=True,
+            on_line=lambda microvm, line: lines.append((microvm.id, line)),
+        )
+    )
+    for result in results:
+        assert not isinstance(result, Exception), result
+    assert {microvm_id for microvm_id, _ in lines} == {vm.id for vm in microvms}
+
+
+def test_warm_pool(microvm_factory, guest_kernel_linux_5_10, rootfs):
+    """
+    Check that microVMs handed out by the factory's warm pool boot.
+    """
+    pool = microvm_factory.start_warm_pool(2)
+    pool.wait_until_full()
+
+    for _ in range(2):
+        microvm = microvm_factory.build(guest_kernel_linux_5_10, rootfs)
+        microvm.spawn()
+        microvm.basic_config(vcpu_count=1, mem_size_mib=128)
+        microvm.add_net_iface()
+        microvm.start()
+
+    # A different build configuration is never served from the pool
+    microvm_factory.build(guest_kernel_linux_5_10, rootfs, monitor_memory=False)
+
+    stats = microvm_factory.stop_warm_pool()
+    assert stats["hits"] == 2
+    assert stats["misses"] == 1
+    assert len(stats["refill_latencies"]) >= 2
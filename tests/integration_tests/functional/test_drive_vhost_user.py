@@ -289,7 +289,7 @@ def test_config_change(microvm_factory, guest_kernel, rootfs):
     vm.add_net_iface()
 
     # Add a block device to test resizing.
-    fs = drive_tools.FilesystemFile(size=orig_size)
+    fs = drive_tools.FilesystemFile(os.path.join(vm.fsfiles, "scratch"), orig_size)
     vm.add_vhost_user_drive("scratch", fs.path)
     vm.start()
 
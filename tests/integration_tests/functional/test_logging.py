@@ -198,3 +198,19 @@ def test_log_config(uvm_plain, log_level, show_level, show_origin):
     # Check format of messages
     for line in lines:
         check_log_message_format(line, microvm.id, log_level, show_level, show_origin)
+
+
+@pytest.mark.parametrize("show_level,show_origin", [(False, False), (True, True)])
+def test_api_response_times_validated(uvm_plain, show_level, show_origin):
+    """
+    Test that the durations of API calls, which are validated when a microVM
+    is killed, are found in the log.
+    """
+    microvm = uvm_plain
+    microvm.spawn(log_show_level=show_level, log_show_origin=show_origin)
+    microvm.basic_config()
+    # The duration of a call is only logged after its response was sent
+    microvm.wait_for_log("Total previous API call duration")
+
+    # pylint: disable=protected-access
+    assert microvm._validate_api_response_times() > 0
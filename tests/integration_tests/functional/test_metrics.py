@@ -4,8 +4,12 @@
 
 import os
 
+import pytest
+from tenacity import retry, stop_after_attempt, wait_fixed
+
 import host_tools.drive as drive_tools
 from host_tools.fcmetrics import FcDeviceMetrics, validate_fc_metrics
+from host_tools.metrics import EMFEmitter, LocalEMFAgent
 
 
 def test_flush_metrics(uvm_plain):
@@ -85,3 +89,33 @@ def test_block_metrics(uvm_plain):
 
     # check that the started microvm has "block" and "num_block_devices" number of "block_" metrics
     block_metrics.validate(test_microvm)
+
+
+@pytest.mark.parametrize("protocol", ["udp", "tcp"])
+def test_emf_emitter(protocol):
+    """
+    Check that the batched EMF emitter delivers all values to the agent.
+    """
+    nr_metrics = 150
+    nr_values = 20_000
+
+    with LocalEMFAgent(protocol) as agent:
+        emitter = EMFEmitter(agent.endpoint, max_pending=1000)
+        for i in range(nr_values):
+            emitter.put_metric({"test": "emf"}, f"metric{i % nr_metrics}", i, "Count")
+        emitter.close()
+
+        @retry(wait=wait_fixed(0.1), stop=stop_after_attempt(50), reraise=True)
+        def check_received():
+            received = [
+                value
+                for i in range(nr_metrics)
+                for value in agent.values(f"metric{i}")
+            ]
+            assert sorted(received) == list(range(nr_values))
+
+        check_received()
+
+    assert emitter.dropped == 0
+    # Values are coalesced, so we need far fewer messages than values
+    assert emitter.sent < nr_values / 50
@@ -11,7 +11,7 @@ import time
 
 from framework import utils
 from framework.microvm import Serial
-from framework.state_machine import TestState
+from framework.state_machine import MatchStaticString, TestState
 
 PLATFORM = platform.machine()
 
@@ -107,11 +107,37 @@ def test_serial_console_login(uvm_plain_any):
 
     serial = Serial(microvm)
     serial.open()
-    current_state = WaitTerminal("ubuntu-fc-uvm:")
+    serial.run_states(WaitTerminal("ubuntu-fc-uvm:"), TestFinished)
 
-    while not isinstance(current_state, TestFinished):
-        output_char = serial.rx_char()
-        current_state = current_state.handle_input(serial, output_char)
+
+def test_match_static_string_split_input():
+    """
+    Test that a match is found however the input is split into chunks.
+    """
+    token = "ubuntu-fc-uvm:"
+    text = "login prompt ubuntu-fc-uvm: after"
+
+    # One char at a time
+    matcher = MatchStaticString(token)
+    matches = [matcher.match(char) for char in text]
+    assert matches.index(True) == text.index(token) + len(token) - 1
+    assert matches.count(True) == 1
+
+    # Every way of splitting the input in two chunks, and in chunks of every size
+    splits = [[text[:i], text[i:]] for i in range(1, len(text))]
+    splits += [
+        [text[i : i + size] for i in range(0, len(text), size)]
+        for size in range(1, len(text) + 1)
+    ]
+    for chunks in splits:
+        matcher = MatchStaticString(token)
+        found = [
+            matcher.remainder + "".join(chunks[i + 1 :])
+            for i, chunk in enumerate(chunks)
+            if matcher.match(chunk)
+        ]
+        # The remainder is the input following the match in its chunk
+        assert found == [" after"], chunks
 
 
 def get_total_mem_size(pid):
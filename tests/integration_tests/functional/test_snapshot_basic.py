@@ -21,6 +21,7 @@ import host_tools.network as net_tools
 from framework import utils
 from framework.microvm import SnapshotType
 from framework.properties import global_props
+from framework.snapshot_store import SnapshotStore
 from framework.utils import check_filesystem, check_output
 from framework.utils_vsock import (
     ECHO_SERVER_PORT,
@@ -468,6 +469,41 @@ def test_diff_snapshot_overlay(guest_kernel, rootfs, microvm_factory):
     # Check that the restored VM works
 
 
+def test_snapshot_store(uvm_nano, microvm_factory, tmp_path):
+    """
+    Tests that snapshots saved to the snapshot store share unchanged memory, and
+    that they can be restored from the store.
+    """
+    vm = uvm_nano
+    vm.add_net_iface()
+    vm.start()
+
+    store = SnapshotStore(tmp_path / "store")
+
+    first_snapshot = vm.snapshot_full(mem_path="mem1", vmstate_path="vmstate1")
+    first_bytes = store.put("first", first_snapshot)
+    vm.resume()
+
+    vm.ssh.check_output("true")
+    second_snapshot = vm.snapshot_full(mem_path="mem2", vmstate_path="vmstate2")
+    second_bytes = store.put("second", second_snapshot)
+    vm.kill()
+
+    # Most of guest memory did not change between the two snapshots
+    assert second_bytes < first_bytes / 2
+
+    restored_vm = microvm_factory.build()
+    restored_vm.spawn()
+    snapshot = store.materialize("second", tmp_path / "restore")
+    restored_vm.restore_from_snapshot(snapshot, resume=True)
+
+    usage = store.disk_usage
+    store.delete("first")
+    freed = store.gc()
+    assert 0 < freed < usage
+    assert store.names() == ["second"]
+
+
 def test_snapshot_overwrite_self(guest_kernel, rootfs, microvm_factory):
     """Tests that if we try to take a snapshot that would overwrite the
     very file from which the current VM is stored, nothing happens.
@@ -0,0 +1,63 @@
+# Copyright 2025 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+"""Performance benchmark for the throughput and latency of the API server."""
+
+import pytest
+
+from framework.api_load import MMDS_DATA, WORKLOADS, run_load
+
+ROUNDS = 5
+ROUND_DURATION_S = 10
+
+
+@pytest.mark.nonci
+@pytest.mark.parametrize("workload", sorted(WORKLOADS))
+@pytest.mark.parametrize(
+    "connections,depth", [(1, 1), (8, 1), (8, 8)], ids=["c1d1", "c8d1", "c8d8"]
+)
+def test_api_server_load(
+    microvm_factory,
+    guest_kernel_acpi,
+    rootfs,
+    workload,
+    connections,
+    depth,
+    metrics,
+    perf_iterations,
+):
+    """
+    Measure API requests per second and client side latency percentiles,
+    while a booted microVM is hammered with `workload`.
+    """
+    vm = microvm_factory.build(guest_kernel_acpi, rootfs, monitor_memory=False)
+    vm.spawn(log_level="Info", emit_metrics=True)
+    vm.basic_config(vcpu_count=2, mem_size_mib=256)
+    vm.add_net_iface()
+    vm.api.balloon.put(amount_mib=0, deflate_on_oom=True, stats_polling_interval_s=1)
+    vm.api.mmds.put(**MMDS_DATA)
+    vm.start()
+
+    metrics.set_dimensions(
+        {
+            "performance_test": "test_api_server_load",
+            "workload": workload,
+            "connections": str(connections),
+            "depth": str(depth),
+            **vm.dimensions,
+        }
+    )
+
+    for i in range(perf_iterations(ROUNDS)):
+        result = run_load(
+            vm.api.socket,
+            WORKLOADS[workload],
+            duration_s=ROUND_DURATION_S,
+            connections=connections,
+            depth=depth,
+            seed=i,
+        )
+        assert not result.errors, result.errors
+
+        metrics.put_metric("throughput", result.throughput, unit="Count/Second")
+        for name, value in result.overall().summary_us().items():
+            metrics.put_metric(f"latency_{name}", value, unit="Microseconds")
@@ -10,7 +10,8 @@ from pathlib import Path
 import pytest
 
 import host_tools.drive as drive_tools
-from framework.utils import CmdBuilder, check_output, track_cpu_utilization
+from framework.utils import CmdBuilder, check_output
+from host_tools.cpu_load import track_cpu_utilization
 
 # size of the block device used in the test, in MB
 BLOCK_DEVICE_SIZE_MB = 2048
@@ -95,8 +96,9 @@ def run_fio(microvm, mode, block_size, test_output_dir, fio_engine="libaio"):
         assert rc == 0, stderr
         assert stderr == ""
 
-        microvm.ssh.scp_get("/tmp/fio.json", test_output_dir)
-        microvm.ssh.scp_get("/tmp/*.log", test_output_dir)
+        microvm.ssh.tar_get(
+            ["/tmp/fio.json", "/tmp/*.log"], test_output_dir, compress=True
+        )
 
         return cpu_load_future.result()
 
@@ -181,7 +183,7 @@ def test_block_performance(
     vm.add_net_iface()
     # Add a secondary block device for benchmark tests.
     fs = drive_tools.FilesystemFile(
-        os.path.join(vm.fsfiles, "scratch"), BLOCK_DEVICE_SIZE_MB
+        os.path.join(vm.fsfiles, "scratch"), BLOCK_DEVICE_SIZE_MB, preallocate=True
     )
     vm.add_drive("scratch", fs.path, io_engine=io_engine)
     vm.start()
@@ -232,7 +234,9 @@ def test_block_vhost_user_performance(
     vm.add_net_iface()
 
     # Add a secondary block device for benchmark tests.
-    fs = drive_tools.FilesystemFile(size=BLOCK_DEVICE_SIZE_MB)
+    fs = drive_tools.FilesystemFile(
+        os.path.join(vm.fsfiles, "scratch"), BLOCK_DEVICE_SIZE_MB, preallocate=True
+    )
     vm.add_vhost_user_drive("scratch", fs.path)
     vm.start()
 
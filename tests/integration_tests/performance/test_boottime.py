@@ -4,7 +4,6 @@
 
 import datetime
 import re
-import time
 
 import pytest
 
@@ -18,33 +17,25 @@ DEFAULT_BOOT_ARGS = (
 
 def get_boottime_device_info(vm):
     """Auxiliary function for asserting the expected boot time."""
-    boot_time_us = None
-    boot_time_cpu_us = None
-    timestamps = []
-
     timestamp_log_regex = (
         r"Guest-boot-time =\s+(\d+) us\s+(\d+) ms,\s+(\d+) CPU us\s+(\d+) CPU ms"
     )
 
-    iterations = 50
-    sleep_time_s = 0.1
-    for _ in range(iterations):
-        timestamps = re.findall(timestamp_log_regex, vm.log_data)
-        if timestamps:
-            break
-        time.sleep(sleep_time_s)
-    if timestamps:
-        boot_time_us, _, boot_time_cpu_us, _ = timestamps[0]
-
-    assert boot_time_us and boot_time_cpu_us, (
-        f"MicroVM did not boot within {sleep_time_s * iterations}s\n"
-        f"Firecracker logs:\n{vm.log_data}\n"
-        f"Thread backtraces:\n{vm.thread_backtraces}"
-    )
+    timeout_s = 5
+    try:
+        _, match = vm.log_reader.wait_for(timestamp_log_regex, timeout_s)
+    except TimeoutError as err:
+        raise AssertionError(
+            f"MicroVM did not boot within {timeout_s}s\n"
+            f"Firecracker logs:\n{vm.log_data}\n"
+            f"Thread backtraces:\n{vm.thread_backtraces}"
+        ) from err
+
+    boot_time_us, _, boot_time_cpu_us, _ = match.groups()
     return int(boot_time_us), int(boot_time_cpu_us)
 
 
-def find_events(log_data):
+def find_events(log_reader):
     """
     Parse events in the Firecracker logs
 
@@ -53,11 +44,13 @@ def find_events(log_data):
         TIMESTAMP [LOGLEVEL] event_(start|end): EVENT
     """
     ts_fmt = "%Y-%m-%dT%H:%M:%S.%f"
-    matches = re.findall(r"(.+) \[.+\] event_(start|end): (.*)", log_data)
+    event_regex = re.compile(r"^event_(start|end): (.*)")
     timestamps = {}
-    for ts, when, what in matches:
-        evt1 = timestamps.setdefault(what, {})
-        evt1[when] = datetime.datetime.strptime(ts[:-3], ts_fmt)
+    for record in log_reader.since(0):
+        if match := event_regex.match(record.message):
+            when, what = match.groups()
+            evt1 = timestamps.setdefault(what, {})
+            evt1[when] = datetime.datetime.strptime(record.timestamp[:-3], ts_fmt)
     for _, val in timestamps.items():
         val["duration"] = val["end"] - val["start"]
     return timestamps
@@ -139,7 +132,7 @@ def test_boottime(
             unit="Microseconds",
         )
 
-        events = find_events(vm.log_data)
+        events = find_events(vm.log_reader)
         build_time = events["build microvm for boot"]["duration"]
         metrics.put_metric("build_time", build_time.microseconds, unit="Microseconds")
         resume_time = events["boot microvm"]["duration"]
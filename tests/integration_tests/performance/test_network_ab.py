@@ -8,7 +8,13 @@ from pathlib import Path
 
 import pytest
 
-from framework.utils_iperf import IPerf3Test, emit_iperf3_metrics
+from framework.utils_iperf import (
+    IPerf3Fleet,
+    IPerf3Test,
+    emit_fleet_metrics,
+    emit_iperf3_metrics,
+)
+from framework.utils_udp import UdpBenchmark
 
 
 def consume_ping_output(ping_putput, request_per_round):
@@ -87,6 +93,76 @@ def test_network_latency(network_microvm, metrics):
         metrics.put_metric("ping_latency", sample, "Milliseconds")
 
 
+def emit_udp_metrics(metrics, result):
+    """Consume the `UdpResult` of a small-packet benchmark"""
+    metrics.put_metric("pps", result.pps, "Count/Second")
+    metrics.put_metric(
+        "vcpu_cpu_per_packet", result.cpu_per_packet_us("fc_vcpu"), "Microseconds"
+    )
+    metrics.put_metric(
+        "vmm_cpu_per_packet", result.cpu_per_packet_us("firecracker"), "Microseconds"
+    )
+
+
+@pytest.mark.nonci
+@pytest.mark.parametrize("network_microvm", [1, 2], indirect=True)
+@pytest.mark.parametrize("payload_size", [64, 1024])
+def test_network_udp_latency(network_microvm, payload_size, metrics):
+    """
+    UDP request/response between host and guest, one request at a time.
+    """
+    rounds = 5
+    round_duration_s = 10
+
+    metrics.set_dimensions(
+        {
+            "performance_test": "test_network_udp_latency",
+            "payload_size": str(payload_size),
+            **network_microvm.dimensions,
+        }
+    )
+
+    benchmark = UdpBenchmark(network_microvm, payload_size=payload_size)
+    for _ in range(rounds):
+        result = benchmark.request_response(round_duration_s)
+        assert len(result.rtt) > 0, "no responses from the guest"
+
+        for name, value in result.rtt.summary_us().items():
+            metrics.put_metric(f"rtt_{name}", value / 1000, "Milliseconds")
+        emit_udp_metrics(metrics, result)
+
+
+@pytest.mark.nonci
+@pytest.mark.parametrize("network_microvm", [1, 2], indirect=True)
+@pytest.mark.parametrize("payload_size", [64, 1024])
+@pytest.mark.parametrize("mode", ["g2h", "h2g"])
+def test_network_pps(network_microvm, payload_size, mode, metrics):
+    """
+    Flood either the host or the guest with small UDP packets, and count how
+    many make it through the virtio-net device per second.
+    """
+    rounds = 5
+    round_duration_s = 10
+
+    metrics.set_dimensions(
+        {
+            "performance_test": "test_network_pps",
+            "payload_size": str(payload_size),
+            "mode": mode,
+            **network_microvm.dimensions,
+        }
+    )
+
+    benchmark = UdpBenchmark(network_microvm, payload_size=payload_size)
+    for _ in range(rounds):
+        result = benchmark.pps(
+            mode, round_duration_s, senders=network_microvm.vcpus_count
+        )
+        assert result.packets > 0
+
+        emit_udp_metrics(metrics, result)
+
+
 @pytest.mark.nonci
 @pytest.mark.timeout(120)
 @pytest.mark.parametrize("network_microvm", [1, 2], indirect=True)
@@ -146,3 +222,74 @@ def test_network_tcp_throughput(
         )
 
     emit_iperf3_metrics(metrics, data, warmup_sec)
+
+
+@pytest.mark.nonci
+@pytest.mark.timeout(300)
+@pytest.mark.parametrize("vm_count,iface_count", [(4, 1), (4, 3)], ids=["4x1", "4x3"])
+@pytest.mark.parametrize("payload_length", ["1K", "128K"], ids=["p1K", "p128K"])
+@pytest.mark.parametrize("connections", [1, 4])
+@pytest.mark.parametrize("mode", ["g2h", "h2g", "bd"])
+def test_network_density(
+    microvm_factory,
+    guest_kernel_acpi,
+    rootfs,
+    vm_count,
+    iface_count,
+    payload_length,
+    connections,
+    mode,
+    metrics,
+    results_dir,
+):
+    """
+    Iperf between guests and host on all interfaces of many microVMs at once,
+    reporting the aggregate throughput per host CPU used by Firecracker.
+    """
+    # Time (in seconds) for which iperf "warms up"
+    warmup_sec = 5
+    # Time (in seconds) for which iperf runs after warmup is done
+    runtime_sec = 20
+
+    # Bidirectional mode alternates the direction of the connections of an
+    # interface
+    if mode == "bd" and connections < 2:
+        pytest.skip("bidirectional test only done with at least 2 connections")
+
+    vms = []
+    for _ in range(vm_count):
+        vm = microvm_factory.build(guest_kernel_acpi, rootfs, monitor_memory=False)
+        vm.spawn(log_level="Info", emit_metrics=True)
+        vm.basic_config(vcpu_count=2, mem_size_mib=512)
+        for _ in range(iface_count):
+            vm.add_net_iface()
+        vm.start()
+        vms.append(vm)
+    for vm in vms:
+        vm.wait_for_ssh_up()
+
+    metrics.set_dimensions(
+        {
+            "performance_test": "test_network_density",
+            "vm_count": str(vm_count),
+            "iface_count": str(iface_count),
+            "payload_length": payload_length,
+            "connections": str(connections),
+            "mode": mode,
+            **vms[0].dimensions,
+        }
+    )
+
+    test = IPerf3Fleet(
+        vms,
+        base_port=5000,
+        runtime=runtime_sec,
+        omit=warmup_sec,
+        mode=mode,
+        connections=connections,
+        payload_length=payload_length,
+    )
+    result = test.run_test()
+
+    result.save(results_dir / "dataset.jsonl")
+    emit_fleet_metrics(metrics, result)
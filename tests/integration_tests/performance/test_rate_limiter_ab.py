@@ -0,0 +1,176 @@
+# Copyright 2025 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+"""Performance benchmark for the precision and cost of net and block rate limiters."""
+
+import os
+
+import pytest
+
+import host_tools.drive as drive_tools
+from framework.utils_rate_limiter import Bucket, ProcIoCounter, trace_rate_limiter
+from framework.utils_udp import GUEST_TOOL, HOST_TOOL
+from host_tools import netlink
+
+MB = 2**20
+
+ROUNDS = 3
+PHASE_DURATION_S = 5
+PORT = 5400
+# Fits into a single frame with the default MTU
+DATAGRAM_SIZE = 1400
+
+# All at 50 MiB/s, which the loads on all devices comfortably exceed
+# without limiter
+BUCKETS = {
+    "100ms": Bucket(size=5 * MB, refill_time=100),
+    "10ms": Bucket(size=MB // 2, refill_time=10),
+    "1s": Bucket(size=50 * MB, refill_time=1000),
+    "100ms_burst": Bucket(size=5 * MB, refill_time=100, one_time_burst=50 * MB),
+}
+# What the rate limiter is PATCHed to while the load is running, at 25 MiB/s,
+# so that the load stays greedy, and it is the limiter being measured
+PATCHED_BUCKET = Bucket(size=5 * MB // 2, refill_time=100)
+
+STAT_UNITS = {
+    "rate_error": "Percent",
+    "rate_error_10ms_p1": "Percent",
+    "rate_error_10ms_p99": "Percent",
+    "burst_bytes": "Bytes",
+    "burst_error": "Percent",
+    "burst_duration": "Seconds",
+}
+
+
+def _net_setup(vm, device):
+    """Counter, load and patch functions for a rate limiter on eth0"""
+    iface = vm.iface["eth0"]["iface"]
+    tap = vm.iface["eth0"]["tap"]
+    vm.ssh.scp_put(HOST_TOOL, GUEST_TOOL)
+
+    # The sampler thread gets its own socket, as they are not thread safe
+    with netlink.in_netns(vm.netns.path):
+        rtnl = netlink.RtNetlink()
+
+    if device == "net_tx":
+        # Frames the guest sends are received by the tap on the host
+        def counter():
+            return rtnl.link_stats(tap.index)["rx_bytes"]
+
+        def load(duration_s):
+            args = f"{iface.host_ip} {PORT} {DATAGRAM_SIZE} {duration_s}"
+            vm.ssh.check_output(
+                f"python3 {GUEST_TOOL} flood {args}", timeout=duration_s + 60
+            )
+
+    else:
+
+        def counter():
+            return rtnl.link_stats(tap.index)["tx_bytes"]
+
+        def load(duration_s):
+            args = f"{iface.guest_ip} {PORT} {DATAGRAM_SIZE} {duration_s}"
+            vm.netns.check_output(f"python3 {HOST_TOOL} flood {args}")
+
+    direction = device.removeprefix("net_")
+
+    def patch(bucket):
+        vm.api.network.patch(
+            iface_id="eth0", **{f"{direction}_rate_limiter": bucket.rate_limiter()}
+        )
+
+    return counter, load, patch, rtnl.close
+
+
+def _block_setup(vm, device):
+    """Counter, load and patch functions for a rate limiter on the scratch drive"""
+    rw = device.removeprefix("block_")
+    # With the sync engine, the VMM thread does all I/O using (p)read and (p)write
+    counter = ProcIoCounter(vm.firecracker_pid, "rchar" if rw == "read" else "wchar")
+
+    def load(duration_s):
+        vm.ssh.check_output(
+            f"fio --name=rate_limiter --filename=/dev/vdb --direct=1 --rw={rw} "
+            f"--bs=64k --ioengine=libaio --iodepth=8 --time_based "
+            f"--runtime={duration_s}s",
+            timeout=duration_s + 60,
+        )
+
+    def patch(bucket):
+        vm.api.drive.patch(drive_id="scratch", rate_limiter=bucket.rate_limiter())
+
+    return counter, load, patch, counter.close
+
+
+@pytest.mark.nonci
+@pytest.mark.parametrize("bucket", BUCKETS)
+@pytest.mark.parametrize("device", ["net_tx", "net_rx", "block_write", "block_read"])
+def test_rate_limiter_precision(
+    microvm_factory,
+    guest_kernel_acpi,
+    rootfs,
+    device,
+    bucket,
+    metrics,
+    results_dir,
+    perf_iterations,
+):
+    """
+    Drive a greedy load through a rate limited device, and measure how closely
+    the bytes going through it follow the token bucket, at 10 ms resolution,
+    before and after PATCHing the rate limiter, and how much VMM CPU time
+    throttling costs.
+    """
+    vm = microvm_factory.build(guest_kernel_acpi, rootfs, monitor_memory=False)
+    vm.spawn(log_level="Info", emit_metrics=True)
+    vm.basic_config(vcpu_count=2, mem_size_mib=1024)
+    vm.add_net_iface()
+    fs = drive_tools.FilesystemFile(
+        os.path.join(vm.fsfiles, "scratch"), size=1024, preallocate=True
+    )
+    vm.add_drive("scratch", fs.path)
+    vm.start()
+
+    metrics.set_dimensions(
+        {
+            "performance_test": "test_rate_limiter_precision",
+            "device": device,
+            "bucket": bucket,
+            **vm.dimensions,
+        }
+    )
+
+    setup = _net_setup if device.startswith("net") else _block_setup
+    counter, load, patch, close = setup(vm, device)
+    try:
+        for i in range(perf_iterations(ROUNDS)):
+            trace = trace_rate_limiter(
+                vm,
+                counter,
+                load,
+                patch,
+                [BUCKETS[bucket], PATCHED_BUCKET],
+                PHASE_DURATION_S,
+            )
+            trace.save(results_dir / f"trace_{i}.npz")
+
+            metrics.put_metric(
+                "conformance_excess", trace.conformance_excess(), "Bytes"
+            )
+            for phase, prefix in enumerate(["", "patched_"]):
+                stats = trace.phase_stats(phase)
+                for name, unit in STAT_UNITS.items():
+                    metrics.put_metric(prefix + name, stats[name], unit)
+
+            transferred_mib = trace.transferred[-1] / MB
+            metrics.put_metric(
+                "vmm_cpu_utilization",
+                trace.vmm_cpu_s / trace.duration_s * 100,
+                "Percent",
+            )
+            metrics.put_metric(
+                "vmm_cpu_per_mib",
+                trace.vmm_cpu_s / transferred_mib * 1e6,
+                "Microseconds",
+            )
+    finally:
+        close()
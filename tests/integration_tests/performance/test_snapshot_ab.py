@@ -1,29 +1,28 @@
 # Copyright 2023 Amazon.com, Inc. or its affiliates. All Rights Reserved.
 # SPDX-License-Identifier: Apache-2.0
 """Performance benchmark for snapshot restore."""
+import os
 import re
 import signal
-import tempfile
 import time
 from dataclasses import dataclass
-from functools import lru_cache
 
 import pytest
 
 import host_tools.drive as drive_tools
 from framework.microvm import HugePagesConfig, Microvm
+from host_tools.fcmetrics_store import FCMetricsStore
 
 USEC_IN_MSEC = 1000
 NS_IN_MSEC = 1_000_000
 ITERATIONS = 30
 
 
-@lru_cache
-def get_scratch_drives():
-    """Create an array of scratch disks."""
-    scratchdisks = ["vdb", "vdc", "vdd", "vde"]
+def get_scratch_drives(vm, count):
+    """Create an array of `count` scratch disks, removed together with `vm`."""
+    scratchdisks = ["vdb", "vdc", "vdd", "vde"][:count]
     return [
-        (drive, drive_tools.FilesystemFile(tempfile.mktemp(), size=64))
+        (drive, drive_tools.FilesystemFile(os.path.join(vm.fsfiles, drive), size=64))
         for drive in scratchdisks
     ]
 
@@ -64,8 +63,7 @@ class SnapshotRestoreTest:
             vm.add_net_iface()
 
         if self.blocks > 1:
-            scratch_drives = get_scratch_drives()
-            for name, diskfile in scratch_drives[: (self.blocks - 1)]:
+            for name, diskfile in get_scratch_drives(vm, self.blocks - 1):
                 vm.add_drive(name, diskfile.path, io_engine="Sync")
 
         if self.all_devices:
@@ -96,7 +94,12 @@ class SnapshotRestoreTest:
     ids=lambda x: x.id,
 )
 def test_restore_latency(
-    microvm_factory, rootfs, guest_kernel_linux_5_10, test_setup, metrics
+    microvm_factory,
+    rootfs,
+    guest_kernel_linux_5_10,
+    test_setup,
+    metrics,
+    perf_iterations,
 ):
     """
     Restores snapshots with vcpu/memory configuration, roughly scaling according to mem = (vcpus - 1) * 2048MB,
@@ -122,17 +125,58 @@ def test_restore_latency(
 
     snapshot = vm.snapshot_full()
     vm.kill()
-    for microvm in microvm_factory.build_n_from_snapshot(snapshot, ITERATIONS):
-        value = 0
-        # Parse all metric data points in search of load_snapshot time.
+    iterations = perf_iterations(ITERATIONS)
+    for microvm in microvm_factory.build_n_from_snapshot(snapshot, iterations):
+        # Search all metric data points for the load_snapshot time.
         microvm.flush_metrics()
-        for data_point in microvm.get_all_metrics():
-            cur_value = data_point["latencies_us"]["load_snapshot"]
-            if cur_value > 0:
-                value = cur_value / USEC_IN_MSEC
-                break
-        assert value > 0
-        metrics.put_metric("latency", value, "Milliseconds")
+        store = FCMetricsStore.from_datapoints(microvm.get_all_metrics())
+        values = store.column("latencies_us.load_snapshot")
+        values = values[values > 0]
+        assert values.size > 0
+        metrics.put_metric("latency", values[0] / USEC_IN_MSEC, "Milliseconds")
+
+
+@pytest.mark.nonci
+@pytest.mark.parametrize("concurrency", [2, 4, 8])
+def test_parallel_restore_latency(
+    microvm_factory,
+    rootfs,
+    guest_kernel_linux_5_10,
+    concurrency,
+    metrics,
+    perf_iterations,
+):
+    """
+    Restores the same snapshot into `concurrency` microvms at a time, to measure restore latencies
+    when the host is busy restoring other microvms, instead of only on an otherwise idle host.
+    """
+    test_setup = SnapshotRestoreTest(mem=1024, vcpus=2)
+    vm = test_setup.boot_vm(microvm_factory, guest_kernel_linux_5_10, rootfs)
+
+    metrics.set_dimensions(
+        {
+            "net_devices": str(test_setup.nets),
+            "block_devices": str(test_setup.blocks),
+            "concurrency": str(concurrency),
+            "performance_test": "test_parallel_restore_latency",
+            **vm.dimensions,
+        }
+    )
+
+    snapshot = vm.snapshot_full()
+    vm.kill()
+
+    for _, timings in microvm_factory.build_n_from_snapshot_parallel(
+        snapshot, perf_iterations(ITERATIONS), concurrency=concurrency
+    ):
+        metrics.put_metric("spawn", timings.spawn * 1000, "Milliseconds")
+        metrics.put_metric(
+            "load_snapshot", timings.load_snapshot * 1000, "Milliseconds"
+        )
+        metrics.put_metric("resume", timings.resume * 1000, "Milliseconds")
+        # Only measured if the microVM has a network interface
+        if timings.first_ssh is not None:
+            metrics.put_metric("first_ssh", timings.first_ssh * 1000, "Milliseconds")
 
 
 # When using the fault-all handler, all guest memory will be faulted in way before the helper tool
@@ -148,6 +192,7 @@ def test_post_restore_latency(
     metrics,
     uffd_handler,
     huge_pages,
+    perf_iterations,
 ):
     """Collects latency metric of post-restore memory accesses done inside the guest"""
     if huge_pages != HugePagesConfig.NONE and uffd_handler is None:
@@ -180,7 +225,7 @@ def test_post_restore_latency(
     vm.kill()
 
     for microvm in microvm_factory.build_n_from_snapshot(
-        snapshot, ITERATIONS, uffd_handler_name=uffd_handler
+        snapshot, perf_iterations(ITERATIONS), uffd_handler_name=uffd_handler
     ):
         _, pid, _ = microvm.ssh.check_output("pidof fast_page_fault_helper")
 
@@ -206,6 +251,7 @@ def test_population_latency(
     huge_pages,
     vcpus,
     mem,
+    perf_iterations,
 ):
     """Collects population latency metrics (e.g. how long it takes UFFD handler to fault in all memory)"""
     test_setup = SnapshotRestoreTest(mem=mem, vcpus=vcpus, huge_pages=huge_pages)
@@ -228,7 +274,7 @@ def test_population_latency(
     vm.kill()
 
     for microvm in microvm_factory.build_n_from_snapshot(
-        snapshot, ITERATIONS, uffd_handler_name="fault_all"
+        snapshot, perf_iterations(ITERATIONS), uffd_handler_name="fault_all"
     ):
         # do _something_ to trigger a pagefault, which will then cause the UFFD handler to fault in _everything_
         microvm.ssh.check_output("true")
@@ -256,6 +302,7 @@ def test_snapshot_create_latency(
     guest_kernel_linux_5_10,
     rootfs,
     metrics,
+    perf_iterations,
 ):
     """Measure the latency of creating a Full snapshot"""
 
@@ -269,7 +316,7 @@ def test_snapshot_create_latency(
         {**vm.dimensions, "performance_test": "test_snapshot_create_latency"}
     )
 
-    for _ in range(ITERATIONS):
+    for _ in range(perf_iterations(ITERATIONS)):
         vm.snapshot_full()
         fc_metrics = vm.flush_metrics()
 
@@ -2,6 +2,7 @@
 # SPDX-License-Identifier: Apache-2.0
 """Tests to collect Firecracker metrics for vhost-user devices."""
 
+import os
 import time
 
 import pytest
@@ -34,7 +35,7 @@ def test_vhost_user_block_metrics(
     vm.add_net_iface()
 
     # Add a block device to test resizing.
-    fs = drive_tools.FilesystemFile(size=orig_size)
+    fs = drive_tools.FilesystemFile(os.path.join(vm.fsfiles, "scratch"), orig_size)
     vm.add_vhost_user_drive("scratch", fs.path)
     vm.start()
 
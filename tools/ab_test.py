@@ -26,14 +26,16 @@ import os
 import statistics
 import subprocess
 import sys
+import zlib
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
 # Hack to be able to use our test framework code
 sys.path.append(str(Path(__file__).parent.parent / "tests"))
 
 # pylint:disable=wrong-import-position
-from framework.ab_test import binary_ab_test, check_regression
+from framework.ab_test import binary_ab_test, check_equivalence, check_regression
 from framework.properties import global_props
 from host_tools.metrics import (
     emit_raw_emf,
@@ -113,13 +115,18 @@ def find_unit(emf: dict, metric: str):
     return metrics.get(metric, "None")
 
 
-def load_data_series(report_path: Path, tag=None, *, reemit: bool = False):
+def load_data_series(
+    report_path: Path, tag=None, *, reemit: bool = False, revision=None
+):
     """Loads the data series relevant for A/B-testing from test_results/test-report.json
     into a dictionary mapping each message's cloudwatch dimensions to a dictionary of
     its list-valued properties/metrics.
 
     If `reemit` is True, it also reemits all EMF logs to a local EMF agent,
-    overwriting the attached "git_commit_id" field with the given revision."""
+    overwriting the attached "git_commit_id" field with the given revision.
+
+    If `revision` is given, only EMF logs of tests run with this revision's binaries
+    in an interleaved A/B-test (see `collect_interleaved_data`) are loaded."""
     # Dictionary mapping EMF dimensions to A/B-testable metrics/properties
     processed_emf = {}
 
@@ -131,6 +138,9 @@ def load_data_series(report_path: Path, tag=None, *, reemit: bool = False):
             if line.startswith("{"):
                 emf = json.loads(line)
 
+                if revision is not None and emf.get("ab_revision") != revision:
+                    continue
+
                 if reemit:
                     assert tag is not None
 
@@ -161,6 +171,45 @@ def load_data_series(report_path: Path, tag=None, *, reemit: bool = False):
     return processed_emf
 
 
+def load_pair_deltas(report_path: Path):
+    """Loads the differences between the B and A run of each pair of runs of a test in
+    an interleaved A/B-test (see `collect_interleaved_data`).
+
+    Returns a dictionary mapping (dimensions, metric) to the list of differences of the
+    mean of the metric in the B run and that in the A run, one for each pair of runs."""
+    # (dimensions, metric) -> revision -> means of the metric in each run
+    means = defaultdict(lambda: {"A": [], "B": []})
+
+    report = json.loads(report_path.read_text("UTF-8"))
+    for test in report["tests"]:
+        samples = defaultdict(list)
+        for line in test["teardown"]["stdout"].splitlines():
+            if not line.startswith("{"):
+                continue
+
+            emf = json.loads(line)
+            revision = emf.get("ab_revision")
+            if revision not in ["A", "B"]:
+                continue
+
+            dimensions, result = process_log_entry(emf)
+            if not dimensions:
+                continue
+
+            for metric, (values, _) in result.items():
+                samples[frozenset(dimensions.items()), metric, revision].extend(values)
+
+        for (dimension_set, metric, revision), values in samples.items():
+            means[dimension_set, metric][revision].append(statistics.mean(values))
+
+    # Both runs of a pair are adjacent in the session, so the n-th A run
+    # pairs up with the n-th B run
+    return {
+        key: [mean_b - mean_a for mean_a, mean_b in zip(runs["A"], runs["B"])]
+        for key, runs in means.items()
+    }
+
+
 def uninteresting_dimensions(processed_emf):
     """
     Computes the set of cloudwatch dimensions that only ever take on a
@@ -204,6 +253,60 @@ def collect_data(tag: str, binary_dir: Path, pytest_opts: str):
     return load_data_series(Path(test_report_path), binary_dir, reemit=True)
 
 
+def regression_seed(seed: int, dimension_set, metric) -> int:
+    """Derives a seed for the regression test of a single metric that only depends on `seed`, the dimensions and
+    the metric (and not, e.g., on the order in which metrics are tested)"""
+    key = json.dumps([seed, sorted(dimension_set, key=str), metric], default=str)
+    return zlib.crc32(key.encode("utf-8"))
+
+
+def _check_regression(args):
+    """Runs `check_regression` in a worker process of `analyze_data`"""
+    values_a, values_b, n_resamples, seed = args
+    return check_regression(values_a, values_b, n_resamples=n_resamples, seed=seed)
+
+
+def collect_interleaved_data(a_directory: Path, b_directory: Path, pytest_opts: str):
+    """
+    Executes the specified test in a single pytest session, running each test with
+    the binaries from both directories interleaved in ABBA order, and stores
+    results into the `test_results/AB` directory.
+
+    Also exports the differences between the paired A and B runs into
+    `test_results/AB/pair_deltas.json`, for paired statistics.
+    """
+    a_directory = a_directory.resolve()
+    b_directory = b_directory.resolve()
+
+    print(f"Collecting interleaved samples with {a_directory} and {b_directory}")
+    test_report_path = Path("test_results/AB/test-report.json")
+    subprocess.run(
+        f"./tools/test.sh --ab-binary-dirs {a_directory} {b_directory} {pytest_opts} -m '' --json-report-file=../{test_report_path}",
+        env=os.environ
+        | {
+            "AWS_EMF_ENVIRONMENT": "local",
+            "AWS_EMF_NAMESPACE": "local",
+        },
+        check=True,
+        shell=True,
+    )
+
+    pair_deltas = [
+        {"dimensions": dict(dimension_set), "metric": metric, "deltas": deltas}
+        for (dimension_set, metric), deltas in load_pair_deltas(
+            test_report_path
+        ).items()
+    ]
+    test_report_path.with_name("pair_deltas.json").write_text(
+        json.dumps(pair_deltas, indent=2), encoding="UTF-8"
+    )
+
+    return (
+        load_data_series(test_report_path, a_directory, reemit=True, revision="A"),
+        load_data_series(test_report_path, b_directory, reemit=True, revision="B"),
+    )
+
+
 def analyze_data(
     processed_emf_a,
     processed_emf_b,
@@ -212,11 +315,18 @@ def analyze_data(
     noise_threshold,
     *,
     n_resamples: int = 9999,
+    seed: int = 0,
+    jobs=None,
 ):
     """
     Analyzes the A/B-test data produced by `collect_data`, by performing regression tests
     as described this script's doc-comment.
 
+    The regression tests of all (dimension set, metric) pairs are independent, and run
+    in parallel in up to `jobs` (default: number of CPUs) processes. Each is seeded
+    deterministically based on `seed`, so that repeated analyses of the same data
+    produce the same results.
+
     Returns a mapping of dimensions and properties/metrics to the result of their regression test.
     """
     assert set(processed_emf_a.keys()) == set(
@@ -230,6 +340,7 @@ def analyze_data(
     for prop_name, prop_val in global_props.__dict__.items():
         metrics_logger.set_property(prop_name, prop_val)
 
+    tests = []
     for dimension_set in processed_emf_a:
         metrics_a = processed_emf_a[dimension_set]
         metrics_b = processed_emf_b[dimension_set]
@@ -239,15 +350,30 @@ def analyze_data(
         ), "A and B run produced incomparable data. This is a bug in the test!"
 
         for metric, (values_a, unit) in metrics_a.items():
-            result = check_regression(
-                values_a, metrics_b[metric][0], n_resamples=n_resamples
-            )
+            tests.append((dimension_set, metric, values_a, metrics_b[metric][0], unit))
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        regressions = executor.map(
+            _check_regression,
+            [
+                (
+                    values_a,
+                    values_b,
+                    n_resamples,
+                    regression_seed(seed, dimension_set, metric),
+                )
+                for dimension_set, metric, values_a, values_b, _ in tests
+            ],
+        )
 
+        for (dimension_set, metric, values_a, values_b, unit), result in zip(
+            tests, regressions
+        ):
             metrics_logger.set_dimensions({"metric": metric, **dict(dimension_set)})
             metrics_logger.put_metric("p_value", float(result.pvalue), "None")
             metrics_logger.put_metric("mean_difference", float(result.statistic), unit)
             metrics_logger.set_property("data_a", values_a)
-            metrics_logger.set_property("data_b", metrics_b[metric][0])
+            metrics_logger.set_property("data_b", values_b)
             metrics_logger.flush()
 
             results[dimension_set, metric] = (result, unit)
@@ -346,6 +472,9 @@ def ab_performance_test(
     p_thresh,
     strength_abs_thresh,
     noise_threshold,
+    *,
+    seed: int = 0,
+    jobs=None,
 ):
     """Does an A/B-test of the specified test with the given firecracker/jailer binaries"""
 
@@ -358,12 +487,172 @@ def ab_performance_test(
             strength_abs_thresh,
             noise_threshold,
             n_resamples=int(100 / p_thresh),
+            seed=seed,
+            jobs=jobs,
         ),
         a_directory=a_revision,
         b_directory=b_revision,
     )
 
 
+def ab_interleaved_performance_test(
+    a_revision: Path,
+    b_revision: Path,
+    pytest_opts,
+    p_thresh,
+    strength_abs_thresh,
+    noise_threshold,
+    *,
+    seed: int = 0,
+    jobs=None,
+):
+    """Does an A/B-test of the specified test with the given firecracker/jailer binaries, running
+    the A and B runs of each test interleaved in a single pytest session"""
+    data_a, data_b = collect_interleaved_data(a_revision, b_revision, pytest_opts)
+
+    return analyze_data(
+        data_a,
+        data_b,
+        p_thresh,
+        strength_abs_thresh,
+        noise_threshold,
+        n_resamples=int(100 / p_thresh),
+        seed=seed,
+        jobs=jobs,
+    )
+
+
+def merge_data_series(processed_emf, new_emf):
+    """Appends the samples of `new_emf` to those in `processed_emf` (both as returned by `load_data_series`)"""
+    for dimension_set, metrics in new_emf.items():
+        existing = processed_emf.setdefault(dimension_set, {})
+        for metric, (values, unit) in metrics.items():
+            existing.setdefault(metric, ([], unit))[0].extend(values)
+
+
+def _sequential_decision(args):
+    """Decides whether the samples collected so far show a regression ("regression"), rule one
+    out ("no_regression"), or whether we need more samples (None)"""
+    values_a, values_b, alpha, strength_abs_thresh, noise_threshold, seed = args
+
+    result = check_regression(
+        values_a, values_b, n_resamples=int(100 / alpha), seed=seed
+    )
+    baseline_mean = statistics.mean(values_a)
+
+    if (
+        result.pvalue < alpha
+        and abs(result.statistic) > strength_abs_thresh
+        and abs(result.statistic / baseline_mean) > noise_threshold
+    ):
+        return "regression"
+
+    margin = max(noise_threshold * abs(baseline_mean), strength_abs_thresh)
+    if check_equivalence(values_a, values_b, margin, alpha=alpha):
+        return "no_regression"
+
+    return None
+
+
+def ab_sequential_performance_test(
+    a_revision: Path,
+    b_revision: Path,
+    pytest_opts,
+    p_thresh,
+    strength_abs_thresh,
+    noise_threshold,
+    *,
+    max_rounds: int = 6,
+    seed: int = 0,
+    jobs=None,
+):
+    """Does an A/B-test of the specified test with the given firecracker/jailer binaries, stopping early
+    once the data is conclusive.
+
+    Instead of running the test once per binary, it is run in up to `max_rounds` rounds, each running the
+    test for both binaries (alternating which goes first). Each round passes `--ab-rounds` to pytest, so
+    that performance tests using the `perf_iterations` fixture only do `1 / max_rounds` of their usual
+    iterations per round, and all rounds together collect as many samples as a non-sequential A/B-test.
+    Tests that do not use it are run in full every round, and gain nothing from this mode.
+
+    After each round, every metric is tested both for a regression and for equivalence (no change larger
+    than the noise threshold). Once every metric is decided one way or the other, no further rounds are
+    run, and the collected data is analyzed as usual.
+
+    To account for looking at the data up to `max_rounds` times, each look (and the final analysis) uses
+    a significance level of `p_thresh / max_rounds` (Bonferroni correction), which keeps the overall false
+    positive rate below `p_thresh`.
+    """
+    alpha = p_thresh / max_rounds
+    pytest_opts = f"{pytest_opts} --ab-rounds={max_rounds}"
+    data_a, data_b = {}, {}
+    decisions = {}
+
+    for round_idx in range(max_rounds):
+        runs = [("A", a_revision, data_a), ("B", b_revision, data_b)]
+        if round_idx % 2:
+            runs.reverse()
+        for tag, binary_dir, data in runs:
+            merge_data_series(
+                data, collect_data(f"{tag}{round_idx}", binary_dir, pytest_opts)
+            )
+
+        undecided = [
+            (dimension_set, metric)
+            for dimension_set, metrics in data_a.items()
+            for metric in metrics
+            if decisions.get((dimension_set, metric)) is None
+            and not is_ignored(dict(dimension_set) | {"metric": metric})
+        ]
+
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            new_decisions = executor.map(
+                _sequential_decision,
+                [
+                    (
+                        data_a[dimension_set][metric][0],
+                        data_b[dimension_set][metric][0],
+                        alpha,
+                        strength_abs_thresh,
+                        noise_threshold,
+                        regression_seed(seed, dimension_set, metric),
+                    )
+                    for dimension_set, metric in undecided
+                ],
+            )
+            for key, decision in zip(undecided, new_decisions):
+                if decision is not None:
+                    decisions[key] = decision
+
+        nr_undecided = sum(decisions.get(key) is None for key in undecided)
+        print(
+            f"Round {round_idx + 1}/{max_rounds}: {nr_undecided} metrics still undecided"
+        )
+
+        for (dimension_set, metric), decision in decisions.items():
+            if (dimension_set, metric) in undecided:
+                samples = len(data_a[dimension_set][metric][0]) + len(
+                    data_b[dimension_set][metric][0]
+                )
+                print(
+                    f"Decided {decision} for {metric} in {dict(dimension_set)} after {samples} samples"
+                )
+
+        if not nr_undecided:
+            break
+
+    return analyze_data(
+        data_a,
+        data_b,
+        alpha,
+        strength_abs_thresh,
+        noise_threshold,
+        n_resamples=int(100 / alpha),
+        seed=seed,
+        jobs=jobs,
+    )
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         description="Executes Firecracker's A/B testsuite across the specified commits"
@@ -388,6 +677,23 @@ if __name__ == "__main__":
         help="Parameters to pass through to pytest, for example for test selection",
         required=True,
     )
+    mode_group = run_parser.add_mutually_exclusive_group()
+    mode_group.add_argument(
+        "--sequential",
+        help="Run the test in rounds, stopping as soon as every metric either shows a regression or is ruled out to have regressed",
+        action="store_true",
+    )
+    mode_group.add_argument(
+        "--interleaved",
+        help="Run the A and B runs of each test interleaved (in ABBA order) in a single pytest session",
+        action="store_true",
+    )
+    run_parser.add_argument(
+        "--max-rounds",
+        help="The maximum number of rounds to run in sequential mode",
+        type=int,
+        default=6,
+    )
     analyze_parser = subparsers.add_parser(
         "analyze",
         help="Analyze the results of two manually ran tests based on their test-report.json files",
@@ -420,9 +726,44 @@ if __name__ == "__main__":
         type=float,
         default=0.05,
     )
+    parser.add_argument(
+        "--seed",
+        help="Seed for the permutation tests, to make their results reproducible",
+        type=int,
+        default=0,
+    )
+    parser.add_argument(
+        "--jobs",
+        help="The number of processes to run permutation tests in. Defaults to the number of CPUs",
+        type=int,
+        default=None,
+    )
     args = parser.parse_args()
 
-    if args.command == "run":
+    if args.command == "run" and args.sequential:
+        ab_sequential_performance_test(
+            args.a_revision,
+            args.b_revision,
+            args.pytest_opts,
+            args.significance,
+            args.absolute_strength,
+            args.noise_threshold,
+            max_rounds=args.max_rounds,
+            seed=args.seed,
+            jobs=args.jobs,
+        )
+    elif args.command == "run" and args.interleaved:
+        ab_interleaved_performance_test(
+            args.a_revision,
+            args.b_revision,
+            args.pytest_opts,
+            args.significance,
+            args.absolute_strength,
+            args.noise_threshold,
+            seed=args.seed,
+            jobs=args.jobs,
+        )
+    elif args.command == "run":
         ab_performance_test(
             args.a_revision,
             args.b_revision,
@@ -430,6 +771,8 @@ if __name__ == "__main__":
             args.significance,
             args.absolute_strength,
             args.noise_threshold,
+            seed=args.seed,
+            jobs=args.jobs,
         )
     else:
         data_a = load_data_series(args.report_a)
@@ -441,4 +784,6 @@ if __name__ == "__main__":
             args.significance,
             args.absolute_strength,
             args.noise_threshold,
+            seed=args.seed,
+            jobs=args.jobs,
         )